@@ -3,6 +3,16 @@
 # Licensed under the Apache License, Version 2.0
 # See LICENSE file for details.
 
-from connectorError import response_codes
+from connectorError import response_codes, connectorException
 from mbed_connector_api import asyncResult
 from mbed_connector_api import connector
+from asyncConnector import asyncConnector
+from resourceCache import resourceCache
+from endpointDirectory import endpointDirectory
+from notificationEvents import notificationEvent, registrationEvent, asyncResponseEvent
+from reconnectPolicy import reconnectPolicy
+from callbackReceiver import callbackReceiver
+from rateLimiter import rateLimiter
+from retryPolicy import retryPolicy
+from preSubscriptionRules import preSubscriptionRules
+from metrics import metrics
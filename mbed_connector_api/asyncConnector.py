@@ -0,0 +1,90 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+from mbed_connector_api import connector
+
+class asyncConnector(connector):
+	"""
+	Non-blocking version of :class:`.connector`. Every public REST method has the same name and
+	arguments as on :class:`.connector` but returns its :class:`.asyncResult` immediately, the HTTP
+	request is run on a pool of worker threads and fills in that same object when it completes.
+	202 responses are resolved into the same object by the long poll as well, so check ``.isDone()``
+	or pass a callback exactly as with :class:`.connector`.
+	Long polling runs as a repeating task on the worker pool instead of a dedicated thread.
+	"""
+
+	# this function needs to keep a pull outstanding on the worker pool
+	def startLongPolling(self, noWait=False, pipelined=False, pipelineDepth=8):
+		'''
+		Start LongPolling Connector for notifications. Each pull runs as a task on the worker pool
+		and queues the next pull when it returns. In pipelined mode the task only pulls and the
+		pulled data is parsed and dispatched on a separate thread, see ``pipelineStats``.
+
+		:param bool noWait: Optional - use the cached values in connector, do not wait for the device to respond
+		:param bool pipelined: Optional - pull and dispatch on separate threads
+		:param int pipelineDepth: Optional - pulled bodies that may wait for dispatch before pulling pauses
+		:return: none
+		'''
+		with self._pollLock:
+			if self._pollActive:
+				self.log.warn("LongPolling is already active.")
+				return
+			# a pull still running from before the last stop belongs to an older generation and is not requeued
+			self._pollGeneration += 1
+			generation = self._pollGeneration
+			self._stopLongPolling.clear()
+			self._pollActive = True
+			if pipelined:
+				self._startPipeline(pipelineDepth)
+		self._executor.submit(self._pollTask,generation)
+		self.log.info("Queued LongPolling task")
+
+	# stop longpolling by switching the flag off, the running pull finishes and is not requeued
+	def stopLongPolling(self):
+		'''
+		Stop LongPolling task
+
+		:return: none
+		'''
+		with self._pollLock:
+			if not self._pollActive:
+				self.log.warn("LongPolling task already stopped")
+				return
+			self._pollGeneration += 1 # the running pull, if any, is not requeued
+			self._pollActive = False
+			self._stopLongPolling.set()
+			if self._pollTimer is not None:
+				# waiting out a backoff, no task will run to notice the flag
+				self._pollTimer.cancel()
+				self._pollTimer = None
+			self._stopPipeline()
+		self.log.debug("set stop longpolling flag")
+
+	# one pull per task, requeue until stopLongPolling is called.
+	# After a failed pull the next task is queued by a timer so no worker sits out the backoff
+	def _pollTask(self,generation):
+		with self._pollLock:
+			if generation != self._pollGeneration:
+				return
+		delay = self._pollOnce()
+		with self._pollLock:
+			if generation != self._pollGeneration:
+				self.log.info("Killing Longpolling task")
+				return
+			self._pollTimer = None
+			if delay:
+				self._pollTimer = threading.Timer(delay,self._executor.submit,(self._pollTask,generation))
+				self._pollTimer.daemon = True
+				self._pollTimer.start()
+				return
+		self._executor.submit(self._pollTask,generation)
+
+	# other keyword arguments are passed on to connector
+	def __init__(self,token,webAddress="https://api.connector.mbed.com",port="80",poolSize=10,workers=8,**kwargs):
+		connector.__init__(self,token,webAddress=webAddress,port=port,poolSize=poolSize,executor=workers,**kwargs)
+		self._pollLock = threading.Lock()
+		self._pollActive = False
+		self._pollGeneration = 0 # bumped by every start and stop, poll tasks of an older generation exit
+		self._pollTimer = None
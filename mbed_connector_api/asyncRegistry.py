@@ -0,0 +1,271 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import time
+import sys
+import traceback
+import logging
+from collections import OrderedDict
+from connectorError import response_codes
+
+class _stripe:
+	"""One shard of an asyncRegistry, with its own lock"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.entries = OrderedDict() # async-response id : (expiry time, asyncResult)
+		self.early = OrderedDict() # async-response id : (expiry time, async-response entry)
+
+class asyncRegistry:
+	"""
+	Thread safe store of :class:`.asyncResult` objects waiting for an async-response id, used as ``connector.database['async-responses']``.
+	Ids are spread over ``stripes`` independently locked shards so callers registering 202 responses
+	and the long poll resolving them do not serialize on one lock.
+
+	Entries that are not answered within ``ttl`` seconds, or that are pushed out because more than ``maxSize``
+	entries are pending, are completed with an error and their callback is called.
+	Responses that arrive before their id has been registered are held for ``earlyTTL`` seconds and
+	handed to ``resolver`` as soon as the id is registered.
+
+	:var ttl: seconds an entry may wait for its async-response
+	:var maxSize: maximum number of pending entries
+	"""
+
+	def register(self,asyncID,result):
+		"""
+		Add an asyncResult waiting on ``asyncID``. If the response already arrived it is resolved right away.
+
+		:param str asyncID: async-response id returned by connector
+		:param asyncResult result: object to fill in when the response arrives
+		:return: none
+		"""
+		stripe = self._stripe(asyncID)
+		added = 0
+		expires = time.time()+self.ttl
+		with stripe.lock:
+			early = stripe.early.pop(asyncID,None)
+			if early is None:
+				added = 0 if stripe.entries.pop(asyncID,None) else 1 # re-adding an id moves it to the back
+				stripe.entries[asyncID] = (expires,result)
+		with self._statsLock:
+			self._pending += added
+			if added:
+				self._nextDeadline = min(self._nextDeadline,expires)
+			overflow = self._pending > self.maxSize
+			if early is not None:
+				self.earlyMatched += 1
+		if early is not None:
+			try:
+				self.resolver(result,early[1])
+			except:
+				self.log.error("resolving held async-response '%s' threw an exception",asyncID)
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+		if overflow:
+			self._evictOldest()
+		self.sweepDue()
+
+	def resolve(self,asyncID,entry):
+		"""
+		Take the asyncResult waiting on ``asyncID`` out of the registry. If nothing is registered under
+		that id yet ``entry`` is held until it is, or until it expires.
+
+		:param str asyncID: async-response id
+		:param dict entry: async-response entry from the notification channel
+		:return: the waiting asyncResult, or None if the entry was held
+		:rtype: asyncResult
+		"""
+		stripe = self._stripe(asyncID)
+		dropped = 0
+		with stripe.lock:
+			waiting = stripe.entries.pop(asyncID,None)
+			if waiting is None:
+				expires = time.time()+self.earlyTTL
+				stripe.early.pop(asyncID,None)
+				stripe.early[asyncID] = (expires,entry)
+				while len(stripe.early) > self._earlySize:
+					stripe.early.popitem(last=False)
+					dropped += 1
+		with self._statsLock:
+			if waiting is not None:
+				self._pending -= 1
+			else:
+				self._nextDeadline = min(self._nextDeadline,expires)
+			self.unmatched += dropped
+		return waiting[1] if waiting is not None else None
+
+	# dict style access, kept so database['async-responses'] behaves as before
+	def __setitem__(self,asyncID,result):
+		self.register(asyncID,result)
+
+	def __getitem__(self,asyncID):
+		stripe = self._stripe(asyncID)
+		with stripe.lock:
+			return stripe.entries[asyncID][1]
+
+	def __contains__(self,asyncID):
+		stripe = self._stripe(asyncID)
+		with stripe.lock:
+			return asyncID in stripe.entries
+
+	def __len__(self):
+		with self._statsLock:
+			return self._pending
+
+	def keys(self):
+		keys = []
+		for stripe in self._stripes:
+			with stripe.lock:
+				keys.extend(stripe.entries.keys())
+		return keys
+
+	def pop(self,asyncID,*default):
+		stripe = self._stripe(asyncID)
+		with stripe.lock:
+			entry = stripe.entries.pop(asyncID,None)
+		if entry is not None:
+			with self._statsLock:
+				self._pending -= 1
+			return entry[1]
+		if default:
+			return default[0]
+		raise KeyError(asyncID)
+
+	def sweep(self):
+		"""
+		Complete every entry whose ttl has passed with an ``async_timeout`` error and drop expired early responses.
+		Called after every long poll, ``sweepDue`` runs it from inserts and callback notifications.
+
+		:return: number of entries expired
+		:rtype: int
+		"""
+		now = time.time()
+		expired = 0
+		nextDeadline = now+min(self.ttl,self.earlyTTL) # at the latest, in case an insert raced with this sweep
+		for stripe in self._stripes:
+			expired += self._sweepStripe(stripe)
+			with stripe.lock:
+				for entries in (stripe.entries,stripe.early):
+					if entries:
+						nextDeadline = min(nextDeadline,next(entries.itervalues())[0])
+		with self._statsLock:
+			self._nextDeadline = nextDeadline
+		return expired
+
+	def sweepDue(self):
+		"""
+		Run ``sweep`` if an entry may have expired since the last one. Cheap enough to call on every notification.
+
+		:return: number of entries expired
+		:rtype: int
+		"""
+		if time.time() < self._nextDeadline:
+			return 0
+		return self.sweep()
+
+	def stats(self):
+		"""
+		:return: dictionary with ``pending`` entries, ``evictions`` total, the ``expired`` / ``overflow`` breakdown,
+			``early`` responses held, ``earlyMatched`` responses matched after being held and ``unmatched`` responses dropped
+		:rtype: dict
+		"""
+		early = 0
+		for stripe in self._stripes:
+			with stripe.lock:
+				early += len(stripe.early)
+		with self._statsLock:
+			return {"pending":self._pending,
+					"evictions":self.expired+self.overflow,
+					"expired":self.expired,
+					"overflow":self.overflow,
+					"early":early,
+					"earlyMatched":self.earlyMatched,
+					"unmatched":self.unmatched}
+
+	def _stripe(self,asyncID):
+		return self._stripes[hash(asyncID) % len(self._stripes)]
+
+	def _sweepStripe(self,stripe):
+		now = time.time()
+		with stripe.lock:
+			# entries share one ttl, so insertion order is expiry order
+			expired = self._popExpired(stripe.entries,now)
+			dropped = self._popExpired(stripe.early,now)
+		with self._statsLock:
+			self._pending -= len(expired)
+			self.expired += len(expired)
+			self.unmatched += len(dropped)
+		for result in expired:
+			self._complete(result,"async_timeout")
+		return len(expired)
+
+	# drop the oldest entries across all stripes until no more than maxSize are pending.
+	# Only runs on overflow, so looking at the head of every stripe is fine here
+	def _evictOldest(self):
+		while True:
+			with self._statsLock:
+				if self._pending <= self.maxSize:
+					return
+			oldest = None
+			for stripe in self._stripes:
+				with stripe.lock:
+					if stripe.entries:
+						expires = next(stripe.entries.itervalues())[0]
+						if oldest is None or expires < oldest[0]:
+							oldest = (expires,stripe)
+			if oldest is None:
+				return
+			stripe = oldest[1]
+			with stripe.lock:
+				if not stripe.entries: # emptied since we looked
+					continue
+				result = stripe.entries.popitem(last=False)[1][1]
+			with self._statsLock:
+				self._pending -= 1
+				self.overflow += 1
+			self._complete(result,"async_evicted")
+
+	# remove and return the values of all entries that expired before now, caller holds the stripe lock
+	def _popExpired(self,entries,now):
+		expired = []
+		for key,(expires,value) in entries.iteritems():
+			if expires > now:
+				break
+			expired.append(key)
+		return [entries.pop(key)[1] for key in expired]
+
+	# finish an evicted asyncResult with an error
+	def _complete(self,result,errType):
+		result.error = response_codes(errType,"")
+		result.is_done = True
+		if result.callback:
+			try:
+				result.callback(result)
+			except:
+				self.log.error("callback for evicted async-response threw an exception")
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+
+	def __init__(self,resolver,ttl=300,maxSize=10000,stripes=16,earlyTTL=30):
+		'''
+		:param fnptr resolver: called as ``resolver(asyncResult, entry)`` when a held response is matched on register
+		'''
+		self.resolver = resolver
+		self.ttl = ttl
+		self.earlyTTL = earlyTTL
+		self.maxSize = maxSize
+		self.expired = 0
+		self.overflow = 0
+		self.earlyMatched = 0
+		self.unmatched = 0
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._statsLock = threading.Lock()
+		self._pending = 0
+		self._nextDeadline = float('inf') # earliest expiry of an entry or held response, at most one ttl ahead
+		self._stripes = [_stripe() for x in range(max(stripes,1))]
+		self._earlySize = max(maxSize//len(self._stripes),1) # early responses held per stripe
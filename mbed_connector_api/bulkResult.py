@@ -0,0 +1,138 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import Queue
+import time
+import sys
+import traceback
+import logging
+
+_fed = object() # queued by the feeder once it has stopped issuing
+
+class bulkResult:
+	"""
+	Iterator returned by bulk calls such as :func:`connector.getResourceValues`.
+	Iterating yields each :class:`.asyncResult` as soon as it completes, in completion order.
+	Iteration stops when every request has completed or the overall ``timeout`` has passed,
+	requests still outstanding at that point are counted as timeouts in ``.summary()``, as are
+	requests whose async-response never arrived. If issuing a request raises, the requests not
+	issued yet are counted as errors and iteration stops once the issued ones have completed.
+
+	:var total: number of requests in the bulk operation
+	:var error: exception raised while issuing requests, None if there was none
+	"""
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		while True:
+			if self._yielded + self._timedOut + self._notIssued >= self.total:
+				raise StopIteration
+			try:
+				if self._deadline is None:
+					result = self._queue.get()
+				else:
+					result = self._queue.get(True,max(self._deadline-time.time(),0))
+			except Queue.Empty:
+				# out of time, stop issuing and count everything not yielded yet as a timeout
+				self._stop.set()
+				self._timedOut = self.total - self._yielded - self._notIssued
+				raise StopIteration
+			if result is not _fed:
+				break
+			# the feeder stopped, nothing more will arrive for requests it did not issue
+			if not self._stop.is_set():
+				self._notIssued = self.total - self._issued
+		self._yielded += 1
+		if result.error and getattr(result.error,'errType',None) == "async_timeout":
+			self._asyncTimeouts += 1
+		elif result.error:
+			self._errors += 1
+		else:
+			self._successes += 1
+		return result
+
+	def summary(self):
+		"""
+		Aggregate outcome of the results iterated over so far.
+
+		:return: dictionary with ``total``, ``successes``, ``errors``, ``timeouts`` and ``pending`` counts
+		:rtype: dict
+		"""
+		return {"total":self.total,
+				"successes":self._successes,
+				"errors":self._errors+self._notIssued,
+				"timeouts":self._timedOut+self._asyncTimeouts,
+				"pending":self.total-self._yielded-self._timedOut-self._notIssued}
+
+	# issue one request per item, never more than `concurrency` incomplete at once
+	def _feed(self,items,issue):
+		try:
+			for item in items:
+				self._slots.acquire()
+				if self._stop.is_set():
+					return
+				result = issue(item)
+				self._issued += 1
+				result.add_done_callback(self._complete)
+		except Exception as e:
+			self.error = e
+			self.log.error("bulk request could not be issued, %d of %d sent : %s",self._issued,self.total,str(e))
+			ex_type, ex, tb = sys.exc_info()
+			traceback.print_tb(tb)
+			del tb
+		finally:
+			self._queue.put(_fed) # wakes the iterator even if nothing else will arrive
+			with self._lock:
+				self._fedAll = True
+				finished = self._completed == self._issued
+			if finished:
+				self._finish()
+
+	def _complete(self,result):
+		self._slots.release()
+		self._queue.put(result)
+		with self._lock:
+			self._completed += 1
+			finished = self._fedAll and self._completed == self._issued
+		if finished:
+			self._finish()
+
+	# every issued request has completed, nothing is left for the done function's resources
+	def _finish(self):
+		if self._done:
+			self._done()
+
+	def __init__(self,items,issue,concurrency=10,timeout=None,done=None):
+		'''
+		:param list items: items to issue
+		:param fnptr issue: function called with each item, returns an asyncResult
+		:param int concurrency: maximum number of incomplete requests at any time
+		:param float timeout: Optional - overall seconds to wait for results
+		:param fnptr done: Optional - called once every item has been issued and every issued request has completed
+		'''
+		items = list(items)
+		self.total = len(items)
+		self._queue = Queue.Queue()
+		self._slots = threading.Semaphore(max(concurrency,1))
+		self._stop = threading.Event()
+		self._deadline = time.time()+timeout if timeout is not None else None
+		self.error = None
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._lock = threading.Lock()
+		self._done = done
+		self._fedAll = False
+		self._issued = 0
+		self._completed = 0
+		self._notIssued = 0
+		self._yielded = 0
+		self._successes = 0
+		self._errors = 0
+		self._timedOut = 0 # not yielded when the overall timeout passed
+		self._asyncTimeouts = 0 # yielded with an async_timeout error
+		self._feeder = threading.Thread(target=self._feed,args=(items,issue),name="mdc-api-bulk")
+		self._feeder.daemon = True
+		self._feeder.start()
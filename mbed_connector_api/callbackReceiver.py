@@ -0,0 +1,187 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import Queue
+import SocketServer
+import time
+import sys
+import traceback
+import logging
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+class _threadingWSGIServer(SocketServer.ThreadingMixIn,WSGIServer):
+	daemon_threads = True
+
+class _quietHandler(WSGIRequestHandler):
+	def log_message(self,format,*args):
+		logging.getLogger(name="mdc-api-logger").debug("callbackReceiver : "+format,*args)
+
+class callbackReceiver:
+	"""
+	Receiver for the notifications connector sends to the callback URL set with ``putCallback``.
+	Each delivery is queued and acknowledged at once with 204 No Content, worker threads then pass the
+	bodies to ``connector.handler`` so connector never waits on the callbacks. When ``maxQueue`` bodies are
+	waiting further deliveries are refused with 503 so connector sends them again later.
+
+	Use ``start`` to serve with the bundled threaded HTTP server, or mount ``wsgiApp`` in any WSGI server.
+	Bodies are processed in arrival order with the default single worker, use more workers only if
+	callbacks do not depend on the order of deliveries.
+
+	:var url: address of the bundled server once started
+	"""
+
+	def wsgiApp(self,environ,start_response):
+		'''
+		WSGI application accepting PUT and POST deliveries from connector.
+		'''
+		start = time.time()
+		method = environ.get('REQUEST_METHOD','')
+		if method not in ('PUT','POST'):
+			start_response("405 Method Not Allowed",[("Allow","PUT, POST"),("Content-Length","0")])
+			return [""]
+		if environ.get('PATH_INFO','/') != self.path:
+			start_response("404 Not Found",[("Content-Length","0")])
+			return [""]
+		try:
+			length = int(environ.get('CONTENT_LENGTH') or 0)
+		except ValueError:
+			length = 0
+		body = environ['wsgi.input'].read(length) if length > 0 else ""
+		received = time.time()
+		try:
+			self._queue.put_nowait((received,body))
+		except Queue.Full:
+			with self._lock:
+				self._rejected += 1
+			start_response("503 Service Unavailable",[("Retry-After","1"),("Content-Length","0")])
+			return [""]
+		with self._lock:
+			self._received += 1
+			self._totalReceive += received-start
+			self._maxReceive = max(self._maxReceive,received-start)
+			self._maxQueued = max(self._maxQueued,self._queue.qsize())
+			ack = time.time()-start
+			self._totalAck += ack
+			self._maxAck = max(self._maxAck,ack)
+		start_response("204 No Content",[])
+		return [""]
+
+	def start(self):
+		'''
+		Serve ``wsgiApp`` on ``host``:``port`` from a background thread, one thread per connection.
+
+		:return: the URL to pass to ``putCallback``
+		:rtype: str
+		'''
+		self._server = make_server(self.host,self.port,self.wsgiApp,server_class=_threadingWSGIServer,handler_class=_quietHandler)
+		self.port = self._server.server_port
+		self.url = "http://%s:%d%s" % (self.host,self.port,self.path)
+		self._serverThread = threading.Thread(target=self._server.serve_forever,name="mdc-api-callback-server")
+		self._serverThread.daemon = True
+		self._serverThread.start()
+		self.log.info("callbackReceiver listening on %s",self.url)
+		return self.url
+
+	def stop(self,wait=True):
+		'''
+		Stop the bundled server and the workers, after the queued bodies have been processed.
+
+		:param bool wait: Optional - block until the workers have exited
+		:return: none
+		'''
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+		for t in self._workers:
+			self._queue.put(None)
+		if wait:
+			for t in self._workers:
+				t.join()
+
+	def stats(self):
+		'''
+		:return: dictionary with ``received``, ``rejected``, ``processed`` and ``queued`` counts, ``maxQueued``,
+			and average / maximum seconds for ``receive`` (reading the body), ``ack`` (request start to response),
+			``queueLag`` (ack to processing start) and ``processing`` (time in ``connector.handler``)
+		:rtype: dict
+		'''
+		with self._lock:
+			def avg(total,count):
+				return total/count if count else 0.0
+			return {"received":self._received,
+					"rejected":self._rejected,
+					"processed":self._processed,
+					"queued":self._queue.qsize(),
+					"maxQueued":self._maxQueued,
+					"avgReceive":avg(self._totalReceive,self._received),
+					"maxReceive":self._maxReceive,
+					"avgAck":avg(self._totalAck,self._received),
+					"maxAck":self._maxAck,
+					"avgQueueLag":avg(self._totalLag,self._processed),
+					"maxQueueLag":self._maxLag,
+					"avgProcessing":avg(self._totalProcessing,self._processed),
+					"maxProcessing":self._maxProcessing}
+
+	def _work(self):
+		while True:
+			task = self._queue.get()
+			if task is None:
+				return
+			received,body = task
+			started = time.time()
+			try:
+				self.connector.handler(body)
+			except:
+				self.log.error("callbackReceiver handler threw an exception")
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+			done = time.time()
+			with self._lock:
+				self._processed += 1
+				self._totalLag += started-received
+				self._maxLag = max(self._maxLag,started-received)
+				self._totalProcessing += done-started
+				self._maxProcessing = max(self._maxProcessing,done-started)
+
+	def __init__(self,connector,host="0.0.0.0",port=8080,path="/",workers=1,maxQueue=10000):
+		'''
+		:param connector connector: connector whose ``handler`` processes the deliveries
+		:param str host: Optional - address the bundled server listens on
+		:param int port: Optional - port the bundled server listens on, 0 picks a free port
+		:param str path: Optional - path connector posts to
+		:param int workers: Optional - threads passing bodies to ``connector.handler``
+		:param int maxQueue: Optional - bodies that may wait for processing before deliveries are refused
+		'''
+		self.connector = connector
+		self.host = host
+		self.port = port
+		self.path = path
+		self.url = None
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._server = None
+		self._serverThread = None
+		self._lock = threading.Lock()
+		self._received = 0
+		self._rejected = 0
+		self._processed = 0
+		self._maxQueued = 0
+		self._totalReceive = 0.0
+		self._maxReceive = 0.0
+		self._totalAck = 0.0
+		self._maxAck = 0.0
+		self._totalLag = 0.0
+		self._maxLag = 0.0
+		self._totalProcessing = 0.0
+		self._maxProcessing = 0.0
+		self._queue = Queue.Queue(maxsize=maxQueue)
+		self._workers = []
+		for x in range(max(workers,1)):
+			t = threading.Thread(target=self._work,name="mdc-api-callback-"+str(x))
+			t.daemon = True
+			t.start()
+			self._workers.append(t)
@@ -0,0 +1,100 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import json
+import re
+
+# JSON backends in order of preference, the first one that imports is used.
+# orjson and ujson are optional, install one of them for faster parsing of large responses.
+_backends = {}
+try:
+	import orjson
+	_backends['orjson'] = (orjson.loads,orjson.dumps)
+except ImportError:
+	pass
+try:
+	import ujson
+	_backends['ujson'] = (ujson.loads,ujson.dumps)
+except ImportError:
+	pass
+_backends['json'] = (json.loads,json.dumps)
+
+backend = None
+loads = None
+dumps = None
+
+def setBackend(name=None):
+	"""
+	Choose the JSON library used by the package.
+
+	:param str name: Optional - 'orjson', 'ujson' or 'json', the fastest one installed if not given
+	:return: name of the backend now in use
+	:rtype: str
+	:raises ValueError: if the named backend is not installed
+	"""
+	global backend, loads, dumps
+	if name is None:
+		name = next(n for n in ('orjson','ujson','json') if n in _backends)
+	if name not in _backends:
+		raise ValueError("JSON backend '%s' is not installed" % name)
+	loads,dumps = _backends[name]
+	backend = name
+	return name
+
+setBackend()
+
+def isJSONType(contentType):
+	"""
+	:param str contentType: value of a Content-Type header
+	:return: True for application/json and +json media types
+	:rtype: bool
+	"""
+	if not contentType:
+		return False
+	media = contentType.split(";",1)[0].strip().lower()
+	return media == "application/json" or media.endswith("+json")
+
+# first non-blank character of a body, bodies without a Content-Type are only parsed if it can start a JSON value
+_firstChar = re.compile(r"\s*(\S)")
+_jsonStart = frozenset('{["-0123456789tfn')
+
+def decode(content,contentType=None):
+	"""
+	Decode a response body according to its Content-Type. JSON media types are parsed, and so are bodies
+	without a Content-Type or with a text one when they are valid JSON, so a plain text ``42`` is still
+	returned as the number 42 as it always was. Text that cannot start a JSON value is returned without
+	being handed to the parser. Bodies of any other media type are returned as they are.
+
+	:param str content: the response body
+	:param str contentType: Optional - value of the Content-Type header
+	:return: the parsed JSON value, or ``content`` if the body is not JSON
+	"""
+	if isinstance(content,basestring) and content:
+		if isJSONType(contentType):
+			try:
+				return loads(content)
+			except ValueError:
+				return content
+		media = contentType.split(";",1)[0].strip().lower() if contentType else ""
+		if not media or media.startswith("text/"):
+			first = _firstChar.match(content)
+			if first is None or first.group(1) not in _jsonStart:
+				return content
+			try:
+				return loads(content)
+			except ValueError:
+				return content
+	return content
+
+def encode(obj):
+	"""
+	Serialize a value to JSON text.
+
+	:param obj: the value
+	:return: JSON text
+	:rtype: str
+	:raises TypeError: if the value can not be represented as JSON
+	"""
+	text = dumps(obj)
+	return text.decode("utf-8") if backend == 'orjson' else text
@@ -102,6 +102,22 @@ class response_codes:
 			# Limits
 				# GET /limits
 				"limit200":"OK.",
+
+			# Library errors, not returned by connector
+				# request could not be sent or raised before a response was received
+				"request_failed":"Request to connector could not be completed.",
+				# asyncResult.getResult() timeout elapsed before the operation completed
+				"wait_timeout":"Timed out waiting for the operation to complete.",
+				# async-response id was not answered before the connector's asyncTimeout
+				"async_timeout":"No asynchronous response received in time, the request has been dropped.",
+				# async-response id pushed out because too many responses were pending
+				"async_evicted":"Too many asynchronous responses pending, the oldest request has been dropped.",
+				# request refused by the rate limiter, no token or transaction budget left
+				"rate_limited":"Request rate limit or transaction quota reached.",
+				# no in-flight slot for the endpoint became free within the connector's endpointWait
+				"endpoint_busy":"Endpoint is still busy with earlier requests.",
+				# write held for a sleeping queue-mode endpoint that deregistered or expired before it woke up
+				"endpoint_deregistered":"Endpoint went away before the held request could be sent.",
 	}
 
 	# set the error type by querying the __errList
@@ -115,3 +131,13 @@ class response_codes:
 		self.status_code = status_code
 		self.errType = str(errParent)+str(status_code)
 		self.error = self._setError(self.errType)
+
+class connectorException(Exception):
+	"""
+	Exception raised by blocking helpers such as :func:`asyncResult.getResult`.
+
+	:var error: :class:`response_codes` object describing the failure
+	"""
+	def __init__(self,error):
+		Exception.__init__(self,"%s : %s" %(error.errType,error.error))
+		self.error = error
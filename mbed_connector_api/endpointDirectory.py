@@ -0,0 +1,183 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import sys
+import traceback
+import logging
+
+class endpointDirectory:
+	"""
+	In-memory view of the endpoints on the domain and their resources. Seeded once from ``getEndpoints``
+	and then kept current from the ``registrations``, ``reg-updates``, ``de-registrations`` and
+	``registrations-expired`` notification channels, so lookups never need a REST call.
+
+	Each endpoint record is a dictionary with ``name``, ``type``, ``status``, ``queueMode`` and ``resources``,
+	where ``resources`` maps resource path to the resource description given by connector, or is None
+	if the resources have not been seen yet. Records are shared, treat them as read only.
+
+	Listeners added with ``addListener`` are called as ``fn(event, name, record)`` where event is one of
+	'registered', 'updated', 'deregistered' or 'expired'.
+	"""
+
+	def get(self,ep):
+		"""
+		:param str ep: name of endpoint
+		:return: endpoint record, or None if the endpoint is not known
+		:rtype: dict
+		"""
+		return self._endpoints.get(ep)
+
+	def getResources(self,ep):
+		"""
+		:param str ep: name of endpoint
+		:return: dictionary of resource path to resource description, None if unknown
+		:rtype: dict
+		"""
+		record = self._endpoints.get(ep)
+		return record['resources'] if record else None
+
+	def byType(self,ept):
+		"""
+		:param str ept: endpoint type
+		:return: names of all known endpoints of that type
+		:rtype: list
+		"""
+		with self._lock:
+			return list(self._types.get(ept,()))
+
+	def names(self):
+		"""
+		:return: names of all known endpoints
+		:rtype: list
+		"""
+		return self._endpoints.keys()
+
+	def __contains__(self,ep):
+		return ep in self._endpoints
+
+	def __len__(self):
+		return len(self._endpoints)
+
+	def addListener(self,fn):
+		"""
+		Call ``fn(event, name, record)`` on every change to the directory.
+
+		:param fnptr fn: function to call
+		:return: none
+		"""
+		self._listeners.append(fn)
+
+	def removeListener(self,fn):
+		"""
+		Stop calling a function added with ``addListener``.
+
+		:return: none
+		"""
+		if fn in self._listeners:
+			self._listeners.remove(fn)
+
+	def seed(self,endpoints):
+		"""
+		Replace the directory contents with a ``getEndpoints`` result. Endpoints that are no longer
+		listed are dropped, resources already known for listed endpoints are kept.
+
+		:param list endpoints: list of ``{"name":..., "type":..., "status":...}`` dictionaries
+		:return: none
+		"""
+		events = []
+		with self._lock:
+			listed = set()
+			for e in endpoints:
+				name = e['name']
+				listed.add(name)
+				old = self._endpoints.get(name)
+				record = self._set(name,e.get('type',""),e.get('status',"ACTIVE"),
+									old['queueMode'] if old else self._isTrue(e.get('q',False)),
+									old['resources'] if old else None)
+				events.append(('updated' if old else 'registered',name,record))
+			for name in [n for n in self._endpoints.iterkeys() if n not in listed]:
+				events.append(('deregistered',name,self._remove(name)))
+		self._notify(events)
+
+	def update(self,channel,items):
+		"""
+		Apply the entries of one notification channel.
+
+		:param str channel: 'registrations', 'reg-updates', 'de-registrations' or 'registrations-expired'
+		:param list items: entries of that channel from the notification data
+		:return: none
+		"""
+		events = []
+		with self._lock:
+			if channel in ('registrations','reg-updates'):
+				for e in items:
+					name = e['ep']
+					old = self._endpoints.get(name)
+					resources = self._resourceMap(e['resources']) if 'resources' in e else (old['resources'] if old else None)
+					record = self._set(name,e.get('ept',old['type'] if old else ""),"ACTIVE",
+										self._isTrue(e.get('q',False)),resources)
+					events.append(('updated' if (old and channel == 'reg-updates') else 'registered',name,record))
+			elif channel in ('de-registrations','registrations-expired'):
+				event = 'deregistered' if channel == 'de-registrations' else 'expired'
+				for name in items:
+					if name in self._endpoints:
+						events.append((event,name,self._remove(name)))
+		self._notify(events)
+
+	def setResources(self,ep,resources):
+		"""
+		Record the resources of a known endpoint, for example from a ``getResources`` result.
+
+		:param str ep: name of endpoint
+		:param list resources: resource descriptions, keyed by ``path`` or ``uri``
+		:return: none
+		"""
+		with self._lock:
+			record = self._endpoints.get(ep)
+			if record is None:
+				return
+			record = self._set(ep,record['type'],record['status'],record['queueMode'],self._resourceMap(resources))
+		self._notify([('updated',ep,record)])
+
+	# make a new record and index it, caller holds the lock
+	def _set(self,name,ept,status,queueMode,resources):
+		old = self._endpoints.get(name)
+		if old and old['type'] != ept:
+			self._types.get(old['type'],set()).discard(name)
+		record = {"name":name,"type":ept,"status":status,"queueMode":queueMode,"resources":resources}
+		self._endpoints[name] = record # records are replaced, never changed in place
+		self._types.setdefault(ept,set()).add(name)
+		return record
+
+	# drop a record, caller holds the lock
+	def _remove(self,name):
+		record = self._endpoints.pop(name)
+		self._types.get(record['type'],set()).discard(name)
+		return record
+
+	def _resourceMap(self,resources):
+		return dict((r.get('path',r.get('uri')),r) for r in resources)
+
+	def _isTrue(self,value):
+		return value is True or str(value).lower() == 'true'
+
+	def _notify(self,events):
+		for event,name,record in events:
+			for fn in list(self._listeners):
+				try:
+					fn(event,name,record)
+				except:
+					self.log.error("endpointDirectory listener threw an exception")
+					ex_type, ex, tb = sys.exc_info()
+					traceback.print_tb(tb)
+					self.log.error(sys.exc_info())
+					del tb
+
+	def __init__(self):
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._lock = threading.Lock()
+		self._endpoints = {} # name : record
+		self._types = {} # endpoint type : set of names
+		self._listeners = []
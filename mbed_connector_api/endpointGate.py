@@ -0,0 +1,166 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import time
+from collections import deque
+
+class _slot:
+	"""In-flight slot on one endpoint, ``release`` may be called any number of times"""
+	def __init__(self,gate,ep):
+		self._gate = gate
+		self._ep = ep
+		self._released = False
+
+	def release(self,*args):
+		with self._gate._lock:
+			if self._released:
+				return
+			self._released = True
+			handoff = self._gate._releaseLocked(self._ep)
+		if handoff is not None:
+			handoff()
+
+class endpointGate:
+	"""
+	Limits the requests in flight to each endpoint. Connector answers a second request for a device that is still
+	busy with 429, so requests for a busy endpoint wait here instead, in the order they arrived.
+	A slot is held until the request's asyncResult is done, which for a 202 is when its async-response
+	arrives or it times out. Requests for different endpoints never wait on each other.
+
+	Callers running a request on their own thread block in ``acquire``. Requests run by an executor are ``park``-ed
+	instead, so no worker waits for a slot, and are resumed by the ``release`` that frees one.
+
+	:var slots: requests allowed in flight per endpoint
+	"""
+
+	def acquire(self,ep,timeout=None):
+		'''
+		Wait for a free slot on an endpoint.
+
+		:param str ep: name of endpoint
+		:param float timeout: Optional - seconds to wait, forever if not given
+		:return: the slot, call its ``release`` when the request is done. None if the timeout passed first
+		'''
+		deadline = time.time()+timeout if timeout is not None else None
+		with self._lock:
+			state = self._state(ep)
+			if state[0] >= self.slots or state[1] or state[3]:
+				# busy, queue up behind the requests already waiting
+				self._waits += 1
+				start = time.time()
+				state[1] += 1
+				try:
+					while state[0] >= self.slots:
+						remaining = deadline-time.time() if deadline is not None else None
+						if remaining is not None and remaining <= 0:
+							self._timeouts += 1
+							return None
+						state[2].wait(remaining)
+				finally:
+					state[1] -= 1
+					self._recordWait(time.time()-start)
+					if state[0] == 0 and state[1] == 0 and not state[3]:
+						del self._endpoints[ep]
+			state = self._endpoints.setdefault(ep,state)
+			state[0] += 1
+			return _slot(self,ep)
+
+	def park(self,ep,resume,timeout=None,expired=None):
+		'''
+		Take a free slot on an endpoint, or queue the request without waiting for one. A queued request is
+		given its slot by calling ``resume(slot)`` on the thread releasing the slot before it.
+
+		:param str ep: name of endpoint
+		:param fnptr resume: called with the slot when it is handed to the queued request
+		:param float timeout: Optional - seconds the request may stay queued, forever if not given
+		:param fnptr expired: Optional - called without arguments if the timeout passes first
+		:return: the slot if one was free, None if the request was queued
+		'''
+		with self._lock:
+			state = self._state(ep)
+			if state[0] < self.slots and not state[1] and not state[3]:
+				state[0] += 1
+				return _slot(self,ep)
+			self._waits += 1
+			waiter = [resume,time.time(),None] # resume, queued at, timer
+			state[3].append(waiter)
+			if timeout is not None:
+				waiter[2] = threading.Timer(timeout,self._expire,(ep,waiter,expired))
+				waiter[2].daemon = True
+				waiter[2].start()
+			return None
+
+	def stats(self):
+		'''
+		:return: dictionary with ``busy`` endpoints, ``inFlight`` and ``waiting`` requests, ``waits`` and ``timeouts``
+			counts, and ``totalWait`` / ``maxWait`` seconds spent waiting for a slot
+		:rtype: dict
+		'''
+		with self._lock:
+			return {"busy":len(self._endpoints),
+					"inFlight":sum(s[0] for s in self._endpoints.itervalues()),
+					"waiting":sum(s[1]+len(s[3]) for s in self._endpoints.itervalues()),
+					"waits":self._waits,
+					"timeouts":self._timeouts,
+					"totalWait":self._totalWait,
+					"maxWait":self._maxWait}
+
+	# give a slot back, caller holds the lock. The slot goes to the first queued request, returning the function
+	# resuming it to be called once the lock is released, or else wakes the next waiter
+	def _releaseLocked(self,ep):
+		state = self._endpoints.get(ep)
+		if state is None:
+			return None
+		state[0] -= 1
+		if state[3]:
+			resume,queued,timer = state[3].popleft()
+			if timer is not None:
+				timer.cancel()
+			self._recordWait(time.time()-queued)
+			state[0] += 1
+			slot = _slot(self,ep)
+			return lambda: resume(slot)
+		if state[1]:
+			state[2].notify()
+		elif state[0] <= 0:
+			del self._endpoints[ep]
+		return None
+
+	# timer of a queued request, drops it unless it was handed a slot meanwhile
+	def _expire(self,ep,waiter,expired):
+		with self._lock:
+			state = self._endpoints.get(ep)
+			if state is None or waiter not in state[3]:
+				return
+			state[3].remove(waiter)
+			self._timeouts += 1
+			self._recordWait(time.time()-waiter[1])
+			if state[0] == 0 and state[1] == 0 and not state[3]:
+				del self._endpoints[ep]
+		if expired is not None:
+			expired()
+
+	# caller holds the lock
+	def _state(self,ep):
+		state = self._endpoints.get(ep)
+		if state is None:
+			state = self._endpoints[ep] = [0,0,threading.Condition(self._lock),deque()] # in flight, blocked, condition, queued
+		return state
+
+	def _recordWait(self,waited):
+		self._totalWait += waited
+		self._maxWait = max(self._maxWait,waited)
+
+	def __init__(self,slots=1):
+		'''
+		:param int slots: requests allowed in flight per endpoint
+		'''
+		self.slots = max(slots,1)
+		self._lock = threading.Lock()
+		self._endpoints = {} # name : [in flight, blocked in acquire, condition, queued requests]
+		self._waits = 0
+		self._timeouts = 0
+		self._totalWait = 0.0
+		self._maxWait = 0.0
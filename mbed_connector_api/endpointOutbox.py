@@ -0,0 +1,133 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import time
+from collections import OrderedDict
+
+class endpointOutbox:
+	"""
+	Writes held for queue-mode endpoints that are asleep. Connector answers writes to a sleeping queue-mode
+	device with 409 or 429, so once an endpoint is marked asleep its writes are kept here and sent in one burst
+	when a registration update shows it is awake again. Only the last write to each resource is kept, the
+	asyncResults of the writes it replaced are completed with its outcome.
+
+	Each held write is a list ``[heldAt, fn, args, result, replaced]`` where ``replaced`` lists the asyncResults
+	of earlier writes to the same resource.
+	"""
+
+	def markAsleep(self,ep):
+		'''
+		:param str ep: name of endpoint
+		:return: none
+		'''
+		with self._lock:
+			self._asleep.add(ep)
+
+	def isAsleep(self,ep):
+		'''
+		:param str ep: name of endpoint
+		:return: True if writes to the endpoint are being held
+		:rtype: bool
+		'''
+		return ep in self._asleep
+
+	def hold(self,ep,key,fn,args,result):
+		'''
+		Hold a write until the endpoint wakes up, replacing an earlier held write with the same key.
+
+		:param str ep: name of endpoint
+		:param key: what the write replaces, usually (verb, resource path)
+		:param fnptr fn: function sending the write
+		:param tuple args: arguments for ``fn``
+		:param asyncResult result: result the write fills in once sent
+		:return: none
+		'''
+		with self._lock:
+			self._asleep.add(ep)
+			writes = self._writes.setdefault(ep,OrderedDict())
+			old = writes.get(key)
+			if old is not None:
+				# keep the place and age of the first write, send the last value
+				writes[key] = [old[0],fn,args,result,old[4]+[old[3]]]
+				self._coalesced += 1
+			else:
+				writes[key] = [time.time(),fn,args,result,[]]
+				self._depth += 1
+				self._maxDepth = max(self._maxDepth,self._depth)
+			self._held += 1
+
+	def take(self,ep):
+		'''
+		Mark an endpoint awake and remove its held writes for sending.
+
+		:param str ep: name of endpoint
+		:return: held writes in the order they were first made
+		:rtype: list
+		'''
+		now = time.time()
+		with self._lock:
+			self._asleep.discard(ep)
+			writes = self._writes.pop(ep,None)
+			if not writes:
+				return []
+			writes = writes.values()
+			self._depth -= len(writes)
+			self._flushes += 1
+			for w in writes:
+				latency = now-w[0]
+				self._flushed += 1
+				self._totalLatency += latency
+				self._maxLatency = max(self._maxLatency,latency)
+			return writes
+
+	def drop(self,ep):
+		'''
+		Forget an endpoint that has gone away.
+
+		:param str ep: name of endpoint
+		:return: the held writes that will not be sent
+		:rtype: list
+		'''
+		with self._lock:
+			self._asleep.discard(ep)
+			writes = self._writes.pop(ep,None)
+			if not writes:
+				return []
+			writes = writes.values()
+			self._depth -= len(writes)
+			self._dropped += len(writes)
+			return writes
+
+	def stats(self):
+		'''
+		:return: dictionary with ``asleep`` endpoints, ``depth`` writes held now and ``maxDepth``, ``held``, ``coalesced``,
+			``flushed`` and ``dropped`` write counts, ``flushes`` and ``avgFlushLatency`` / ``maxFlushLatency`` in seconds from a write being held to it being sent
+		:rtype: dict
+		'''
+		with self._lock:
+			return {"asleep":len(self._asleep),
+					"depth":self._depth,
+					"maxDepth":self._maxDepth,
+					"held":self._held,
+					"coalesced":self._coalesced,
+					"flushed":self._flushed,
+					"dropped":self._dropped,
+					"flushes":self._flushes,
+					"avgFlushLatency":self._totalLatency/self._flushed if self._flushed else 0.0,
+					"maxFlushLatency":self._maxLatency}
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._asleep = set()
+		self._writes = {} # name : OrderedDict of key : held write
+		self._depth = 0
+		self._maxDepth = 0
+		self._held = 0
+		self._coalesced = 0
+		self._flushed = 0
+		self._dropped = 0
+		self._flushes = 0
+		self._totalLatency = 0.0
+		self._maxLatency = 0.0
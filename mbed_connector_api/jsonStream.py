@@ -0,0 +1,54 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import json
+
+_whitespace = " \t\r\n"
+
+def iterJSONArray(chunks):
+	"""
+	Incrementally parse a JSON array, yielding each element as soon as it has been read.
+	Only the element being parsed is held in memory, not the whole document.
+
+	:param iterable chunks: pieces of the JSON text, for example ``response.iter_content(size)``
+	:return: generator of the array's elements
+	:raises ValueError: if the text is not a JSON array or ends before the array is closed
+	"""
+	decoder = json.JSONDecoder()
+	chunks = iter(chunks)
+	buf = ""
+	pos = 0
+	started = False
+	exhausted = False
+	while True:
+		# skip separators between elements
+		while pos < len(buf) and (buf[pos] in _whitespace or (started and buf[pos] == ",")):
+			pos += 1
+		if pos < len(buf):
+			if not started:
+				if buf[pos] != "[":
+					raise ValueError("JSON text is not an array")
+				started = True
+				pos += 1
+				continue
+			if buf[pos] == "]":
+				return
+			try:
+				obj,end = decoder.raw_decode(buf,pos)
+				# a number at the very end of the buffer may continue in the next chunk
+				if end < len(buf) or exhausted or isinstance(obj,(dict,list)):
+					yield obj
+					pos = end
+					continue
+			except ValueError:
+				if exhausted:
+					raise
+		elif exhausted:
+			raise ValueError("JSON array ended unexpectedly")
+		# need more text, drop what has been parsed already
+		try:
+			buf = buf[pos:]+next(chunks)
+			pos = 0
+		except StopIteration:
+			exhausted = True
@@ -3,18 +3,61 @@
 # Licensed under the Apache License, Version 2.0
 # See LICENSE file for details.
 import requests as r
-import json
-from base64 import standard_b64decode as b64decode
 import threading
+import time
 import sys
 import traceback
-from connectorError import response_codes
+import inspect
+from connectorError import response_codes, connectorException
+from transport import transport
+from workerPool import workerPool
+from bulkResult import bulkResult
+from asyncRegistry import asyncRegistry
+from resourceCache import resourceCache
+from endpointDirectory import endpointDirectory
+from jsonStream import iterJSONArray
+from notificationDispatcher import notificationDispatcher
+from notificationRouter import notificationRouter
+from notificationEvents import makeEvent, asyncResponseEvent
+import codec
+from reconnectPolicy import reconnectPolicy
+from pollPipeline import pollPipeline
+from endpointGate import endpointGate
+from endpointOutbox import endpointOutbox
+from preSubscriptionRules import preSubscriptionRules
+from preSubscriptionSet import preSubscriptionSet
+from metrics import metrics
 import logging
 
-class asyncResult:
+log = logging.getLogger(name="mdc-api-logger")
+
+# connector REST methods are wrapped with this so that, when the connector has an executor,
+# the call is submitted to it and the asyncResult is returned straight away
+def _deferrable(fn):
+	argNames = inspect.getargspec(fn).args[1:] # drop self
+	cbfnIndex = argNames.index('cbfn') if 'cbfn' in argNames else None
+	def method(self,*args,**kwargs):
+		start = time.time()
+		if self._executor is None or getattr(self._local,'inline',False):
+			result = fn(self,*args,**kwargs)
+		else:
+			result = self._defer(fn,args,kwargs,cbfnIndex)
+		if self.metrics is not None:
+			self._observeCall(fn.__name__,start,result)
+		return result
+	method.__name__ = fn.__name__
+	method.__doc__ = fn.__doc__
+	method._fn = fn
+	return method
+
+# calls that send a request to the device, taking ep as their first argument. They hold one of the endpoint's slots
+_gatedCalls = frozenset(("getResourceValue","putResourceValue","postResource","deleteEndpoint"))
+
+class asyncResult(object):
 	"""
 	AsyncResult objects returned by all mbed_connector_api library calls. 
 	Make sure to check the ``.isDone()`` function and the ``.error`` variable before accessing the ``.result`` variable. 
+	Use ``.wait()`` or ``.getResult()`` to block until the operation completes instead of polling ``.isDone()``.
 
 
 	:var error: False if no error, if error then populated by :class:'connectorError.response_codes` object
@@ -30,27 +73,98 @@ class asyncResult:
 		"""
 		return self.is_done
 
+	def done(self):
+		"""
+		Same as ``.isDone()``, for compatibility with ``concurrent.futures.Future``.
+
+		:returns: True / False based on completion of async operation
+		:rtype: bool
+		"""
+		return self.is_done
+
+	# setting is_done to True wakes up waiters and runs the done callbacks
+	@property
+	def is_done(self):
+		return self._done.is_set()
+
+	@is_done.setter
+	def is_done(self, value):
+		if not value:
+			return
+		with self._lock:
+			if self._done.is_set():
+				return
+			self._done.set()
+			callbacks = self._doneCallbacks
+			self._doneCallbacks = []
+		for fn in callbacks:
+			self._runDoneCallback(fn)
+
+	def wait(self, timeout=None):
+		"""
+		Block until the operation has completed.
+
+		:param float timeout: Optional - maximum number of seconds to wait, wait forever if None
+		:returns: True if the operation completed, False if the wait timed out
+		:rtype: bool
+		"""
+		return self._done.wait(timeout)
+
+	def getResult(self, timeout=None):
+		"""
+		Block until the operation has completed and return the ``.result`` variable.
+
+		:param float timeout: Optional - maximum number of seconds to wait, wait forever if None
+		:returns: the ``.result`` variable
+		:raises connectorException: if the operation failed, or did not complete within ``timeout``
+		"""
+		if not self._done.wait(timeout):
+			raise connectorException(response_codes("wait_timeout",""))
+		if self.error:
+			raise connectorException(self.error)
+		return self.result
+
+	def add_done_callback(self, fn):
+		"""
+		Call ``fn(asyncResult)`` once the operation has completed. If it has already completed ``fn`` is called immediately.
+		Unlike the ``callback`` passed to library calls these are called for every completion, including errors.
+
+		:param fnptr fn: function to call
+		:return: none
+		"""
+		with self._lock:
+			if not self._done.is_set():
+				self._doneCallbacks.append(fn)
+				return
+		self._runDoneCallback(fn)
+
+	def _runDoneCallback(self, fn):
+		try:
+			fn(self)
+		except:
+			log.error("asyncResult done callback threw an exception")
+			ex_type, ex, tb = sys.exc_info()
+			traceback.print_tb(tb)
+			log.error(sys.exc_info())
+			del tb
+
 	def fill(self,  data):
 		if type(data) == r.models.Response:
-			try:
-				self.result =  json.loads(data.content)
-			except:
-				self.result = []
-				if isinstance(data.content,str): # string handler
-					self.result = data.content
-				elif isinstance(data.content,int): # int handler
-					self.log.debug("data returned is an integer, not sure what to do with that")
-				else: # all other handler
-					self.log.debug("unhandled data type, type of content : %s" %type(data.content))
+			# only JSON bodies are parsed, plain text values are kept as they are
+			self.result = codec.decode(data.content,data.headers.get('content-type'))
+			if not isinstance(data.content,basestring): # all other handler
+				log.debug("unhandled data type, type of content : %s" %type(data.content))
 			self.status_code = data.status_code
 			self.raw_data = data.content
 		else:
 			#error
-			self.log.error("type not found : %s"%type(data))
+			log.error("type not found : %s"%type(data))
 		return
 
 	def __init__(self, callback=""):
-		self.is_done = False
+		self._lock = threading.Lock()
+		self._done = threading.Event()
+		self._doneCallbacks = []
 		self.result = {}
 		self.status_code = ''
 		self.raw_data = {}
@@ -66,9 +180,15 @@ class connector:
 	Interface class to use the connector.mbed.com REST API. 
 	This class will by default handle asyncronous events.
 	All function return :class:'.asyncResult' objects
+
+	REST calls block until the HTTP request has completed unless an ``executor`` is given, either an object
+	with a ``concurrent.futures`` style ``submit()`` or a number of worker threads for a built-in pool.
+	With an executor every REST call returns its :class:'.asyncResult' immediately, and that object
+	completes once the HTTP request and, for 202 responses, the asynchronous response have finished.
 	"""
 
 	# Return connector version number and recent rest API version number it supports
+	@_deferrable
 	def getConnectorVersion(self):
 		"""
 		GET the current Connector version.
@@ -76,7 +196,7 @@ class connector:
 		:returns:  asyncResult object, populates error and result fields
 		:rtype: asyncResult
 		"""
-		result = asyncResult()
+		result = self._newResult()
 		data = self._getURL("/",versioned=False)
 		result.fill(data)
 		if data.status_code == 200:
@@ -87,6 +207,7 @@ class connector:
 		return result
 
 	# Return API version of connector
+	@_deferrable
 	def getApiVersions(self):
 		"""
 		Get the REST API versions that connector accepts.
@@ -94,7 +215,7 @@ class connector:
 		:returns:  :class:asyncResult object, populates error and result fields
 		:rtype: asyncResult
 		"""
-		result = asyncResult()
+		result = self._newResult()
 		data = self._getURL("/rest-versions",versioned=False)
 		result.fill(data)
 		if data.status_code == 200:
@@ -105,17 +226,20 @@ class connector:
 		return result
 
 	# Returns metadata about connector limits as JSON blob
+	@_deferrable
 	def getLimits(self):
 		"""return limits of account in async result object.
 
 		:returns:  asyncResult object, populates error and result fields
 		:rtype: asyncResult
 		"""
-		result = asyncResult()
+		result = self._newResult()
 		data = self._getURL("/limits")
 		result.fill(data)
 		if data.status_code == 200:
 			result.error = False
+			if self._limiter is not None:
+				self._limiter.setBudget(self._remainingBudget(result.result))
 		else:
 			result.error = response_codes("limit",data.status_code)
 		result.is_done = True
@@ -123,6 +247,7 @@ class connector:
 
 	# return json list of all endpoints.
 	# optional type field can be used to match all endpoints of a certain type.
+	@_deferrable
 	def getEndpoints(self,typeOfEndpoint=""):
 		"""
 		Get list of all endpoints on the domain.
@@ -132,7 +257,7 @@ class connector:
 		:rtype: asyncResult
 		"""
 		q = {}
-		result = asyncResult()
+		result = self._newResult()
 		if typeOfEndpoint:
 			q['type'] = typeOfEndpoint
 			result.extra['type'] = typeOfEndpoint
@@ -145,7 +270,60 @@ class connector:
 		result.is_done = True
 		return result
 
+	# stream the endpoint list instead of loading it whole
+	def iterEndpoints(self,typeOfEndpoint="",pageSize=64*1024):
+		"""
+		Generator version of ``getEndpoints``. The listing is streamed from connector and parsed
+		incrementally, so each endpoint is yielded as soon as it has been read and memory use stays
+		flat however large the domain is.
+
+		:param str typeOfEndpoint: Optional filter endpoints returned by type
+		:param int pageSize: Optional - number of bytes read from the connection at a time
+		:return: generator of endpoint dictionaries
+		:raises connectorException: if connector does not return the list
+		"""
+		q = {}
+		if typeOfEndpoint:
+			q['type'] = typeOfEndpoint
+		return self._iterList("/endpoints",q,"get_endpoints",pageSize)
+
+	# stream the resource list of an endpoint
+	def iterResources(self,ep,noResp=False,cacheOnly=False,pageSize=64*1024):
+		"""
+		Generator version of ``getResources``, for endpoints with very large resource trees.
+
+		:param str ep: Endpoint to get the resources of
+		:param bool noResp: Optional - specify no response necessary from endpoint
+		:param bool cacheOnly: Optional - get results from cache on connector, do not wake up endpoint
+		:param int pageSize: Optional - number of bytes read from the connection at a time
+		:return: generator of resource dictionaries
+		:raises connectorException: if connector does not return the list
+		"""
+		q = {}
+		if noResp or cacheOnly:
+			q['noResp'] = 'true' if noResp == True else 'false'
+			q['cacheOnly'] = 'true' if cacheOnly == True else 'false'
+		return self._iterList("/endpoints/"+ep,q,"get_resources",pageSize)
+
+	# seed the endpoint directory, it is kept current from the notification channel afterwards
+	def syncDirectory(self,typeOfEndpoint=""):
+		"""
+		Load the endpoint directory from ``getEndpoints``. After this the directory in ``.directory`` is kept
+		current from registration notifications, so call it once after starting long polling or registering a callback URL.
+
+		:param str typeOfEndpoint: Optional filter endpoints loaded by type
+		:return: the getEndpoints result, the directory is seeded when it completes successfully
+		:rtype: asyncResult
+		"""
+		result = self.getEndpoints(typeOfEndpoint)
+		def seed(done):
+			if done.error is False:
+				self.directory.seed(done.result)
+		result.add_done_callback(seed)
+		return result
+
 	# return json list of all resources on an endpoint
+	@_deferrable
 	def getResources(self,ep,noResp=False,cacheOnly=False):
 		"""
 		Get list of resources on an endpoint.
@@ -158,7 +336,7 @@ class connector:
 		"""
 		# load query params if set to other than defaults
 		q = {}
-		result = asyncResult()
+		result = self._newResult()
 		result.endpoint = ep
 		if noResp or cacheOnly:
 			q['noResp'] = 'true' if noResp == True else 'false'
@@ -171,6 +349,8 @@ class connector:
 		if data.status_code == 200: # sucess
 			result.error = False
 			self.log.debug("getResources sucess, status_code = `%s`, content = `%s`", str(data.status_code),data.content)
+			if isinstance(result.result,list):
+				self.directory.setResources(ep,result.result)
 		else: # fail
 			result.error = response_codes("get_resources",data.status_code)
 			self.log.debug("getResources failed with error code `%s`" %str(data.status_code))
@@ -179,27 +359,63 @@ class connector:
 
 
 	# return async object
-	def getResourceValue(self,ep,res,cbfn="",noResp=False,cacheOnly=False):
+	@_deferrable
+	def getResourceValue(self,ep,res,cbfn="",noResp=False,cacheOnly=False,useLocalCache=False):
 		"""
 		Get value of a specific resource on a specific endpoint.
+		A call for a read that is already in flight shares that read's request and is completed from its answer.
 		
 		:param str ep: name of endpoint
 		:param str res: name of resource
 		:param fnptr cbfn: Optional - callback function to be called on completion
 		:param bool noResp: Optional - specify no response necessary from endpoint
 		:param bool cacheOnly: Optional - get results from cache on connector, do not wake up endpoint
+		:param bool useLocalCache: Optional - return a fresh value from the local resource cache without contacting connector
 		:return: value of the resource, usually a string
 		:rtype: asyncResult
 		"""
 		q = {}
-		result = asyncResult(callback=cbfn) #set callback fn for use in async handler
+		result = self._newResult(callback=cbfn) #set callback fn for use in async handler
 		result.endpoint = ep
 		result.resource = res
+		if useLocalCache:
+			value = self.cache.get(ep,res)
+			if value is not None: # fresh value from a notification or earlier read
+				result.result = value
+				result.raw_data = value
+				result.status_code = 200
+				result.error = False
+				result.extra['cached'] = True
+				result.is_done = True
+				if cbfn:
+					cbfn(result)
+				return result
+		if self._coalesceReads:
+			# the same read already in flight, wait for its answer instead of sending another request
+			key = (ep,res,bool(noResp),bool(cacheOnly))
+			with self._flightLock:
+				flight = self._inFlight.get(key)
+				if flight is not None:
+					flight.append(result)
+					self._coalesced += 1
+					return result
+				flight = self._inFlight[key] = []
+			result.add_done_callback(lambda leader: self._finishFlight(key,flight,leader))
+		result.add_done_callback(self._cacheResult)
 		if noResp or cacheOnly:
 			q['noResp'] = 'true' if noResp == True else 'false'
 			q['cacheOnly'] = 'true' if cacheOnly == True else 'false'
 		# make query
-		data = self._getURL("/endpoints/"+ep+res, query=q)
+		try:
+			data = self._endpointRequest(ep,result,self._getURL,"/endpoints/"+ep+res,query=q)
+		except Exception as e:
+			if self._coalesceReads:
+				# followers get the same answer the caller gets from the exception
+				failed = asyncResult()
+				failed.status_code = result.status_code
+				failed.error = self._errorFor(e)
+				self._finishFlight(key,flight,failed)
+			raise
 		result.fill(data)
 		if data.status_code == 200: # immediate success
 			result.error = False
@@ -208,18 +424,44 @@ class connector:
 				cbfn(result)
 			return result
 		elif data.status_code == 202:
-			self.database['async-responses'][json.loads(data.content)["async-response-id"]]= result
+			self.database['async-responses'][codec.loads(data.content)["async-response-id"]]= result
 		else: # fail
 			result.error = response_codes("resource",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
+	# fan out getResourceValue over many (endpoint, resource) pairs
+	def getResourceValues(self,pairs,concurrency=10,noResp=False,cacheOnly=False,timeout=None,useLocalCache=False):
+		"""
+		Get the value of many resources at once. Requests are issued concurrently with at most
+		``concurrency`` of them incomplete at any time, 202 responses are resolved by long polling as usual.
+		Uses the connector's executor if it has one, otherwise a worker pool is created for the call.
+
+		:param list pairs: list of (endpoint name, resource name) tuples
+		:param int concurrency: Optional - maximum number of requests in flight
+		:param bool noResp: Optional - specify no response necessary from endpoint
+		:param bool cacheOnly: Optional - get results from cache on connector, do not wake up endpoint
+		:param float timeout: Optional - overall seconds to wait, outstanding requests are then counted as timeouts
+		:param bool useLocalCache: Optional - use fresh values from the local resource cache where there are any
+		:return: iterator yielding asyncResult objects as they complete, with a ``.summary()`` of the outcome
+		:rtype: bulkResult
+		"""
+		executor = self._executor
+		done = None
+		if executor is None:
+			executor = workerPool(workers=concurrency,name="mdc-api-bulk-worker")
+			done = lambda: executor.shutdown(wait=False) # every request has completed, parked ones included
+		fn = self.getResourceValue._fn
+		def issue(pair):
+			return self._defer(fn,pair,{'noResp':noResp,'cacheOnly':cacheOnly,'useLocalCache':useLocalCache},None,executor)
+		return bulkResult(pairs,issue,concurrency=concurrency,timeout=timeout,done=done)
+
 	# return async object
+	@_deferrable
 	def putResourceValue(self,ep,res,data,cbfn=""):
 		"""
-		Put a value to a resource on an endpoint
+		Put a value to a resource on an endpoint.
+		With ``queueOutbox`` set, writes to a sleeping queue-mode endpoint are held and sent when it wakes up.
 		
 		:param str ep: name of endpoint
 		:param str res: name of resource
@@ -228,26 +470,34 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		"""
-		result = asyncResult(callback=cbfn)
+		result = self._newResult(callback=cbfn)
 		result.endpoint = ep
 		result.resource = res
-		data = self._putURL("/endpoints/"+ep+res,payload=data)
+		payload = data
+		result.add_done_callback(self._invalidateCached) # the cached value is stale once the write is done
+		if self._outbox is not None and self._outbox.isAsleep(ep):
+			return self._holdWrite(ep,('PUT',res),self.putResourceValue._fn,(ep,res,payload),result)
+		data = self._endpointRequest(ep,result,self._putURL,"/endpoints/"+ep+res,payload=payload)
+		if data.status_code in (409,429) and self._sleeping(ep):
+			return self._holdWrite(ep,('PUT',res),self.putResourceValue._fn,(ep,res,payload),result)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 200: #immediate success
 			result.error = False
 			result.is_done = True
 		elif data.status_code == 202:
-			self.database['async-responses'][json.loads(data.content)["async-response-id"]]= result
+			self.database['async-responses'][codec.loads(data.content)["async-response-id"]]= result
 		else:
 			result.error = response_codes("resource",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
 	#return async object
+	@_deferrable
 	def postResource(self,ep,res,data="",cbfn=""):
 		'''
 		POST data to a resource on an endpoint.
+		With ``queueOutbox`` set, writes to a sleeping queue-mode endpoint are held and sent when it wakes up.
 		
 		:param str ep: name of endpoint
 		:param str res: name of resource
@@ -256,23 +506,30 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult(callback=cbfn)
+		result = self._newResult(callback=cbfn)
 		result.endpoint = ep
 		result.resource = res
-		data = self._postURL("/endpoints/"+ep+res,data)
+		payload = data
+		result.add_done_callback(self._invalidateCached) # the cached value is stale once the write is done
+		if self._outbox is not None and self._outbox.isAsleep(ep):
+			return self._holdWrite(ep,('POST',res),self.postResource._fn,(ep,res,payload),result)
+		data = self._endpointRequest(ep,result,self._postURL,"/endpoints/"+ep+res,payload)
+		if data.status_code in (409,429) and self._sleeping(ep):
+			return self._holdWrite(ep,('POST',res),self.postResource._fn,(ep,res,payload),result)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 201: #immediate success
 			result.error = False
 			result.is_done = True
 		elif data.status_code == 202:
-			self.database['async-responses'][json.loads(data.content)["async-response-id"]]= result
+			self.database['async-responses'][codec.loads(data.content)["async-response-id"]]= result
 		else:
 			result.error = response_codes("resource",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
 	# return async object
+	@_deferrable
 	def deleteEndpoint(self,ep,cbfn=""):
 		'''
 		Send DELETE message to an endpoint.
@@ -282,24 +539,26 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult(callback=cbfn)
+		result = self._newResult(callback=cbfn)
 		result.endpoint = ep
-		data = self._deleteURL("/endpoints/"+ep)
+		result.add_done_callback(self._invalidateCached)
+		data = self._endpointRequest(ep,result,self._deleteURL,"/endpoints/"+ep)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 200: #immediate success
 			result.error = False
 			result.is_done = True
 		elif data.status_code == 202:
-			self.database['async-responses'][json.loads(data.content)["async-response-id"]]= result
+			self.database['async-responses'][codec.loads(data.content)["async-response-id"]]= result
 		else:
 			result.error = response_codes("resource",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
 	# subscribe to endpoint/resource, the cbfn is given an asynch object that
 	# represents the result. it is up to the user to impliment the notification
 	# channel callback in a higher level library.
+	@_deferrable
 	def putResourceSubscription(self,ep,res,cbfn=""):
 		'''
 		Subscribe to changes in a specific resource ``res`` on an endpoint ``ep``
@@ -310,22 +569,23 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error`` 
 		:rtype: asyncResult
 		'''
-		result = asyncResult(callback=cbfn)
+		result = self._newResult(callback=cbfn)
 		result.endpoint = ep
 		result.resource = res
 		data = self._putURL("/subscriptions/"+ep+res)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 200: #immediate success
 			result.error = False
 			result.is_done = True
 		elif data.status_code == 202:
-			self.database['async-responses'][json.loads(data.content)["async-response-id"]]= result
+			self.database['async-responses'][codec.loads(data.content)["async-response-id"]]= result
 		else:
 			result.error = response_codes("subscribe",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
+	@_deferrable
 	def deleteEndpointSubscriptions(self,ep):
 		'''
 		Delete all subscriptions on specified endpoint ``ep``
@@ -334,19 +594,20 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error`` 
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		result.endpoint = ep
 		data = self._deleteURL("/subscriptions/"+ep)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 204: #immediate success
 			result.error = False
 			result.is_done = True
 		else:
 			result.error = response_codes("delete_endpoint_subscription",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
+	@_deferrable
 	def deleteResourceSubscription(self,ep,res):
 		'''
 		Delete subscription to a resource ``res`` on an endpoint ``ep``
@@ -356,20 +617,21 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		result.endpoint = ep
 		result.resource = res
 		data = self._deleteURL("/subscriptions/"+ep+res)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 204: #immediate success
 			result.error = False
 			result.is_done = True
 		else:
 			result.error = response_codes("unsubscribe",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
+	@_deferrable
 	def deleteAllSubscriptions(self):
 		'''
 		Delete all subscriptions on the domain (all endpoints, all resources)
@@ -377,20 +639,21 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		data = self._deleteURL("/subscriptions/")
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 204: #immediate success
 			result.error = False
 			result.is_done = True
 		else:
 			result.error = response_codes("unsubscribe",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
 	# return async object
 	# result field is a string
+	@_deferrable
 	def getEndpointSubscriptions(self,ep):
 		'''
 		Get list of all subscriptions on a given endpoint ``ep``
@@ -399,22 +662,23 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		result.endpoint = ep
 		data = self._getURL("/subscriptions/"+ep)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 200: #immediate success
 			result.error = False
-			result.is_done = True
 			result.result = data.content
+			result.is_done = True
 		else:
 			result.error = response_codes("unsubscribe",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
 	# return async object
 	# result field is a string
+	@_deferrable
 	def getResourceSubscription(self,ep,res):
 		'''
 		Get list of all subscriptions for a resource ``res`` on an endpoint ``ep``
@@ -424,48 +688,59 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		result.endpoint = ep
 		result.resource = res
 		data = self._getURL("/subscriptions/"+ep+res)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 200: #immediate success
 			result.error = False
-			result.is_done = True
 			result.result = data.content
+			result.is_done = True
 		else:
 			result.error = response_codes("unsubscribe",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
+	@_deferrable
 	def putPreSubscription(self,JSONdata):
 		'''
 		Set pre-subscription rules for all endpoints / resources on the domain.
 		This can be useful for all current and future endpoints/resources.
 		
-		:param json JSONdata: data to use as pre-subscription data. Wildcards are permitted
+		:param json JSONdata: data to use as pre-subscription data. Wildcards are permitted.
+			A :class:`preSubscriptionRules` sends its optimized rules
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		if isinstance(JSONdata,str) and self._isJSON(JSONdata):
+		if isinstance(JSONdata,preSubscriptionRules):
+			self.log.debug("pre-subscription rules optimized from %(rules)d rules / %(pairs)d pairs",JSONdata.before)
+			self.log.debug("pre-subscription rules optimized to %(rules)d rules / %(pairs)d pairs",JSONdata.after)
+			JSONdata = JSONdata.rules
+		if isinstance(JSONdata,basestring):
 			self.log.warn("pre-subscription data was a string, converting to a list : %s",JSONdata)
-			JSONdata = json.loads(JSONdata) # convert json string to list
-		if not (isinstance(JSONdata,list) and self._isJSON(JSONdata)):
+			try:
+				JSONdata = codec.loads(JSONdata) # convert json string to list
+			except ValueError:
+				pass
+		if not isinstance(JSONdata,list): # serialized once, by _putURL
 			self.log.error("pre-subscription data is not valid. Please make sure it is a valid JSON list")
-		result = asyncResult()
+		result = self._newResult()
 		data = self._putURL("/subscriptions",JSONdata, versioned=False)
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 204: # immediate success with no response
 			result.error = False
-			result.is_done = True
 			result.result = []
+			result.is_done = True
+			self._preSubscriptions.invalidate() # rules replaced, re-read before the next incremental change
 		else:
 			result.error = response_codes("presubscription",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
+	@_deferrable
 	def getPreSubscription(self):
 		'''
 		Get the current pre-subscription data from connector
@@ -473,19 +748,57 @@ class connector:
 		:return: JSON that represents the pre-subscription data in the ``.result`` field
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		data = self._getURL("/subscriptions")
+		result.raw_data = data.content
+		result.status_code = data.status_code
 		if data.status_code == 200: #immediate success
 			result.error = False
-			result.is_done = True
 			result.result = data.json()
+			result.is_done = True
 		else:
 			result.error = response_codes("presubscription",data.status_code)
 			result.is_done = True
-		result.raw_data = data.content
-		result.status_code = data.status_code
 		return result
 
+	def addPreSubscriptions(self,rules,cbfn=""):
+		'''
+		Add pre-subscription rules to the ones already on connector. Changes made at about the same time,
+		from any thread, are sent together as one ``putPreSubscription`` of the optimized rules.
+		Nothing is sent if the rules are already covered.
+
+		:param list rules: (endpoint name, resource path[, endpoint type]) tuples or pre-subscription dictionaries
+		:param fnptr cbfn: Optional - callback function to call when the change is sent
+		:return: successful ``.status_code`` / ``.is_done``, ``.status_code`` is None if nothing had to be sent.
+			``.result`` is the list of rules now on connector. Check the ``.error``
+		:rtype: asyncResult
+		'''
+		start = time.time()
+		result = asyncResult(callback=cbfn)
+		if self.metrics is not None:
+			self._observeCall('addPreSubscriptions',start,result)
+		self._preSubscriptions.change(rules,None,result)
+		return result
+
+	def removePreSubscriptions(self,rules,cbfn=""):
+		'''
+		Remove pre-subscription rules added before, batched like ``addPreSubscriptions``.
+		Narrower rules that the removed ones covered are kept.
+
+		:param list rules: (endpoint name, resource path[, endpoint type]) tuples or pre-subscription dictionaries
+		:param fnptr cbfn: Optional - callback function to call when the change is sent
+		:return: successful ``.status_code`` / ``.is_done``, ``.status_code`` is None if nothing had to be sent.
+			``.result`` is the list of rules now on connector. Check the ``.error``
+		:rtype: asyncResult
+		'''
+		start = time.time()
+		result = asyncResult(callback=cbfn)
+		if self.metrics is not None:
+			self._observeCall('removePreSubscriptions',start,result)
+		self._preSubscriptions.change(None,rules,result)
+		return result
+
+	@_deferrable
 	def putCallback(self,url,headers=""):
 		'''
 		Set the callback URL. To be used in place of LongPolling when deploying a webapp.
@@ -497,10 +810,10 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		payloadToSend = {"url":url}
 		if headers:
-			payload['headers':headers]
+			payloadToSend['headers'] = headers
 		data = self._putURL(url="/notification/callback",payload=payloadToSend, versioned=False)
 		if data.status_code == 204: #immediate success
 			result.error = False
@@ -512,6 +825,7 @@ class connector:
 		result.is_done = True
 		return result
 
+	@_deferrable
 	def getCallback(self):
 		'''
 		Get the callback URL currently registered with Connector. 
@@ -519,7 +833,7 @@ class connector:
 		:return: callback url in ``.result``, error if applicable in ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		data = self._getURL("/notification/callback",versioned=False)
 		if data.status_code == 200: #immediate success
 			result.error = False
@@ -531,6 +845,7 @@ class connector:
 		result.is_done = True
 		return result
 
+	@_deferrable
 	def deleteCallback(self):
 		'''
 		Delete the Callback URL currently registered with Connector.
@@ -538,7 +853,7 @@ class connector:
 		:return: successful ``.status_code`` / ``.is_done``. Check the ``.error``
 		:rtype: asyncResult
 		'''
-		result = asyncResult()
+		result = self._newResult()
 		data = self._deleteURL("/notification/callback")
 		if data.status_code == 204: #immediate success
 			result.result = data.content
@@ -582,13 +897,47 @@ class connector:
 		else:
 			self.log.warn("'%s' is not a legitimate notification channel option. Please check your spelling.",handler)
 
+	def on(self,channel,ep=None,path=None,cb=None):
+		'''
+		Subscribe to single events on a notification channel, filtered by endpoint and resource path.
+		Any number of subscribers can be added to each channel, they are called in addition to the
+		handler set with ``setHandler``. Patterns are shell style wildcards, in a path ``*`` matches
+		one segment and a final ``**`` matches the rest, e.g. ``on('notifications', ep='sensor-*', path='/3303/*/5700', cb=fn)``.
+		Callbacks get one channel entry as a ``notificationEvent``, ``registrationEvent`` or ``asyncResponseEvent``,
+		or the endpoint name for de-registrations and expired registrations.
+
+		:param str channel: name of the notification channel, see ``setHandler``
+		:param str ep: Optional - endpoint name pattern, all endpoints if not given
+		:param str path: Optional - resource path pattern, all paths if not given
+		:param fnptr cb: function to call with each matching event
+		:return: handle to pass to ``off``
+		:rtype: int
+		'''
+		if channel not in self._channels:
+			self.log.warn("'%s' is not a legitimate notification channel option. Please check your spelling.",channel)
+		return self._router.add(channel,cb,ep=ep,path=path)
+
+	def off(self,handle):
+		'''
+		Remove a subscription added with ``on``.
+
+		:param int handle: handle returned by ``on``
+		:return: True if the subscription existed
+		:rtype: bool
+		'''
+		return self._router.remove(handle)
+
 	# this function needs to spin off a thread that is constantally polling,
 	# should match asynch ID's to values and call their function
-	def startLongPolling(self, noWait=False):
+	def startLongPolling(self, noWait=False, pipelined=False, pipelineDepth=8):
 		'''
 		Start LongPolling Connector for notifications.
+		In pipelined mode the LongPoll thread only pulls, a second thread parses and dispatches what was pulled,
+		so the next pull is already outstanding while callbacks run. See ``pipelineStats``.
 		
 		:param bool noWait: Optional - use the cached values in connector, do not wait for the device to respond
+		:param bool pipelined: Optional - pull and dispatch on separate threads
+		:param int pipelineDepth: Optional - pulled bodies that may wait for dispatch before pulling pauses
 		:return: Thread of constantly running LongPoll. To be used to kill the thred if necessary.
 		:rtype: pythonThread
 		'''
@@ -603,6 +952,11 @@ class connector:
 		else:
 			# start infinite longpolling thread
 			self._stopLongPolling.clear()
+			if self.longPollThread.ident is not None: # a thread can only be started once
+				self.longPollThread = threading.Thread(target=self.longPoll,name="mdc-api-longpoll")
+				self.longPollThread.daemon = True
+			if pipelined:
+				self._startPipeline(pipelineDepth)
 			self.longPollThread.start()
 			self.log.info("Spun off LongPolling thread")
 		return self.longPollThread # return thread instance so user can manually intervene if necessary
@@ -626,23 +980,62 @@ class connector:
 	def longPoll(self, versioned=True):
 		self.log.debug("LongPolling Started, self.address = %s" %self.address)
 		while(not self._stopLongPolling.is_set()):
-			try:
-				if versioned:
-					data = r.get(self.address+self.apiVersion+'/notification/pull',headers={"Authorization":"Bearer "+self.bearer,"Connection":"keep-alive","accept":"application/json"})
+			delay = self._pollOnce(versioned)
+			if delay:
+				self._stopLongPolling.wait(delay) # back off, but wake up at once if stopped
+		self._stopPipeline(wait=True) # the thread ends once everything it pulled has been dispatched
+		self.log.info("Killing Longpolling Thread")
+
+	# pipelined long polling, pulled bodies go through a pollPipeline to its processor thread
+	def _startPipeline(self,depth):
+		self._pipeline = pollPipeline(self.handler,depth=depth)
+		self._lastPipeline = self._pipeline
+
+	# let the processor finish what has been pulled and exit, called from the polling side once it has stopped
+	def _stopPipeline(self,wait=False):
+		pipeline,self._pipeline = self._pipeline,None
+		if pipeline is not None:
+			pipeline.close(wait)
+
+	# single pull from the notification channel, shared by the longpoll thread and asyncConnector's poll task.
+	# Returns the seconds to wait before the next pull, as decided by the reconnect policy
+	def _pollOnce(self, versioned=True):
+		delay = self._reconnect.delay()
+		if delay:
+			return delay # circuit is open, no pull until it is time to probe
+		try:
+			addr = self.address+self.apiVersion+'/notification/pull' if versioned else self.address+'/notification/pull'
+			data = self._transport.get(addr,headers={"accept":"application/json"})
+			self.log.debug("Longpoll Returned, len = %d, statuscode=%d",len(data.text),data.status_code)
+			if data.status_code not in (200,204):
+				delay = self._reconnect.failure("HTTP status %d" % data.status_code)
+				self.log.warn("longPolling returned status %d, next pull in %.1f seconds",data.status_code,delay)
+				return delay
+			self._reconnect.success()
+			# process callbacks
+			if data.status_code == 200: # 204 means no content, do nothing
+				pipeline = self._pipeline
+				if pipeline is not None:
+					pipeline.put(data.content)
 				else:
-					data = r.get(self.address+'/notification/pull',headers={"Authorization":"Bearer "+self.bearer,"Connection":"keep-alive","accept":"application/json"})
-				self.log.debug("Longpoll Returned, len = %d, statuscode=%d",len(data.text),data.status_code)
-				# process callbacks
-				if data.status_code == 200: # 204 means no content, do nothing
 					self.handler(data.content)
-					self.log.debug("Longpoll data = "+data.content)
-			except:
+				self.log.debug("Longpoll data = "+data.content)
+			return 0
+		except:
+			delay = self._reconnect.failure(str(sys.exc_info()[1]))
+			if self._reconnect.consecutiveFailures == 1:
 				self.log.error("longPolling had an issue and threw an exception")
 				ex_type, ex, tb = sys.exc_info()
 				traceback.print_tb(tb)
 				self.log.error(sys.exc_info())
 				del tb
-		self.log.info("Killing Longpolling Thread")
+			else:
+				# only the first failure in a row gets a traceback, an outage should not flood the log
+				self.log.warn("longPolling failed %d times in a row, next pull in %.1f seconds : %s",
+								self._reconnect.consecutiveFailures,delay,str(sys.exc_info()[1]))
+			return delay
+		finally:
+			self.database['async-responses'].sweep()
 
 	# parse the notification channel responses and call appropriate handlers
 	def handler(self,data):
@@ -663,11 +1056,22 @@ class connector:
 		else:
 			self.log.error("Input is not valid request object or json string : %s" %str(data))
 			return False
+		# expire unanswered async-responses here too, in callback URL mode there is no long poll to do it
+		self.database['async-responses'].sweepDue()
 		try:
-			data = json.loads(data)
+			data = codec.loads(data)
+			# one event object per entry, so payloads are decoded at most once for the cache and subscribers
+			events = dict((channel,[makeEvent(channel,item) for item in data[channel]]) for channel in self._channels if channel in data)
+			if 'notifications' in events:
+				self._cacheNotifications(events['notifications'])
+			self._updateDirectory(data)
+			if self._dispatcher is not None:
+				self._dispatch(data,events)
+				return
 			if 'async-responses' in data.keys():
-				self.async_responses_callback(data)
+				self._callAsync(self.async_responses_callback,data,events['async-responses'])
 			if 'notifications' in data.keys():
+				self._observeLag(events['notifications'])
 				self.notifications_callback(data)
 			if 'registrations' in data.keys():
 				self.registrations_callback(data)
@@ -677,6 +1081,10 @@ class connector:
 				self.de_registrations_callback(data)
 			if 'registrations-expired' in data.keys():
 				self.registrations_expired_callback(data)
+			if len(self._router):
+				for channel in self._channels:
+					for event in events.get(channel,()):
+						self._route(channel,event)
 		except:
 			self.log.error("handle router had an issue and threw an exception")
 			ex_type, ex, tb = sys.exc_info()
@@ -684,6 +1092,160 @@ class connector:
 			self.log.error(sys.exc_info())
 			del tb
 
+	def transportStats(self):
+		'''
+		Get connection pool statistics for the HTTP transport used by this object.
+
+		:return: dictionary with ``requests``, ``hits``, ``misses``, ``pools`` and ``poolSize``
+		:rtype: dict
+		'''
+		return self._transport.stats()
+
+	def asyncResponseStats(self):
+		'''
+		Get statistics for the registry of requests waiting on an async-response.
+
+		:return: dictionary with ``pending``, ``evictions``, ``expired``, ``overflow``, ``early``, ``earlyMatched`` and ``unmatched`` counts
+		:rtype: dict
+		'''
+		return self.database['async-responses'].stats()
+
+	def cacheStats(self):
+		'''
+		Get statistics for the local resource value cache used by ``getResourceValue(..., useLocalCache=True)``.
+
+		:return: dictionary with ``entries``, ``bytes``, ``hits``, ``misses``, ``expired`` and ``evictions`` counts
+		:rtype: dict
+		'''
+		return self.cache.stats()
+
+	def longPollHealth(self):
+		'''
+		Get the health of the long poll, for use by health checks.
+
+		:return: dictionary with the reconnect policy ``state`` ('closed', 'open' or 'half-open'), ``consecutiveFailures``,
+			``totalFailures``, ``circuitOpens``, ``lastSuccess``, ``sinceLastSuccess`` and ``lastError``
+		:rtype: dict
+		'''
+		return self._reconnect.stats()
+
+	def pipelineStats(self):
+		'''
+		Get poll to dispatch lag statistics for pipelined long polling.
+
+		:return: dictionary with ``queued``, ``maxQueued``, ``processed``, ``avgLag`` and ``maxLag``, None if long polling has not been pipelined
+		:rtype: dict
+		'''
+		pipeline = self._lastPipeline
+		return pipeline.stats() if pipeline is not None else None
+
+	def rateLimitStats(self):
+		'''
+		Get statistics for the outbound rate limiter.
+
+		:return: dictionary with ``tokens``, ``budget``, ``throttled``, ``totalWait``, ``maxWait``, ``failed``, ``refreshes`` and ``lastRefresh``, None if there is no limiter
+		:rtype: dict
+		'''
+		return self._limiter.stats() if self._limiter is not None else None
+
+	def throttleWait(self):
+		'''
+		Get how long the next request would wait for the rate limiter.
+
+		:return: seconds until a request can be sent, 0 if it can be sent now or there is no limiter
+		:rtype: float
+		'''
+		return self._limiter.expectedWait() if self._limiter is not None else 0.0
+
+	def endpointGateStats(self):
+		'''
+		Get statistics for the per-endpoint in-flight limit.
+
+		:return: dictionary with ``busy``, ``inFlight``, ``waiting``, ``waits``, ``timeouts``, ``totalWait`` and ``maxWait``, None if endpoint requests are not limited
+		:rtype: dict
+		'''
+		return self._gate.stats() if self._gate is not None else None
+
+	def setRetryPolicy(self,policy,verb=None):
+		'''
+		Set how requests that get a transient status from connector are retried.
+
+		:param retryPolicy policy: the policy, None to never retry
+		:param str verb: Optional - HTTP method the policy applies to, e.g. 'POST', instead of the default for all requests
+		:return: none
+		'''
+		if verb is None:
+			self.retry = policy
+		else:
+			self._retryOverrides[verb.upper()] = policy
+
+	def retryStats(self):
+		'''
+		Get the number of retries made, by the status code that caused them.
+
+		:return: dictionary of status code to retry count, connection errors and timeouts are counted under 'error'
+		:rtype: dict
+		'''
+		with self._retryLock:
+			return dict(self._retryCounts)
+
+	def coalesceStats(self):
+		'''
+		Get statistics for coalescing of identical ``getResourceValue`` calls.
+
+		:return: dictionary with ``inFlight`` distinct reads and ``coalesced`` calls answered by another call's request
+		:rtype: dict
+		'''
+		with self._flightLock:
+			return {"inFlight":len(self._inFlight),"coalesced":self._coalesced}
+
+	def outboxStats(self):
+		'''
+		Get statistics for writes held for sleeping queue-mode endpoints.
+
+		:return: dictionary with ``asleep``, ``depth``, ``maxDepth``, ``held``, ``coalesced``, ``flushed``, ``dropped``, ``flushes``, ``avgFlushLatency`` and ``maxFlushLatency``, None if there is no outbox
+		:rtype: dict
+		'''
+		return self._outbox.stats() if self._outbox is not None else None
+
+	def preSubscriptionStats(self):
+		'''
+		Counters for ``addPreSubscriptions`` / ``removePreSubscriptions``.
+
+		:return: dictionary with ``rules`` on connector, ``pending`` changes, ``changes``, ``puts``, ``skipped`` and ``failed``
+		:rtype: dict
+		'''
+		return self._preSubscriptions.stats()
+
+	def metricsSnapshot(self):
+		'''
+		Get the metrics collected by this object: ``call_seconds`` histograms per API method and status code,
+		``http_request_seconds`` per HTTP verb and status code, ``notification_lag_seconds`` from the connector timestamp
+		of a notification to its callback, and gauges for pending async-responses and long poll health.
+
+		:return: dictionary as returned by :meth:`metrics.snapshot`, None if metrics are off
+		:rtype: dict
+		'''
+		return self.metrics.snapshot() if self.metrics is not None else None
+
+	def metricsText(self):
+		'''
+		Get the metrics collected by this object in Prometheus text exposition format, to be served on a /metrics page.
+
+		:return: the metrics, an empty string if metrics are off
+		:rtype: str
+		'''
+		return self.metrics.prometheus() if self.metrics is not None else ""
+
+	def dispatchStats(self):
+		'''
+		Get statistics for the notification dispatch workers.
+
+		:return: dictionary with ``queued``, ``maxQueued``, ``dispatched``, ``avgLatency`` and ``maxLatency``, None if callbacks are run inline
+		:rtype: dict
+		'''
+		return self._dispatcher.stats() if self._dispatcher is not None else None
+
 	# Turn on / off debug messages based on the onOff variable
 	def debug(self,onOff,level='DEBUG'):
 		'''
@@ -716,39 +1278,17 @@ class connector:
 
 	# internal async-requests handler.
 	# data input is json data
-	def _asyncHandler(self,data):
+	def _asyncHandler(self,data,events=None):
 		try:
-			responses = data['async-responses']
-			for entry in responses:
-				if entry['id'] in self.database['async-responses'].keys():
-					result = self.database['async-responses'].pop(entry['id']) # get the asynch object out of database
-					# fill in async-result object
-					if 'error' in entry.keys():
-						# error happened, handle it
-						result.error = response_codes('async-responses-handler',entry['status'])
-						result.error.error = entry['error']
-						result.is_done = True
-						if result.callback:
-							result.callback(result)
-						else: 
-							return result
-					else:
-						# everything is good, fill it out
-						result.result = b64decode(entry['payload'])
-						result.raw_data = entry
-						result.status = entry['status']
-						result.error = False
-						for thing in entry.keys():
-							result.extra[thing]=entry[thing]
-						result.is_done = True
-						# call associated callback function
-						if result.callback:
-							result.callback(result)
-						else:
-							self.log.warn("No callback function given")
+			if events is None:
+				events = [asyncResponseEvent(entry) for entry in data['async-responses']]
+			for event in events:
+				result = self.database['async-responses'].resolve(event.id,event) # get the asynch object out of database
+				if result is not None:
+					self._fillAsync(result,event)
 				else:
-					# TODO : object not found int asynch database
-					self.log.warn("No asynch entry for  '%s' found in databse",entry['id'])
+					# response arrived before its 202 was registered, the registry holds it until then
+					self.log.debug("No asynch entry for '%s' found in database yet, holding response",event.id)
 		except:
 			# TODO error handling here
 			self.log.error("Bad data encountered and failed to elegantly handle it. ")
@@ -758,6 +1298,220 @@ class connector:
 			del tb
 			return
 
+	# the default async-responses handler reuses the events handler() built, so payloads are decoded once.
+	# A handler set with setHandler gets the data as before
+	def _callAsync(self,fn,data,events):
+		if fn == self._asyncHandler:
+			self._asyncHandler(data,events)
+		else:
+			fn(data)
+
+	# fill in async-result object from an async-responses entry and call its callback.
+	# Called from _asyncHandler, or by the registry when a held response is matched
+	def _fillAsync(self,result,event):
+		if isinstance(event,dict):
+			event = asyncResponseEvent(event)
+		if 'error' in event:
+			# error happened, handle it
+			result.error = response_codes('async-responses-handler',event.status)
+			result.error.error = event.error
+			result.is_done = True
+		else:
+			# everything is good, fill it out
+			result.result = event.payload
+			result.raw_data = event.raw
+			result.status = event.status
+			result.error = False
+			result.extra.update(event.raw)
+			result.is_done = True
+		# call associated callback function
+		if result.callback:
+			result.callback(result)
+		else:
+			self.log.debug("No callback function given")
+
+	# store notification values in the local resource cache
+	def _cacheNotifications(self,events):
+		for n in events:
+			try:
+				if n.ep is None or n.path is None or n.payload is None:
+					raise KeyError('ep, path and payload are required')
+				self.cache.put(n.ep,n.path,n.payload,n.maxAge)
+			except (KeyError,TypeError,ValueError,AttributeError):
+				self.log.debug("notification not cached, missing or bad fields : %s",str(n))
+
+	# GET a JSON list and yield its elements as they are read off the connection
+	def _iterList(self,url,query,errParent,pageSize):
+		data = self._getURL(url,query=query,stream=True)
+		try:
+			if data.status_code != 200:
+				raise connectorException(response_codes(errParent,data.status_code))
+			for item in iterJSONArray(data.iter_content(pageSize)):
+				yield item
+		finally:
+			data.close() # hand the connection back to the pool even if the caller stops early
+
+	# split a notification batch into single events and queue them on the dispatcher.
+	# Each callback gets the same dictionary layout as before, with one entry in its channel list
+	def _dispatch(self,data,events):
+		channels = [('async-responses',self.async_responses_callback),
+					('notifications',self.notifications_callback),
+					('registrations',self.registrations_callback),
+					('reg-updates',self.reg_updates_callback),
+					('de-registrations',self.de_registrations_callback),
+					('registrations-expired',self.registrations_expired_callback)]
+		for channel,fn in channels:
+			for item,event in zip(data.get(channel,()),events.get(channel,())):
+				# order per endpoint, async responses carry no endpoint so use their id
+				key = item.get('ep',item.get('id')) if isinstance(item,dict) else item
+				self._dispatcher.submit(key,self._deliver,channel,item,event,fn)
+
+	# dispatcher task for one event, the setHandler callback then any routed subscribers
+	def _deliver(self,channel,item,event,fn):
+		if channel == 'notifications':
+			self._observeLag((event,))
+		try:
+			if channel == 'async-responses':
+				self._callAsync(fn,{channel:[item]},[event])
+			else:
+				fn({channel:[item]})
+		finally:
+			self._route(channel,event)
+
+	# seconds from the connector timestamp of each notification to its callback, epoch seconds or milliseconds
+	def _observeLag(self,events):
+		if self.metrics is None:
+			return
+		now = time.time()
+		for event in events:
+			stamp = event.timestamp if not isinstance(event,basestring) else None
+			if not isinstance(stamp,(int,long,float)) or isinstance(stamp,bool):
+				continue
+			if stamp > 1e11:
+				stamp = stamp/1000.0
+			self.metrics.observe('notification_lag_seconds',(),max(now-stamp,0.0))
+
+	# time an API call to the completion of its asyncResult, by method and status code
+	def _observeCall(self,name,start,result):
+		if not isinstance(result,asyncResult):
+			return
+		observe = self.metrics.observe
+		def done(result):
+			status = result.status_code
+			if status in ('',None):
+				status = 'error' if result.error else 'none'
+			observe('call_seconds',(name,str(status)),time.time()-start)
+		result.add_done_callback(done)
+
+	# gauges read when metrics are collected
+	def _longPollState(self):
+		return {'closed':0,'half-open':1,'open':2}.get(self._reconnect.stats()['state'])
+
+	def _sinceLastSuccess(self):
+		return self._reconnect.stats()['sinceLastSuccess']
+
+	# send one channel event to the subscribers added with on()
+	def _route(self,channel,event):
+		if isinstance(event,basestring):
+			self._router.route(channel,event,event,None)
+		else:
+			self._router.route(channel,event,event.ep,event.path)
+
+	# keep the endpoint directory current from the registration channels
+	def _updateDirectory(self,data):
+		for channel in ('registrations','reg-updates','de-registrations','registrations-expired'):
+			if channel in data:
+				try:
+					self.directory.update(channel,data[channel])
+				except (KeyError,TypeError,AttributeError):
+					self.log.warn("could not apply '%s' to the endpoint directory : %s",channel,str(data[channel]))
+				if channel in ('de-registrations','registrations-expired'):
+					for name in data[channel]:
+						self.cache.invalidate(name)
+				if self._outbox is not None:
+					self._outboxChannel(channel,data[channel])
+
+	# a coalesced read is done, hand its outcome to every caller that attached to it
+	def _finishFlight(self,key,flight,leader):
+		with self._flightLock:
+			if self._inFlight.get(key) is flight:
+				del self._inFlight[key]
+			followers = flight[:]
+			del flight[:]
+		for follower in followers:
+			self._mirrorResult(leader,follower)
+
+	# complete follower with the outcome of leader and call its callback
+	def _mirrorResult(self,leader,follower):
+		follower.result = leader.result
+		follower.raw_data = leader.raw_data
+		follower.status_code = leader.status_code
+		if hasattr(leader,'status'):
+			follower.status = leader.status
+		follower.extra.update(leader.extra)
+		follower.error = leader.error
+		follower.is_done = True
+		if follower.callback:
+			follower.callback(follower)
+
+	# True if a 409/429 for ep means a queue-mode device is asleep and its writes should be held
+	def _sleeping(self,ep):
+		if self._outbox is None:
+			return False
+		record = self.directory.get(ep)
+		return bool(record and record['queueMode'])
+
+	# keep a write for a sleeping queue-mode endpoint in the outbox, result is filled in when it is sent
+	def _holdWrite(self,ep,key,fn,args,result):
+		self.log.debug("holding %s %s for sleeping endpoint %s",key[0],key[1],ep)
+		self._outbox.hold(ep,key,fn,args,result)
+		return result
+
+	# flush the outbox when a registration notification shows an endpoint is awake, fail it when the endpoint is gone.
+	# Only notifications count, directory changes from getResources or syncDirectory say nothing about the device being awake
+	def _outboxChannel(self,channel,items):
+		for item in items:
+			if channel in ('registrations','reg-updates'):
+				name = item.get('ep') if isinstance(item,dict) else None
+				writes = self._outbox.take(name) if name is not None else None
+				if writes:
+					self.log.info("endpoint %s is awake, sending %d held writes",name,len(writes))
+					self._flushWrites(writes)
+			else:
+				for heldAt,fn,args,result,replaced in self._outbox.drop(item):
+					result.error = response_codes("endpoint_deregistered","")
+					result.is_done = True
+					if result.callback:
+						result.callback(result)
+					for old in replaced:
+						self._mirrorResult(result,old)
+
+	# send held writes in one burst, off the notification thread
+	def _flushWrites(self,writes):
+		for heldAt,fn,args,result,replaced in writes:
+			for old in replaced:
+				result.add_done_callback(lambda leader,old=old: self._mirrorResult(leader,old))
+		if self._executor is not None:
+			for heldAt,fn,args,result,replaced in writes:
+				self._submit(result,fn,args,{})
+		else:
+			def send():
+				for heldAt,fn,args,result,replaced in writes:
+					self._run(result,fn,args,{})
+			t = threading.Thread(target=send,name="mdc-api-outbox")
+			t.daemon = True
+			t.start()
+
+	# done callback for getResourceValue, keep successful reads in the local resource cache
+	def _cacheResult(self,result):
+		if result.error is False:
+			self.cache.put(result.endpoint,result.resource,result.result,result.extra.get('max-age'))
+
+	# done callback for writes and deleteEndpoint, drop the cached value of the resource, or of the whole endpoint
+	def _invalidateCached(self,result):
+		if result.error is False:
+			self.cache.invalidate(result.endpoint,result.resource or None)
+
 	# default handler for notifications. User should impliment all of these in
 	# a L2 implimentation or in their webapp.
 	# @input data is a dictionary
@@ -788,55 +1542,234 @@ class connector:
 	# versioned tells the API whether to hit the /v#/ version. set to false for
 	#  commands that break with this, like the API and Connector version calls
 	# TODO: spin this off to be non-blocking
-	def _getURL(self, url,query={},versioned=True):
-		if versioned:
-			return r.get(self.address+self.apiVersion+url,headers={"Authorization":"Bearer "+self.bearer},params=query)
-		else:
-			return r.get(self.address+url,headers={"Authorization":"Bearer "+self.bearer},params=query)
+	def _getURL(self, url,query={},versioned=True,stream=False):
+		addr = self.address+self.apiVersion+url if versioned else self.address+url
+		return self._send("GET",addr,params=query,stream=stream)
 
 	# put data to URL with json payload in dataIn
 	def _putURL(self, url,payload=None,versioned=True):
-		if self._isJSON(payload):
-			self.log.debug("PUT payload is json")
-			if versioned:
-				return r.put(self.address+self.apiVersion+url,json=payload,headers={"Authorization":"Bearer "+self.bearer})
-			else:
-				return r.put(self.address+url,json=payload,headers={"Authorization":"Bearer "+self.bearer})
-		else:
+		addr = self.address+self.apiVersion+url if versioned else self.address+url
+		if payload is None:
+			return self._send("PUT",addr)
+		# serialize once here instead of checking with _isJSON and letting requests serialize again
+		try:
+			body = codec.encode(payload)
+		except (TypeError,ValueError,OverflowError):
 			self.log.debug("PUT payload is NOT json")
-			if versioned:
-				return r.put(self.address+self.apiVersion+url,data=payload,headers={"Authorization":"Bearer "+self.bearer})
-			else:
-				return r.put(self.address+url,data=payload,headers={"Authorization":"Bearer "+self.bearer})
+			return self._send("PUT",addr,data=payload)
+		self.log.debug("PUT payload is json")
+		return self._send("PUT",addr,data=body,headers={"Content-Type":"application/json"})
 
 	# put data to URL with json payload in dataIn
 	def _postURL(self, url,payload="",versioned=True):
 		addr = self.address+self.apiVersion+url if versioned else self.address+url
-		h = {"Authorization":"Bearer "+self.bearer}
 		if payload:
 			self.log.info("POSTing with payload: %s ",payload)
-			return r.post(addr,data=payload,headers=h)
+			return self._send("POST",addr,data=payload)
 		else:
 			self.log.info("POSTing")
-			return r.post(addr,headers=h)
+			return self._send("POST",addr)
 
 	# delete endpoint
 	def _deleteURL(self, url,versioned=True):
-		if versioned:
-			return r.delete(self.address+self.apiVersion+url,headers={"Authorization":"Bearer "+self.bearer})
-		else:
-			return r.delete(self.address+url,headers={"Authorization":"Bearer "+self.bearer})
+		addr = self.address+self.apiVersion+url if versioned else self.address+url
+		return self._send("DELETE",addr)
+
+	# send one request through the rate limiter, retrying transient failures as the retry policy for the verb allows
+	def _send(self,verb,addr,**kwargs):
+		policy = self._retryOverrides.get(verb,self.retry)
+		start = time.time()
+		attempt = 1
+		while True:
+			self._throttle()
+			sent = time.time()
+			try:
+				data = self._transport.request(verb,addr,**kwargs)
+			except (r.exceptions.ConnectionError,r.exceptions.Timeout) as e:
+				if self.metrics is not None:
+					self.metrics.observe('http_request_seconds',(verb,'error'),time.time()-sent)
+				delay = policy.retryDelay(verb,None,attempt,time.time()-start) if policy is not None else None
+				if delay is None:
+					raise
+				status = 'error'
+				self.log.warn("%s %s failed, attempt %d, retrying in %.2f seconds : %s",verb,addr,attempt,delay,str(e))
+			else:
+				if self.metrics is not None:
+					self.metrics.observe('http_request_seconds',(verb,str(data.status_code)),time.time()-sent)
+				if policy is None or data.status_code not in policy.codes:
+					return data
+				delay = policy.retryDelay(verb,data.status_code,attempt,time.time()-start,self._retryAfter(data))
+				if delay is None:
+					return data
+				status = data.status_code
+				data.close()
+				self.log.warn("%s %s returned %d, attempt %d, retrying in %.2f seconds",verb,addr,status,attempt,delay)
+			with self._retryLock:
+				self._retryCounts[status] = self._retryCounts.get(status,0)+1
+			time.sleep(delay)
+			attempt += 1
+
+	# seconds asked for by a Retry-After header, None if there is none or it is a date
+	def _retryAfter(self,data):
+		try:
+			return float(data.headers.get('retry-after'))
+		except (TypeError,ValueError):
+			return None
+
+	# send a request that goes through to the device, holding one of the endpoint's in-flight slots
+	# until result is done. For a 202 that is when the async-response arrives or times out
+	def _endpointRequest(self,ep,result,send,*args,**kwargs):
+		if self._gate is None:
+			return send(*args,**kwargs)
+		slot = getattr(self._local,'slot',None) # taken before _run was submitted
+		self._local.slot = None
+		if slot is None:
+			slot = self._gate.acquire(ep,self._gateWait)
+		if slot is None:
+			raise connectorException(response_codes("endpoint_busy",""))
+		result.add_done_callback(slot.release)
+		try:
+			data = send(*args,**kwargs)
+		except:
+			slot.release()
+			raise
+		if data.status_code in (409,429):
+			slot.release() # refused, nothing is in flight on the device. The write may be held in the outbox
+		return data
+
+	# wait for, or fail on, the rate limiter before a request is sent
+	def _throttle(self):
+		if self._limiter is not None:
+			self._limiter.acquire()
+
+	# remaining transaction budget for the rate limiter. Goes straight to the transport, it must not be throttled itself
+	def _refreshLimits(self):
+		data = self._transport.get(self.address+self.apiVersion+"/limits")
+		if data.status_code != 200:
+			return None
+		return self._remainingBudget(codec.loads(data.content))
+
+	# pre-subscription rules for the incremental changes, read inline on the batch thread
+	def _loadPreSubscriptions(self):
+		result = self.getPreSubscription._fn(self)
+		if result.error:
+			raise connectorException(result.error)
+		return result.result
+
+	def _storePreSubscriptions(self,rules):
+		return self.putPreSubscription._fn(self,rules)
+
+	def _remainingBudget(self,limits):
+		try:
+			return int(limits['transaction-quota'])-int(limits['transaction-count'])
+		except (KeyError,TypeError,ValueError):
+			return None
 
 
 	# check if input is json, return true or false accordingly
 	def _isJSON(self,dataIn):
 		try:
-			json.dumps(dataIn)
+			codec.encode(dataIn)
 			return True
 		except:
 			self.log.debug("[_isJSON] exception triggered, input is not json")
 			return False
 
+	def shutdown(self,wait=True):
+		'''
+		Stop long polling, the notification dispatch workers and, if the connector created its own worker pool, the worker threads.
+		An executor passed in by the caller is left running.
+
+		:param bool wait: Optional - block until queued work has finished
+		:return: none
+		'''
+		self._stopLongPolling.set()
+		if self._ownExecutor:
+			self._executor.shutdown(wait)
+		if self._dispatcher is not None:
+			self._dispatcher.shutdown(wait)
+
+	# hand the call off to the executor, return the asyncResult it will fill in
+	def _defer(self,fn,args,kwargs,cbfnIndex,executor=None):
+		cbfn = kwargs.get('cbfn',"")
+		if cbfnIndex is not None and len(args) > cbfnIndex:
+			cbfn = args[cbfnIndex]
+		result = asyncResult(callback=cbfn)
+		self._submit(result,fn,args,kwargs,executor)
+		return result
+
+	# submit a call to the executor. A call for a busy endpoint is queued on the gate and submitted with its slot
+	# when the slot is released, so workers never wait for an endpoint
+	def _submit(self,result,fn,args,kwargs,executor=None):
+		executor = executor or self._executor
+		if self._gate is None or fn.__name__ not in _gatedCalls:
+			executor.submit(self._run,result,fn,args,kwargs)
+			return
+		ep = args[0] if args else kwargs.get('ep')
+		slot = self._gate.park(ep,lambda slot: self._resume(executor,result,fn,args,kwargs,slot),
+						self._gateWait,lambda: self._gateExpired(result))
+		if slot is not None:
+			executor.submit(self._run,result,fn,args,kwargs,slot)
+
+	# submit a parked call with the slot handed to it. Runs on the thread releasing the slot, so a call that
+	# cannot be submitted, e.g. because the executor was shut down, gives the slot back and fails here
+	def _resume(self,executor,result,fn,args,kwargs,slot):
+		try:
+			executor.submit(self._run,result,fn,args,kwargs,slot)
+		except Exception as e:
+			self.log.error("%s could not be resumed : %s",fn.__name__,str(e))
+			slot.release()
+			result.error = self._errorFor(e)
+			result.is_done = True
+			if result.callback:
+				result.callback(result)
+
+	# a queued call waited longer than endpointWait for its endpoint
+	def _gateExpired(self,result):
+		result.error = response_codes("endpoint_busy","")
+		result.is_done = True
+		if result.callback:
+			result.callback(result)
+
+	# executor side of _defer, covers the HTTP request. A 202 is then resolved through async-responses as usual.
+	# slot is the endpoint slot taken for the call, given back here if the call did not send a request with it
+	def _run(self,result,fn,args,kwargs,slot=None):
+		self._local.result = result # picked up by _newResult inside fn
+		self._local.inline = True # calls made by fn run on this thread
+		self._local.slot = slot # picked up by _endpointRequest
+		try:
+			fn(self,*args,**kwargs)
+		except Exception as e:
+			if not isinstance(e,connectorException):
+				self.log.error("%s failed : %s",fn.__name__,str(e))
+			result.error = self._errorFor(e)
+			result.is_done = True
+			if result.callback:
+				result.callback(result)
+		finally:
+			self._local.result = None
+			self._local.inline = False
+			if self._local.slot is not None:
+				self._local.slot.release() # answered from a cache, coalesced or held, nothing was sent
+				self._local.slot = None
+
+	# error for a request that raised. A connectorException was refused before a request was sent, e.g. by the rate limiter
+	def _errorFor(self,e):
+		if isinstance(e,connectorException):
+			return e.error
+		error = response_codes("request_failed","")
+		error.error = str(e)
+		return error
+
+	# create the asyncResult for an API call. If a result was handed in for this thread
+	# by _run it is used instead, so the caller's object is the one that gets filled in
+	def _newResult(self,callback=""):
+		result = getattr(self._local,'result',None)
+		if result is None:
+			return asyncResult(callback=callback)
+		self._local.result = None
+		return result
+
 	# extend dictionary class so we can instantiate multiple levels at once
 	class vividict(dict):
 		def __missing__(self, key):
@@ -847,9 +1780,28 @@ class connector:
 	def __init__(	self,
 					token,
 					webAddress="https://api.connector.mbed.com",
-					port="80",):
+					port="80",
+					poolSize=10,
+					executor=None,
+					asyncTimeout=300,
+					maxPendingAsync=10000,
+					cacheEntries=10000,
+					cacheBytes=8*1024*1024,
+					dispatchWorkers=0,
+					dispatchQueue=1000,
+					reconnect=None,
+					limiter=None,
+					endpointSlots=0,
+					endpointWait=None,
+					retry=None,
+					coalesceReads=False,
+					queueOutbox=False,
+					preSubscriptionWindow=0.05,
+					collectMetrics=True):
 		# set token
 		self.bearer = token
+		# pooled keep-alive transport used by all REST calls. The Authorization header is prebuilt, and rebuilt if bearer is changed
+		self._transport = transport(lambda: self.bearer,poolSize=poolSize)
 		# set version of REST API
 		self.apiVersion = "/v2"
 		# Init database, used for callback fn's for various tasks (asynch, subscriptions...etc)
@@ -859,7 +1811,61 @@ class connector:
 		self.database['reg-updates']
 		self.database['de-registrations']
 		self.database['registrations-expired']
-		self.database['async-responses']
+		# pending 202 responses, completed with an error if not answered within asyncTimeout seconds
+		self.database['async-responses'] = asyncRegistry(self._fillAsync,ttl=asyncTimeout,maxSize=maxPendingAsync)
+		# local resource values from notifications and reads, for getResourceValue(useLocalCache=True)
+		self.cache = resourceCache(maxEntries=cacheEntries,maxBytes=cacheBytes)
+		# notification callbacks run on dispatchWorkers threads, ordered per endpoint. 0 runs them inline in handler()
+		self._dispatcher = notificationDispatcher(workers=dispatchWorkers,maxQueue=dispatchQueue) if dispatchWorkers > 0 else None
+		# pattern subscriptions added with on(), per notification channel
+		self._channels = ('async-responses','notifications','registrations','reg-updates','de-registrations','registrations-expired')
+		self._router = notificationRouter()
+		# endpoints and resources on the domain, see syncDirectory
+		self.directory = endpointDirectory()
+		# per thread asyncResult handed to _newResult by deferred calls
+		self._local = threading.local()
+		# executor mode, REST calls are submitted to the executor and return immediately.
+		# executor can be anything with a concurrent.futures style submit(), or a number of worker threads
+		self._ownExecutor = isinstance(executor,int) and not isinstance(executor,bool)
+		self._executor = workerPool(workers=executor) if self._ownExecutor else executor
+		# backoff and circuit breaker for failed long poll pulls, see longPollHealth
+		self._reconnect = reconnect if reconnect is not None else reconnectPolicy()
+		# processor stage for pipelined long polling, None when pulls are handled on the polling thread
+		self._pipeline = None
+		self._lastPipeline = None
+		# optional rateLimiter applied to every request, its budget is kept current from /limits
+		self._limiter = limiter
+		if limiter is not None and limiter.refresher is None:
+			limiter.refresher = self._refreshLimits
+		# requests in flight per endpoint, further requests for a busy endpoint wait for up to endpointWait seconds. 0 does not limit
+		self._gate = endpointGate(slots=endpointSlots) if endpointSlots > 0 else None
+		self._gateWait = endpointWait
+		# retryPolicy for 429/502/503/504 and connection errors, None never retries. See setRetryPolicy for per verb policies
+		self.retry = retry
+		self._retryOverrides = {}
+		self._retryLock = threading.Lock()
+		self._retryCounts = {}
+		# getResourceValue calls for a read already in flight share its request, keyed by (ep, res, noResp, cacheOnly)
+		self._coalesceReads = coalesceReads
+		self._flightLock = threading.Lock()
+		self._inFlight = {}
+		self._coalesced = 0
+		# writes to sleeping queue-mode endpoints are held and sent when the endpoint registers or updates its registration
+		self._outbox = endpointOutbox() if queueOutbox else None
+		# cached pre-subscription rules for addPreSubscriptions / removePreSubscriptions, changes within the window share one PUT
+		self._preSubscriptions = preSubscriptionSet(window=preSubscriptionWindow)
+		self._preSubscriptions.load = self._loadPreSubscriptions
+		self._preSubscriptions.store = self._storePreSubscriptions
+		# latency histograms and gauges, see metricsSnapshot / metricsText. None when collectMetrics is off
+		self.metrics = metrics() if collectMetrics else None
+		if self.metrics is not None:
+			self.metrics.histogram('call_seconds',"Seconds from an API call to its result being done",('method','status'))
+			self.metrics.histogram('http_request_seconds',"Seconds per HTTP request to connector",('verb','status'))
+			self.metrics.histogram('notification_lag_seconds',"Seconds from the connector timestamp of a notification to its callback",())
+			self.metrics.gauge('async_responses_pending',"Requests waiting on an async-response",lambda: len(self.database['async-responses']))
+			self.metrics.gauge('longpoll_circuit_state',"Long poll circuit breaker, 0 closed, 1 half-open, 2 open",self._longPollState)
+			self.metrics.gauge('longpoll_consecutive_failures',"Long poll pulls failed since the last success",lambda: self._reconnect.stats()['consecutiveFailures'])
+			self.metrics.gauge('longpoll_seconds_since_success',"Seconds since the last successful long poll pull",self._sinceLastSuccess)
 		# longpolling variable
 		self._stopLongPolling = threading.Event() # must initialize false to avoid race condition
 		self._stopLongPolling.clear()
@@ -0,0 +1,143 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import bisect
+import sys
+import traceback
+import logging
+
+# upper bounds in seconds, shared by every histogram
+BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0)
+
+class metrics:
+	"""
+	Latency histograms and gauges for a connector. Histograms are declared once with their label names and
+	``observe`` adds a sample in one short lock and a bisect, so collection can stay on in production.
+	A histogram's ``count`` is also its counter. Gauges are functions read only when a snapshot is taken.
+
+	``snapshot`` returns the values as a dictionary, ``prometheus`` as Prometheus text exposition.
+
+	:var prefix: prepended to every metric name in the Prometheus output
+	"""
+
+	def histogram(self,name,description,labels):
+		'''
+		Declare a histogram.
+
+		:param str name: metric name
+		:param str description: help text for the Prometheus output
+		:param tuple labels: label names, ``observe`` is given values in the same order
+		:return: none
+		'''
+		with self._lock:
+			self._histograms.setdefault(name,(description,tuple(labels),{}))
+
+	def gauge(self,name,description,fn):
+		'''
+		Declare a gauge.
+
+		:param str name: metric name
+		:param str description: help text for the Prometheus output
+		:param fnptr fn: function returning the current value, called when a snapshot is taken
+		:return: none
+		'''
+		with self._lock:
+			self._gauges[name] = (description,fn)
+
+	def observe(self,name,labels,value):
+		'''
+		Add a sample to a histogram.
+
+		:param str name: metric name, declared with ``histogram``
+		:param tuple labels: label values
+		:param float value: the sample, in seconds
+		:return: none
+		'''
+		i = bisect.bisect_left(BUCKETS,value)
+		with self._lock:
+			series = self._histograms[name][2]
+			s = series.get(labels)
+			if s is None:
+				s = series[labels] = [0,0.0,[0]*(len(BUCKETS)+1)] # count, sum, samples per bucket
+			s[0] += 1
+			s[1] += value
+			s[2][i] += 1
+
+	def snapshot(self):
+		'''
+		:return: dictionary of metric name to its value for gauges, or for histograms a dictionary of label values to
+			``count``, ``sum`` and cumulative ``buckets`` (a list of (upper bound, count) pairs ending with 'inf')
+		:rtype: dict
+		'''
+		result = {}
+		with self._lock:
+			for name,(description,labelNames,series) in self._histograms.iteritems():
+				result[name] = dict((labels,{"count":s[0],"sum":s[1],"buckets":self._cumulative(s[2])}) for labels,s in series.iteritems())
+			gauges = self._gauges.items()
+		for name,(description,fn) in gauges:
+			result[name] = self._read(name,fn)
+		return result
+
+	def prometheus(self):
+		'''
+		:return: all metrics in Prometheus text exposition format, version 0.0.4
+		:rtype: str
+		'''
+		lines = []
+		with self._lock:
+			histograms = [(name,description,labelNames,[(labels,s[0],s[1],self._cumulative(s[2])) for labels,s in series.iteritems()])
+							for name,(description,labelNames,series) in sorted(self._histograms.iteritems())]
+			gauges = sorted(self._gauges.items())
+		for name,description,labelNames,series in histograms:
+			name = self.prefix+name
+			lines.append("# HELP %s %s" % (name,description))
+			lines.append("# TYPE %s histogram" % name)
+			for labels,count,total,buckets in sorted(series):
+				pairs = ['%s="%s"' % (k,self._escape(v)) for k,v in zip(labelNames,labels)]
+				for le,n in buckets:
+					lines.append("%s_bucket{%s} %d" % (name,",".join(pairs+['le="%s"' % ("+Inf" if le == 'inf' else repr(le))]),n))
+				lines.append("%s_sum{%s} %s" % (name,",".join(pairs),repr(total)))
+				lines.append("%s_count{%s} %d" % (name,",".join(pairs),count))
+		for name,(description,fn) in gauges:
+			value = self._read(name,fn)
+			if value is None:
+				continue
+			name = self.prefix+name
+			lines.append("# HELP %s %s" % (name,description))
+			lines.append("# TYPE %s gauge" % name)
+			lines.append("%s %s" % (name,repr(float(value))))
+		return "\n".join(lines)+"\n"
+
+	def _cumulative(self,counts):
+		buckets = []
+		n = 0
+		for le,c in zip(BUCKETS+('inf',),counts):
+			n += c
+			buckets.append((le,n))
+		return buckets
+
+	def _escape(self,value):
+		return str(value).replace("\\","\\\\").replace("\"","\\\"").replace("\n","\\n")
+
+	def _read(self,name,fn):
+		try:
+			return fn()
+		except:
+			self.log.error("metrics could not read gauge %s",name)
+			ex_type, ex, tb = sys.exc_info()
+			traceback.print_tb(tb)
+			self.log.error(sys.exc_info())
+			del tb
+			return None
+
+	def __init__(self,prefix="mbed_connector_"):
+		'''
+		:param str prefix: Optional - prepended to metric names in the Prometheus output
+		'''
+		self.prefix = prefix
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._lock = threading.Lock()
+		self._histograms = {} # name : (description, label names, {label values : [count, sum, per bucket counts]})
+		self._gauges = {} # name : (description, fn)
@@ -0,0 +1,98 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import Queue
+import time
+import sys
+import traceback
+import logging
+
+class notificationDispatcher:
+	"""
+	Runs notification callbacks on a pool of worker threads so slow callbacks do not hold up the long poll.
+	Every event is submitted with a key, usually the endpoint name. Events with the same key always go to
+	the same worker and so run in the order they were submitted, events with different keys run in parallel.
+	Each worker has a bounded queue, when it is full ``submit`` blocks which pushes back on the long poll.
+
+	:var workers: number of worker threads
+	"""
+
+	def submit(self,key,fn,*args):
+		"""
+		Queue ``fn(*args)`` behind earlier work for the same key.
+
+		:param key: ordering key, usually the endpoint name
+		:param fnptr fn: function to call
+		:return: none
+		"""
+		self._queues[hash(key) % self.workers].put((time.time(),fn,args))
+
+	def stats(self):
+		"""
+		:return: dictionary with ``queued`` events now waiting, ``maxQueued`` seen, ``dispatched`` count,
+			and ``avgLatency`` / ``maxLatency`` in seconds from submit to the callback starting
+		:rtype: dict
+		"""
+		with self._lock:
+			return {"queued":sum(q.qsize() for q in self._queues),
+					"maxQueued":self._maxQueued,
+					"dispatched":self._dispatched,
+					"avgLatency":self._totalLatency/self._dispatched if self._dispatched else 0.0,
+					"maxLatency":self._maxLatency}
+
+	def shutdown(self,wait=True):
+		"""
+		Stop the workers once the queued events have been dispatched.
+
+		:param bool wait: Optional - block until all workers have exited
+		:return: none
+		"""
+		for q in self._queues:
+			q.put(None)
+		if wait:
+			for t in self._threads:
+				t.join()
+
+	def _work(self,queue):
+		while True:
+			task = queue.get()
+			if task is None:
+				return
+			queued,fn,args = task
+			latency = time.time()-queued
+			depth = queue.qsize()+1
+			with self._lock:
+				self._dispatched += 1
+				self._totalLatency += latency
+				self._maxLatency = max(self._maxLatency,latency)
+				self._maxQueued = max(self._maxQueued,depth)
+			try:
+				fn(*args)
+			except:
+				self.log.error("notification callback threw an exception")
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+
+	def __init__(self,workers=4,maxQueue=1000):
+		'''
+		:param int workers: number of worker threads
+		:param int maxQueue: events each worker may have queued before submit blocks
+		'''
+		self.workers = max(workers,1)
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._lock = threading.Lock()
+		self._dispatched = 0
+		self._totalLatency = 0.0
+		self._maxLatency = 0.0
+		self._maxQueued = 0
+		self._queues = [Queue.Queue(maxsize=maxQueue) for x in range(self.workers)]
+		self._threads = []
+		for x in range(self.workers):
+			t = threading.Thread(target=self._work,args=(self._queues[x],),name="mdc-api-dispatch-"+str(x))
+			t.daemon = True
+			t.start()
+			self._threads.append(t)
@@ -0,0 +1,164 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import time
+from base64 import standard_b64decode as b64decode
+
+_undecoded = object()
+
+class _event(object):
+	"""
+	Read only view of one entry of a notification channel. The entry dictionary is kept as ``raw`` and not
+	copied, fields are read from it when asked for. Dictionary style access is passed through to ``raw``
+	so code written for plain entries keeps working.
+	"""
+	__slots__ = ('raw','received')
+
+	def __init__(self,raw):
+		self.raw = raw
+		self.received = time.time()
+
+	def __getitem__(self,key):
+		return self.raw[key]
+
+	def __contains__(self,key):
+		return key in self.raw
+
+	def get(self,key,default=None):
+		return self.raw.get(key,default)
+
+	def keys(self):
+		return self.raw.keys()
+
+	def __repr__(self):
+		return "%s(%r)" % (type(self).__name__,self.raw)
+
+	@property
+	def ep(self):
+		'''name of the endpoint the entry is about'''
+		return self.raw.get('ep')
+
+	@property
+	def path(self):
+		'''resource path, None for entries that are not about a resource'''
+		return None
+
+class _payloadEvent(_event):
+	"""Entry with a base64 ``payload``, decoded the first time it is read"""
+	__slots__ = ('_payload',)
+
+	def __init__(self,raw):
+		_event.__init__(self,raw)
+		self._payload = _undecoded
+
+	@property
+	def payload(self):
+		'''decoded payload bytes, None if the entry has no payload'''
+		if self._payload is _undecoded:
+			payload = self.raw.get('payload')
+			self._payload = b64decode(payload) if payload is not None else None
+		return self._payload
+
+	@property
+	def view(self):
+		'''memoryview over the decoded payload, None if the entry has no payload'''
+		payload = self.payload
+		return memoryview(payload) if payload is not None else None
+
+	@property
+	def ct(self):
+		'''content type of the payload'''
+		return self.raw.get('ct')
+
+	@property
+	def maxAge(self):
+		'''seconds the value stays fresh, None if not given'''
+		return self.raw.get('max-age')
+
+class notificationEvent(_payloadEvent):
+	"""
+	One entry of the ``notifications`` channel, a new value of a subscribed resource.
+
+	:var raw: the entry dictionary as sent by connector
+	:var received: time the entry was read off the notification channel
+	"""
+	__slots__ = ()
+
+	@property
+	def path(self):
+		'''resource path'''
+		return self.raw.get('path')
+
+	@property
+	def timestamp(self):
+		'''time connector stamped on the notification, None if not given'''
+		return self.raw.get('timestamp')
+
+class asyncResponseEvent(_payloadEvent):
+	"""
+	One entry of the ``async-responses`` channel, the answer to an earlier request that returned an async id.
+
+	:var raw: the entry dictionary as sent by connector
+	:var received: time the entry was read off the notification channel
+	"""
+	__slots__ = ()
+
+	@property
+	def id(self):
+		'''async id of the request being answered'''
+		return self.raw.get('id')
+
+	@property
+	def status(self):
+		'''status code the endpoint answered with'''
+		return self.raw.get('status')
+
+	@property
+	def error(self):
+		'''error description, None if the request succeeded'''
+		return self.raw.get('error')
+
+class registrationEvent(_event):
+	"""
+	One entry of the ``registrations`` or ``reg-updates`` channel.
+
+	:var raw: the entry dictionary as sent by connector
+	:var received: time the entry was read off the notification channel
+	"""
+	__slots__ = ()
+
+	@property
+	def ept(self):
+		'''endpoint type'''
+		return self.raw.get('ept')
+
+	@property
+	def queueMode(self):
+		'''True if the endpoint is in queue mode'''
+		q = self.raw.get('q',False)
+		return q is True or str(q).lower() == 'true'
+
+	@property
+	def resources(self):
+		'''list of resource descriptions registered by the endpoint'''
+		return self.raw.get('resources',[])
+
+_types = {'notifications':notificationEvent,
+		'async-responses':asyncResponseEvent,
+		'registrations':registrationEvent,
+		'reg-updates':registrationEvent}
+
+def makeEvent(channel,item):
+	"""
+	Wrap an entry of a notification channel in the matching event class. Entries of the
+	``de-registrations`` and ``registrations-expired`` channels are endpoint names and are returned as they are.
+
+	:param str channel: name of the notification channel
+	:param item: the entry
+	:return: event object, or ``item`` if the channel has no event class
+	"""
+	cls = _types.get(channel)
+	if cls is None or not isinstance(item,dict):
+		return item
+	return cls(item)
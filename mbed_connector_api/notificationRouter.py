@@ -0,0 +1,236 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import itertools
+import sys
+import traceback
+import logging
+from fnmatch import fnmatchcase
+
+_globChars = "*?["
+
+class _pathNode:
+	"""Node of a path trie, one level per path segment"""
+	def __init__(self):
+		self.children = {} # literal segment : _pathNode
+		self.star = None # '*', any one segment
+		self.globs = [] # (segment pattern, _pathNode) for other wildcard segments
+		self.here = [] # subscribers whose pattern ends at this node
+		self.rest = [] # subscribers whose pattern ends with '**', any remaining segments
+
+	def add(self,segments,sub):
+		node = self
+		for x,seg in enumerate(segments):
+			if seg == "**" and x == len(segments)-1:
+				node.rest.append(sub)
+				return
+			if seg == "*":
+				node.star = node.star or _pathNode()
+				node = node.star
+			elif any(c in seg for c in _globChars):
+				for pattern,child in node.globs:
+					if pattern == seg:
+						node = child
+						break
+				else:
+					child = _pathNode()
+					node.globs.append((seg,child))
+					node = child
+			else:
+				node = node.children.setdefault(seg,_pathNode())
+		node.here.append(sub)
+
+	def match(self,segments,out):
+		# walk every branch that can match, at most one literal branch per level
+		nodes = [self]
+		for seg in segments:
+			following = []
+			for node in nodes:
+				out.extend(node.rest)
+				child = node.children.get(seg)
+				if child is not None:
+					following.append(child)
+				if node.star is not None:
+					following.append(node.star)
+				for pattern,child in node.globs:
+					if fnmatchcase(seg,pattern):
+						following.append(child)
+			nodes = following
+			if not nodes:
+				return
+		for node in nodes:
+			out.extend(node.rest)
+			out.extend(node.here)
+
+class _epNode:
+	"""Node of an endpoint name prefix trie, one level per character"""
+	def __init__(self):
+		self.children = {}
+		self.paths = None # _pathNode for patterns of the form 'prefix*' ending here
+
+class _channelIndex:
+	"""Endpoint and path index for the subscribers of one channel"""
+	def __init__(self):
+		self.exact = {} # endpoint name : _pathNode
+		self.prefixes = _epNode() # 'prefix*' patterns
+		self.any = None # _pathNode for subscribers to every endpoint
+		self.globs = [] # (endpoint pattern, _pathNode) for other wildcard patterns
+
+	def add(self,sub):
+		pattern = sub.ep
+		if pattern is None or pattern == "*":
+			self.any = self.any or _pathNode()
+			paths = self.any
+		elif not any(c in pattern for c in _globChars):
+			paths = self.exact.setdefault(pattern,_pathNode())
+		elif pattern.endswith("*") and not any(c in pattern[:-1] for c in _globChars):
+			node = self.prefixes
+			for c in pattern[:-1]:
+				node = node.children.setdefault(c,_epNode())
+			node.paths = node.paths or _pathNode()
+			paths = node.paths
+		else:
+			for glob,paths in self.globs:
+				if glob == pattern:
+					break
+			else:
+				paths = _pathNode()
+				self.globs.append((pattern,paths))
+		paths.add(sub.segments,sub)
+
+	def match(self,ep,path):
+		tries = []
+		if self.any is not None:
+			tries.append(self.any)
+		if ep is not None:
+			exact = self.exact.get(ep)
+			if exact is not None:
+				tries.append(exact)
+			node = self.prefixes
+			if node.paths is not None:
+				tries.append(node.paths)
+			for c in ep:
+				node = node.children.get(c)
+				if node is None:
+					break
+				if node.paths is not None:
+					tries.append(node.paths)
+			for glob,paths in self.globs:
+				if fnmatchcase(ep,glob):
+					tries.append(paths)
+		out = []
+		segments = _segments(path)
+		for paths in tries:
+			if path is None:
+				# events without a path only match subscribers that did not ask for one
+				out.extend(paths.rest)
+			else:
+				paths.match(segments,out)
+		return out
+
+class _subscriber:
+	def __init__(self,handle,channel,ep,path,cb):
+		self.handle = handle
+		self.channel = channel
+		self.ep = ep
+		self.path = path
+		self.cb = cb
+		self.segments = ["**"] if path is None else _segments(path)
+
+def _segments(path):
+	if path is None:
+		return []
+	return path.strip("/").split("/")
+
+class notificationRouter:
+	"""
+	Routing table sending individual notification channel events to every subscriber whose endpoint and
+	path patterns match. Patterns are shell style wildcards, ``*`` in a path matches exactly one segment
+	and a final ``**`` matches any number of segments. Endpoint patterns of the form ``prefix*`` and exact
+	names are looked up through a prefix trie and a hash table, and paths through a segment trie, so routing
+	an event costs about the same however many subscribers there are.
+	"""
+
+	def add(self,channel,cb,ep=None,path=None):
+		"""
+		Subscribe ``cb(event)`` to events on ``channel`` matching ``ep`` and ``path``.
+
+		:param str channel: notification channel name
+		:param fnptr cb: function to call with each matching event
+		:param str ep: Optional - endpoint name pattern, all endpoints if not given
+		:param str path: Optional - resource path pattern, all paths if not given
+		:return: handle to pass to ``remove``
+		:rtype: int
+		"""
+		with self._lock:
+			sub = _subscriber(next(self._handles),channel,ep,path,cb)
+			self._subs[sub.handle] = sub
+			self._rebuild()
+			return sub.handle
+
+	def remove(self,handle):
+		"""
+		Remove a subscription.
+
+		:param int handle: handle returned by ``add``
+		:return: True if the subscription existed
+		:rtype: bool
+		"""
+		with self._lock:
+			if self._subs.pop(handle,None) is None:
+				return False
+			self._rebuild()
+			return True
+
+	def match(self,channel,ep,path):
+		"""
+		:return: list of subscriber callbacks matching an event
+		:rtype: list
+		"""
+		index = self._index.get(channel)
+		if index is None:
+			return []
+		return [sub.cb for sub in index.match(ep,path)]
+
+	def route(self,channel,event,ep=None,path=None):
+		"""
+		Call every subscriber matching the event.
+
+		:param str channel: notification channel the event came from
+		:param event: the event passed to the callbacks
+		:param str ep: endpoint name of the event
+		:param str path: resource path of the event, None for events that are not about a resource
+		:return: number of callbacks called
+		:rtype: int
+		"""
+		callbacks = self.match(channel,ep,path)
+		for cb in callbacks:
+			try:
+				cb(event)
+			except:
+				self.log.error("routed notification callback threw an exception")
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+		return len(callbacks)
+
+	def __len__(self):
+		return len(self._subs)
+
+	# build a new index and swap it in, so route() never needs the lock. Caller holds the lock
+	def _rebuild(self):
+		index = {}
+		for handle in sorted(self._subs):
+			sub = self._subs[handle]
+			index.setdefault(sub.channel,_channelIndex()).add(sub)
+		self._index = index
+
+	def __init__(self):
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._lock = threading.Lock()
+		self._handles = itertools.count(1)
+		self._subs = {} # handle : _subscriber
+		self._index = {} # channel : _channelIndex
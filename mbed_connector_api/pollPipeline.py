@@ -0,0 +1,90 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import Queue
+import time
+import sys
+import traceback
+import logging
+
+class pollPipeline:
+	"""
+	Second stage of pipelined long polling. The thread doing ``/notification/pull`` hands each body to ``put``
+	and goes straight back to pulling, a processor thread parses and dispatches the bodies in the order they
+	were pulled. The queue between the two is bounded, when the processor falls ``depth`` bodies behind
+	``put`` blocks so the pulls slow down to match.
+	"""
+
+	def put(self,body):
+		'''
+		Queue a pulled body for processing.
+
+		:param str body: notification channel data as returned by the pull
+		:return: none
+		'''
+		self._queue.put((time.time(),body))
+
+	def stats(self):
+		'''
+		:return: dictionary with ``queued`` bodies now waiting, ``maxQueued`` seen, ``processed`` count, and
+			``avgLag`` / ``maxLag`` in seconds from the pull returning to its body being dispatched
+		:rtype: dict
+		'''
+		with self._lock:
+			return {"queued":self._queue.qsize(),
+					"maxQueued":self._maxQueued,
+					"processed":self._processed,
+					"avgLag":self._totalLag/self._processed if self._processed else 0.0,
+					"maxLag":self._maxLag}
+
+	def close(self,wait=False):
+		'''
+		Stop the processor once the queued bodies have been dispatched.
+
+		:param bool wait: Optional - block until the processor has exited
+		:return: none
+		'''
+		self._queue.put(None)
+		if wait:
+			self._thread.join()
+
+	def _work(self):
+		while True:
+			task = self._queue.get()
+			if task is None:
+				return
+			pulled,body = task
+			lag = time.time()-pulled
+			depth = self._queue.qsize()+1
+			with self._lock:
+				self._processed += 1
+				self._totalLag += lag
+				self._maxLag = max(self._maxLag,lag)
+				self._maxQueued = max(self._maxQueued,depth)
+			try:
+				self._handler(body)
+			except:
+				self.log.error("long poll processor threw an exception")
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+
+	def __init__(self,handler,depth=8):
+		'''
+		:param fnptr handler: called with each pulled body, usually ``connector.handler``
+		:param int depth: bodies that may wait for the processor before ``put`` blocks
+		'''
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._handler = handler
+		self._lock = threading.Lock()
+		self._processed = 0
+		self._totalLag = 0.0
+		self._maxLag = 0.0
+		self._maxQueued = 0
+		self._queue = Queue.Queue(maxsize=max(depth,1))
+		self._thread = threading.Thread(target=self._work,name="mdc-api-longpoll-processor")
+		self._thread.daemon = True
+		self._thread.start()
@@ -0,0 +1,182 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+
+# Pre-subscription patterns are literal, or end in a single '*' matching any suffix. None matches anything.
+
+def _pattern(value):
+	if value in (None,"","*"):
+		return None
+	return value
+
+def _covers(a,b):
+	if a is None:
+		return True
+	if b is None:
+		return False
+	if a.endswith("*"):
+		return b.startswith(a[:-1])
+	return a == b
+
+def _coveredBy(value,exact,stems):
+	# True if value is matched by one of the literal patterns in exact or prefix patterns in stems, other than itself
+	if value is None:
+		return False
+	if value.endswith("*"):
+		stem = value[:-1]
+		return any(stem[:i] in stems for i in range(len(stem)))
+	return value in exact or any(value[:i] in stems for i in range(len(value)+1))
+
+def expandRules(desired):
+	'''
+	Split rules into one (endpoint name, resource path, endpoint type) tuple per pattern combination.
+
+	:param list desired: (endpoint name, resource path[, endpoint type]) tuples or connector rule dictionaries
+	:return: tuples with '' and '*' patterns replaced by None
+	:rtype: list
+	'''
+	triples = []
+	for item in desired:
+		if isinstance(item,dict):
+			paths = item.get('resource-path')
+			if isinstance(paths,basestring):
+				paths = [paths]
+			for path in (paths or [None]):
+				triples.append((_pattern(item.get('endpoint-name')),_pattern(path),_pattern(item.get('endpoint-type'))))
+		else:
+			triples.append((_pattern(item[0]),_pattern(item[1]),_pattern(item[2]) if len(item) > 2 else None))
+	return triples
+
+class _patternSet:
+	"""Set of patterns answering 'does any of them match this value' in time linear in the value's length"""
+	def __init__(self,patterns):
+		self.any = None in patterns
+		self.exact = set(p for p in patterns if p is not None and not p.endswith("*"))
+		self.stems = set(p[:-1] for p in patterns if p is not None and p.endswith("*"))
+
+	def matches(self,value):
+		if self.any:
+			return True
+		if value is None:
+			return False
+		return value in self.exact or any(value[:i] in self.stems for i in range(len(value)+1))
+
+	def covers(self,pattern):
+		# True if everything the pattern matches is matched by the set
+		if self.any:
+			return True
+		if pattern is None:
+			return False
+		if pattern.endswith("*"):
+			return any(pattern[:i] in self.stems for i in range(len(pattern)))
+		return self.matches(pattern)
+
+	def minimal(self):
+		# patterns not covered by another pattern in the set, None if the set matches everything
+		if self.any:
+			return None
+		keep = [s+"*" for s in self.stems if not _coveredBy(s+"*",(),self.stems)]
+		keep += [p for p in self.exact if not _coveredBy(p,(),self.stems)]
+		return sorted(keep)
+
+class preSubscriptionRules:
+	"""
+	Compiles the notifications wanted, as (endpoint name, resource path) or (endpoint name, resource path, endpoint type)
+	patterns, into the smallest equivalent list of pre-subscription rules. Rules covered by broader rules are dropped
+	and rules for the same endpoint name and type are merged into one rule with a list of paths. The result can be
+	passed to ``putPreSubscription``, and ``matches`` tells locally whether an endpoint resource is covered.
+
+	Connector's own rule dictionaries (``endpoint-name``, ``endpoint-type``, ``resource-path``) are accepted as input too.
+
+	:var rules: the optimized rules, in connector's format
+	:var before: ``rules`` and ``pairs`` (name, type, path combinations) given
+	:var after: ``rules`` and ``pairs`` after optimization
+	"""
+
+	def matches(self,ep,path,ept=None):
+		'''
+		Check whether the rules subscribe a resource, without asking connector.
+
+		:param str ep: name of endpoint, rules naming an endpoint do not match if it is None
+		:param str path: resource path
+		:param str ept: Optional - endpoint type, rules naming a type do not match if it is not given
+		:return: True if the resource is pre-subscribed
+		:rtype: bool
+		'''
+		candidates = list(self._anyName)
+		if ep is not None:
+			candidates += self._byName.get(ep,())
+			for i in range(len(ep)+1):
+				candidates += self._byStem.get(ep[:i],())
+		for types,paths in candidates:
+			if types.matches(ept) and paths.matches(path):
+				return True
+		return False
+
+	def __len__(self):
+		return len(self.rules)
+
+	def _optimize(self,triples):
+		groups = {} # (name, type) : set of paths
+		for name,path,ept in triples:
+			groups.setdefault((name,ept),set()).add(path)
+		groups = dict((key,_patternSet(paths)) for key,paths in groups.iteritems())
+		# index group names so the groups that may cover a name are found without comparing every pair
+		byName = {}
+		for key in groups:
+			byName.setdefault(key[0],[]).append(key)
+		rules = []
+		for (name,ept),paths in sorted(groups.iteritems(),key=lambda g:(g[0][0] or "",g[0][1] or "")):
+			covering = list(byName.get(None,()))
+			if name is not None:
+				covering += byName.get(name,())
+				# names ending in '*' whose stem is a prefix of this name (or of this name's own stem)
+				stem = name[:-1] if name.endswith("*") else name
+				for i in range(len(stem)+(0 if name.endswith("*") else 1)):
+					covering += byName.get(stem[:i]+"*",())
+			remaining = paths.minimal()
+			for key in covering:
+				if key == (name,ept) or not _covers(key[1],ept):
+					continue
+				other = groups[key]
+				if other.any:
+					remaining = []
+					break
+				if remaining is None:
+					continue # every path here, the other group only covers some
+				remaining = [p for p in remaining if not other.covers(p)]
+			if remaining == []:
+				continue
+			rule = {}
+			if name is not None:
+				rule['endpoint-name'] = name
+			if ept is not None:
+				rule['endpoint-type'] = ept
+			if remaining is not None:
+				rule['resource-path'] = remaining
+			rules.append(rule)
+		return rules
+
+	def __init__(self,desired):
+		'''
+		:param list desired: (endpoint name, resource path[, endpoint type]) tuples or connector rule dictionaries.
+			Patterns may end in '*', None or '*' matches anything
+		'''
+		desired = list(desired)
+		triples = expandRules(desired)
+		self.before = {"rules":len(desired),"pairs":len(triples)}
+		self.rules = self._optimize(triples)
+		self.after = {"rules":len(self.rules),"pairs":sum(len(r.get('resource-path',[None])) for r in self.rules)}
+		self._anyName = []
+		self._byName = {}
+		self._byStem = {}
+		for rule in self.rules:
+			name = _pattern(rule.get('endpoint-name'))
+			entry = (_patternSet([_pattern(rule.get('endpoint-type'))]),_patternSet(rule.get('resource-path',[None])))
+			if name is None:
+				self._anyName.append(entry)
+			elif name.endswith("*"):
+				self._byStem.setdefault(name[:-1],[]).append(entry)
+			else:
+				self._byName.setdefault(name,[]).append(entry)
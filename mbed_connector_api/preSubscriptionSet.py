@@ -0,0 +1,157 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import sys
+import traceback
+import logging
+from connectorError import response_codes, connectorException
+from preSubscriptionRules import preSubscriptionRules, expandRules
+
+class preSubscriptionSet:
+	"""
+	Local copy of the pre-subscription rules on connector, changed by adding and removing rules instead of
+	replacing the whole list. Changes made within ``window`` seconds of each other are applied together and
+	sent with one PUT of the optimized rules, and no PUT is sent when they leave the rules as they were.
+	The copy is seeded from connector on first use and kept as the (endpoint name, resource path, endpoint type)
+	tuples asked for, so removing a rule brings back narrower rules it had covered.
+
+	:var load: function returning the rules on connector, raising :class:`connectorException` if they cannot be read. Set by the connector
+	:var store: function sending a :class:`preSubscriptionRules`, returning an asyncResult. Set by the connector
+	"""
+
+	def change(self,add,remove,result):
+		'''
+		Queue a change for the next batch.
+
+		:param list add: rules to add, in any form :class:`preSubscriptionRules` accepts
+		:param list remove: rules to remove
+		:param asyncResult result: filled in once the batch is sent, ``.result`` is the rules now on connector
+		:return: none
+		'''
+		change = (expandRules(add or []),expandRules(remove or []),result)
+		with self._lock:
+			self._pending.append(change)
+			self._changes += 1
+			if self._timer is None:
+				self._timer = threading.Timer(self.window,self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def flush(self):
+		'''
+		Send the queued changes now instead of when the window ends.
+
+		:return: none
+		'''
+		with self._flushLock: # one PUT at a time, in order
+			with self._lock:
+				if self._timer is not None:
+					self._timer.cancel()
+					self._timer = None
+				batch = self._pending
+				self._pending = []
+			if not batch:
+				return
+			try:
+				with self._lock:
+					desired = self._desired
+				if desired is None:
+					loaded = self.load()
+					desired = set(expandRules(loaded))
+					written = preSubscriptionRules(loaded).rules
+				else:
+					written = self._written
+				desired = set(desired)
+				for add,remove,result in batch:
+					desired.update(add)
+					desired.difference_update(remove)
+				rules = preSubscriptionRules(desired)
+				if rules.rules == written:
+					with self._lock:
+						self._desired = desired
+						self._written = written
+						self._skipped += 1
+					self._complete(batch,False,None,written)
+					return
+				self.log.debug("sending %d pre-subscription changes as %d rules",len(batch),len(rules))
+				stored = self.store(rules)
+				if stored.error:
+					with self._lock:
+						self._failed += 1
+					self._complete(batch,stored.error,stored.status_code,None)
+					return
+				with self._lock:
+					self._desired = desired
+					self._written = rules.rules
+					self._puts += 1
+				self._complete(batch,False,stored.status_code,rules.rules)
+			except connectorException as e:
+				# rules could not be read back, or the PUT was refused before it was sent
+				with self._lock:
+					self._failed += 1
+				self._complete(batch,e.error,None,None)
+			except:
+				self.log.error("pre-subscription changes could not be sent")
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+				error = response_codes("request_failed","")
+				error.error = str(ex)
+				with self._lock:
+					self._failed += 1
+				self._complete(batch,error,None,None)
+
+	def invalidate(self):
+		'''
+		Forget the local copy, so the next change reads the rules from connector again.
+
+		:return: none
+		'''
+		with self._lock:
+			self._desired = None
+			self._written = None
+
+	def stats(self):
+		'''
+		:return: dictionary with ``rules`` in the local copy (None before it is loaded), ``pending`` changes,
+			``changes`` made, ``puts`` sent, ``skipped`` batches that changed nothing and ``failed`` batches
+		:rtype: dict
+		'''
+		with self._lock:
+			return {"rules":len(self._written) if self._written is not None else None,
+					"pending":len(self._pending),
+					"changes":self._changes,
+					"puts":self._puts,
+					"skipped":self._skipped,
+					"failed":self._failed}
+
+	def _complete(self,batch,error,status,rules):
+		for add,remove,result in batch:
+			result.status_code = status
+			result.result = rules if rules is not None else {}
+			result.error = error
+			result.is_done = True
+			if result.callback:
+				result.callback(result)
+
+	def __init__(self,window=0.05):
+		'''
+		:param float window: Optional - seconds to wait for further changes before sending
+		'''
+		self.window = window
+		self.load = None
+		self.store = None
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._lock = threading.Lock()
+		self._flushLock = threading.Lock()
+		self._pending = []
+		self._timer = None
+		self._desired = None # set of (name, path, type) tuples, None until loaded
+		self._written = None # optimized rules on connector
+		self._changes = 0
+		self._puts = 0
+		self._skipped = 0
+		self._failed = 0
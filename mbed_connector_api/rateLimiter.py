@@ -0,0 +1,175 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import time
+import sys
+import traceback
+import logging
+from connectorError import response_codes, connectorException
+
+class rateLimiter:
+	"""
+	Token bucket limiting the requests a connector sends, plus the transaction budget left on the account.
+	``rate`` tokens per second are added up to ``burst``, every request takes one. The budget is seeded from
+	``getLimits`` (``transaction-quota`` minus ``transaction-count``) on the first request and refreshed every
+	``refreshInterval`` seconds in the background, each request also takes one from it.
+
+	When no token or budget is left a request either waits (``mode='block'``, for at most ``maxWait`` seconds)
+	or fails at once (``mode='fail'``) by raising :class:`connectorException` with a ``rate_limited`` error.
+	The exception's ``retryAfter`` is the expected wait, which ``expectedWait`` also gives before trying.
+
+	:var refresher: function returning the remaining budget, or None if unknown. Set by the connector
+	"""
+
+	def acquire(self):
+		'''
+		Take a token for one request, waiting or failing as set by ``mode``.
+
+		:return: seconds spent waiting
+		:rtype: float
+		:raises connectorException: if the request may not be sent
+		'''
+		self._maybeRefresh()
+		waited = 0.0
+		while True:
+			with self._lock:
+				wait = self._waitLocked(time.time())
+				if wait <= 0:
+					if self.rate is not None:
+						self._tokens -= 1
+					if self.budget is not None:
+						self.budget -= 1
+					if waited:
+						self._throttled += 1
+						self._totalWait += waited
+						self._maxWait = max(self._maxWait,waited)
+					return waited
+				if self.mode == 'fail' or (self.maxWait is not None and waited+wait > self.maxWait):
+					self._failed += 1
+					error = response_codes("rate_limited","")
+					error.error = "%s Expected wait %.2f seconds." % (error.error,wait)
+					e = connectorException(error)
+					e.retryAfter = wait
+					raise e
+			time.sleep(wait)
+			waited += wait
+			self._maybeRefresh()
+
+	def expectedWait(self):
+		'''
+		:return: seconds until a request could be sent, 0 if one can be sent now
+		:rtype: float
+		'''
+		with self._lock:
+			return max(self._waitLocked(time.time()),0.0)
+
+	def setBudget(self,remaining):
+		'''
+		Set the transactions left on the account, for example from a ``getLimits`` result.
+
+		:param int remaining: transactions left, None if unknown
+		:return: none
+		'''
+		with self._lock:
+			self.budget = remaining
+			self._lastRefresh = time.time()
+			self._refreshes += 1
+
+	def stats(self):
+		'''
+		:return: dictionary with ``tokens`` and ``budget`` left, ``throttled`` requests that waited and their
+			``totalWait`` / ``maxWait`` seconds, ``failed`` requests refused, ``refreshes`` of the budget and ``lastRefresh`` time
+		:rtype: dict
+		'''
+		with self._lock:
+			self._refill(time.time())
+			return {"tokens":self._tokens if self.rate is not None else None,
+					"budget":self.budget,
+					"throttled":self._throttled,
+					"totalWait":self._totalWait,
+					"maxWait":self._maxWait,
+					"failed":self._failed,
+					"refreshes":self._refreshes,
+					"lastRefresh":self._lastRefresh}
+
+	# seconds until both a token and budget are available, caller holds the lock
+	def _waitLocked(self,now):
+		wait = 0.0
+		if self.rate is not None:
+			self._refill(now)
+			if self._tokens < 1:
+				wait = (1-self._tokens)/self.rate
+		if self.budget is not None and self.budget <= 0:
+			# nothing left until the next refresh shows a new quota
+			wait = max(wait,self._lastRefresh+self.refreshInterval-now,0.05)
+		return wait
+
+	# add the tokens earned since the last refill, caller holds the lock
+	def _refill(self,now):
+		if self.rate is not None:
+			self._tokens = min(self.burst,self._tokens+(now-self._filled)*self.rate)
+		self._filled = now
+
+	# seed the budget inline on first use, refresh it in the background once it is due
+	def _maybeRefresh(self):
+		if self.refresher is None:
+			return
+		with self._lock:
+			if self._refreshing:
+				return
+			if self._lastRefresh is not None and time.time()-self._lastRefresh < self.refreshInterval:
+				return
+			self._refreshing = True
+			seed = self._lastRefresh is None
+		if seed:
+			self._refresh()
+		else:
+			t = threading.Thread(target=self._refresh,name="mdc-api-limits")
+			t.daemon = True
+			t.start()
+
+	def _refresh(self):
+		try:
+			self.setBudget(self.refresher())
+		except:
+			self.log.error("rateLimiter could not refresh the transaction budget")
+			ex_type, ex, tb = sys.exc_info()
+			traceback.print_tb(tb)
+			self.log.error(sys.exc_info())
+			del tb
+			with self._lock:
+				self._lastRefresh = time.time() # try again after the next interval
+		finally:
+			with self._lock:
+				self._refreshing = False
+
+	def __init__(self,rate=None,burst=None,mode='block',maxWait=30,refreshInterval=300):
+		'''
+		:param float rate: Optional - requests per second, no rate limit if not given
+		:param int burst: Optional - requests that may be sent back to back, defaults to one second's worth
+		:param str mode: Optional - 'block' to wait for a token, 'fail' to raise at once
+		:param float maxWait: Optional - longest wait in block mode before raising, None waits as long as it takes
+		:param float refreshInterval: Optional - seconds between refreshes of the budget from ``getLimits``
+		'''
+		if mode not in ('block','fail'):
+			raise ValueError("mode must be 'block' or 'fail'")
+		self.rate = float(rate) if rate else None
+		self.burst = float(burst if burst else max(rate or 1,1))
+		self.mode = mode
+		self.maxWait = maxWait
+		self.refreshInterval = refreshInterval
+		self.refresher = None
+		self.budget = None
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._lock = threading.Lock()
+		self._tokens = self.burst
+		self._filled = time.time()
+		self._refreshing = False
+		self._lastRefresh = None
+		self._refreshes = 0
+		self._throttled = 0
+		self._failed = 0
+		self._totalWait = 0.0
+		self._maxWait = 0.0
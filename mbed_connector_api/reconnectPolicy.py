@@ -0,0 +1,101 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import random
+import time
+
+class reconnectPolicy:
+	"""
+	Decides how long the long poll waits after a failed pull. Delays grow exponentially from ``baseDelay``
+	up to ``maxDelay`` with full jitter, a random delay between 0 and the exponential value, so many clients
+	do not reconnect in step. After ``failureThreshold`` failures in a row the circuit opens and no pull is
+	made for ``openTime`` seconds, then a single probe pull decides whether it closes again.
+
+	:var state: 'closed' while pulls succeed, 'open' while waiting out an outage, 'half-open' while probing
+	"""
+
+	def success(self):
+		'''
+		Record a successful pull, resets the failure count and closes the circuit.
+
+		:return: none
+		'''
+		with self._lock:
+			self.consecutiveFailures = 0
+			self.lastSuccess = time.time()
+			self.state = 'closed'
+
+	def failure(self,reason=""):
+		'''
+		Record a failed pull.
+
+		:param str reason: Optional - description of what went wrong, kept as ``lastError``
+		:return: seconds to wait before the next pull
+		:rtype: float
+		'''
+		with self._lock:
+			self.consecutiveFailures += 1
+			self.totalFailures += 1
+			self.lastError = reason
+			if self.state == 'half-open' or self.consecutiveFailures >= self.failureThreshold:
+				if self.state != 'open':
+					self.circuitOpens += 1
+				self.state = 'open'
+				self._openUntil = time.time()+self.openTime
+				return self.openTime
+			ceiling = min(self.maxDelay,self.baseDelay*(self.factor**(self.consecutiveFailures-1)))
+			return self._random.uniform(0,ceiling)
+
+	def delay(self):
+		'''
+		:return: seconds to wait before the next pull may be made, 0 if it may be made now
+		:rtype: float
+		'''
+		with self._lock:
+			if self.state != 'open':
+				return 0
+			remaining = self._openUntil-time.time()
+			if remaining > 0:
+				return remaining
+			self.state = 'half-open'
+			return 0
+
+	def stats(self):
+		'''
+		:return: dictionary with ``state``, ``consecutiveFailures``, ``totalFailures``, ``circuitOpens``,
+			``lastSuccess`` time, ``sinceLastSuccess`` in seconds (None before the first success) and ``lastError``
+		:rtype: dict
+		'''
+		with self._lock:
+			return {"state":self.state,
+					"consecutiveFailures":self.consecutiveFailures,
+					"totalFailures":self.totalFailures,
+					"circuitOpens":self.circuitOpens,
+					"lastSuccess":self.lastSuccess,
+					"sinceLastSuccess":time.time()-self.lastSuccess if self.lastSuccess else None,
+					"lastError":self.lastError}
+
+	def __init__(self,baseDelay=0.5,maxDelay=60,factor=2,failureThreshold=10,openTime=120):
+		'''
+		:param float baseDelay: upper bound of the delay after the first failure, in seconds
+		:param float maxDelay: largest delay between pulls while the circuit is closed
+		:param float factor: growth of the delay bound per consecutive failure
+		:param int failureThreshold: consecutive failures that open the circuit
+		:param float openTime: seconds the circuit stays open before a probe pull
+		'''
+		self.baseDelay = baseDelay
+		self.maxDelay = maxDelay
+		self.factor = factor
+		self.failureThreshold = failureThreshold
+		self.openTime = openTime
+		self.state = 'closed'
+		self.consecutiveFailures = 0
+		self.totalFailures = 0
+		self.circuitOpens = 0
+		self.lastSuccess = None
+		self.lastError = ""
+		self._openUntil = 0
+		self._lock = threading.Lock()
+		self._random = random.Random()
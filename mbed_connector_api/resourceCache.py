@@ -0,0 +1,109 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import time
+from collections import OrderedDict
+
+class resourceCache:
+	"""
+	Local LRU cache of resource values keyed by (endpoint, resource path). Filled from notifications and
+	from completed ``getResourceValue`` calls, entries expire after the ``max-age`` that came with the value.
+	Least recently used entries are dropped when ``maxEntries`` or ``maxBytes`` is exceeded.
+
+	:var defaultMaxAge: seconds a value is kept when no max-age was given, 60 is the CoAP default
+	"""
+
+	def put(self,ep,path,value,maxAge=None):
+		"""
+		Store a value. A max-age of 0 means the value must not be cached.
+
+		:param str ep: name of endpoint
+		:param str path: resource path
+		:param value: resource value, usually a string
+		:param int maxAge: Optional - seconds the value stays fresh, defaults to ``defaultMaxAge``
+		:return: none
+		"""
+		try:
+			maxAge = self.defaultMaxAge if maxAge in (None,"") else float(maxAge)
+		except (TypeError,ValueError):
+			maxAge = self.defaultMaxAge
+		key = (ep,path)
+		with self._lock:
+			self._drop(key)
+			if maxAge <= 0:
+				return
+			size = len(value) if isinstance(value,basestring) else len(str(value))
+			self._entries[key] = (time.time()+maxAge,value,size)
+			self._bytes += size
+			while self._entries and (len(self._entries) > self.maxEntries or self._bytes > self.maxBytes):
+				self._drop(next(self._entries.iterkeys()))
+				self.evictions += 1
+
+	def get(self,ep,path):
+		"""
+		:param str ep: name of endpoint
+		:param str path: resource path
+		:return: the cached value, or None if there is no fresh value
+		"""
+		key = (ep,path)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			if entry[0] <= time.time():
+				self._drop(key)
+				self.expired += 1
+				self.misses += 1
+				return None
+			# move to the most recently used end
+			del self._entries[key]
+			self._entries[key] = entry
+			self.hits += 1
+			return entry[1]
+
+	def invalidate(self,ep,path=None):
+		"""
+		Drop a cached value, or every value for an endpoint if ``path`` is not given.
+
+		:return: none
+		"""
+		with self._lock:
+			if path is not None:
+				self._drop((ep,path))
+			else:
+				for key in [k for k in self._entries.iterkeys() if k[0] == ep]:
+					self._drop(key)
+
+	def stats(self):
+		"""
+		:return: dictionary with ``entries``, ``bytes``, ``hits``, ``misses``, ``expired`` and ``evictions`` counts
+		:rtype: dict
+		"""
+		with self._lock:
+			return {"entries":len(self._entries),
+					"bytes":self._bytes,
+					"hits":self.hits,
+					"misses":self.misses,
+					"expired":self.expired,
+					"evictions":self.evictions}
+
+	# remove a key, caller holds the lock
+	def _drop(self,key):
+		entry = self._entries.pop(key,None)
+		if entry is not None:
+			self._bytes -= entry[2]
+
+	def __init__(self,maxEntries=10000,maxBytes=8*1024*1024,defaultMaxAge=60):
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.defaultMaxAge = defaultMaxAge
+		self.hits = 0
+		self.misses = 0
+		self.expired = 0
+		self.evictions = 0
+		self._bytes = 0
+		self._lock = threading.Lock()
+		self._entries = OrderedDict() # (endpoint, path) : (expiry time, value, size)
@@ -0,0 +1,59 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import random
+
+class retryPolicy:
+	"""
+	Decides whether a request that got a transient status from connector is sent again, and after how long.
+	Retries wait a random time up to an exponential bound (full jitter), or the ``Retry-After`` the response
+	asked for if that is longer, and stop after ``maxAttempts`` attempts or once ``deadline`` seconds have passed
+	since the first one. POST is not idempotent, it is only retried when ``retryUnsafe`` is set.
+
+	:var codes: status codes worth retrying
+	"""
+
+	def retryDelay(self,verb,status,attempt,elapsed,retryAfter=None):
+		'''
+		:param str verb: HTTP method of the request
+		:param int status: status code received, None if the request raised a connection error
+		:param int attempt: attempts made so far, starting at 1
+		:param float elapsed: seconds since the first attempt
+		:param float retryAfter: Optional - seconds asked for by a ``Retry-After`` header
+		:return: seconds to wait before the next attempt, None if the request should not be retried
+		:rtype: float
+		'''
+		if status is None and not self.retryErrors:
+			return None
+		if status is not None and status not in self.codes:
+			return None
+		if verb == 'POST' and not self.retryUnsafe:
+			return None
+		if attempt >= self.maxAttempts:
+			return None
+		delay = self._random.uniform(0,min(self.maxDelay,self.baseDelay*(2**(attempt-1))))
+		if retryAfter is not None:
+			delay = max(delay,min(retryAfter,self.maxDelay))
+		if self.deadline is not None and elapsed+delay > self.deadline:
+			return None
+		return delay
+
+	def __init__(self,codes=(429,502,503,504),maxAttempts=3,baseDelay=0.2,maxDelay=5,deadline=30,retryUnsafe=False,retryErrors=True):
+		'''
+		:param tuple codes: Optional - status codes to retry
+		:param int maxAttempts: Optional - attempts including the first one
+		:param float baseDelay: Optional - upper bound of the wait before the first retry, doubled for each further retry
+		:param float maxDelay: Optional - longest wait between attempts
+		:param float deadline: Optional - seconds after the first attempt when no more retries are started, None for no limit
+		:param bool retryUnsafe: Optional - also retry POST requests
+		:param bool retryErrors: Optional - also retry requests that failed to connect or timed out
+		'''
+		self.codes = frozenset(codes)
+		self.maxAttempts = maxAttempts
+		self.baseDelay = baseDelay
+		self.maxDelay = maxDelay
+		self.deadline = deadline
+		self.retryUnsafe = retryUnsafe
+		self.retryErrors = retryErrors
+		self._random = random.Random()
@@ -20,6 +20,8 @@ import json
 from base64 import standard_b64encode as b64encode
 import random
 import os
+import time
+import threading
 
 # Grab the connector token from the 'ACCESS_KEY' environment variable
 if 'ACCESS_KEY' in os.environ.keys():
@@ -219,6 +221,860 @@ class test_connector_mock:
 		expect(x.isDone()).to.equal(True)
 		expect(x.status_code).to.equal(200)
 
+	# test that all calls go through the pooled transport, GET /limits twice
+	@timed(10)
+	def test_transportStats(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/limits"),
+								body=self.md.getPayload('limits'),
+								status=self.md.getStatusCode('limits'))
+		self.connector.getLimits()
+		self.connector.getLimits()
+		stats = self.connector.transportStats()
+		expect(stats['requests']).to.equal(2)
+		expect(stats['hits']+stats['misses']).to.equal(2)
+		expect(stats['poolSize']).to.equal(10)
+
+	# test that assigning a new token to bearer is picked up by the pooled transport
+	@timed(10)
+	def test_transportTokenChange(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/limits"),
+								body=self.md.getPayload('limits'),
+								status=self.md.getStatusCode('limits'))
+		self.connector.getLimits()
+		expect(httpretty.last_request().headers['Authorization']).to.equal("Bearer "+token)
+		self.connector.bearer = "rotated"
+		self.connector.getLimits()
+		expect(httpretty.last_request().headers['Authorization']).to.equal("Bearer rotated")
+
+	# test that asyncConnector returns immediately and fills the result in later, GET /limits
+	@timed(10)
+	def test_asyncConnector(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/limits"),
+								body=self.md.getPayload('limits'),
+								status=self.md.getStatusCode('limits'))
+		c = mbed_connector_api.asyncConnector(token, "http://mock")
+		c.apiVersion=""
+		x = c.getLimits()
+		self.waitOnAsync(x)
+		expect(x.error).to.equal(False)
+		expect(x.status_code).to.equal(200)
+		expect(x.result['transaction-quota']).to.equal(10000)
+		c.shutdown()
+
+	# test that a 202 from asyncConnector is resolved by the long poll task
+	@timed(10)
+	def test_asyncConnectorAsyncResponse(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints/51f540a2-3113-46e2-aef4-96e94a637b31/Test/0/D",
+								body=self.ah.input('getResourceValue'),
+								status=202)
+		httpretty.register_uri(httpretty.GET,"http://mock/notification/pull",
+								body=self.ah.input('longPoll'),
+								status=200)
+		c = mbed_connector_api.asyncConnector(token, "http://mock")
+		c.apiVersion=""
+		x = c.getResourceValue("51f540a2-3113-46e2-aef4-96e94a637b31", "/Test/0/D")
+		c.startLongPolling()
+		self.waitOnAsync(x)
+		expect(x.error).to.equal(False)
+		expect(x.status).to.equal(200)
+		c.shutdown()
+
+	# test blocking on an asyncResult with wait / getResult / add_done_callback
+	@timed(10)
+	def test_asyncResultWait(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/limits"),
+								body=self.md.getPayload('limits'),
+								status=self.md.getStatusCode('limits'))
+		c = mbed_connector_api.asyncConnector(token, "http://mock")
+		c.apiVersion=""
+		done = []
+		x = c.getLimits()
+		x.add_done_callback(done.append)
+		expect(x.wait(5)).to.equal(True)
+		expect(x.getResult(5)['transaction-count']).to.equal(259)
+		expect(done).to.equal([x])
+		# callbacks added after completion are called immediately
+		x.add_done_callback(done.append)
+		expect(len(done)).to.equal(2)
+		c.shutdown()
+
+	# test that getResult raises on errors and on timeouts
+	@timed(10)
+	def test_asyncResultGetResultRaises(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/missing"),
+								body="",
+								status=404)
+		x = self.connector.getResources("missing")
+		assert_raises(mbed_connector_api.connectorException,x.getResult,1)
+		y = mbed_connector_api.asyncResult()
+		expect(y.wait(0.01)).to.equal(False)
+		try:
+			y.getResult(0.01)
+			assert False
+		except mbed_connector_api.connectorException as e:
+			expect(e.error.errType).to.equal("wait_timeout")
+
+	# test executor mode on connector, calls return immediately and complete as futures
+	@timed(10)
+	def test_executorMode(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/limits"),
+								body=self.md.getPayload('limits'),
+								status=self.md.getStatusCode('limits'))
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints"),
+								body=self.md.getPayload('endpoints'),
+								status=self.md.getStatusCode('endpoints'))
+		c = mbed_connector_api.connector(token, "http://mock", executor=4)
+		c.apiVersion=""
+		calls = [c.getLimits(), c.getEndpoints(), c.getLimits()]
+		for x in calls:
+			expect(x.wait(5)).to.equal(True)
+			expect(x.done()).to.equal(True)
+			expect(x.error).to.equal(False)
+		expect(calls[1].result[0]['type']).to.equal("test")
+		c.shutdown()
+
+	# test bulk reads across several endpoints, GET /endpoints/{endpoint}/{resource}
+	@timed(10)
+	def test_getResourceValues(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/good-\d+/3/0/2"),
+								body="1.0",
+								status=200)
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/gone-\d+/3/0/2"),
+								body="",
+								status=404)
+		pairs = [("good-%d"%x,"/3/0/2") for x in range(6)] + [("gone-%d"%x,"/3/0/2") for x in range(3)]
+		bulk = self.connector.getResourceValues(pairs,concurrency=3,timeout=5)
+		results = list(bulk)
+		expect(len(results)).to.equal(9)
+		expect(sorted(x.endpoint for x in results if not x.error)).to.equal(sorted(ep for ep,res in pairs[:6]))
+		expect(bulk.summary()).to.equal({"total":9,"successes":6,"errors":3,"timeouts":0,"pending":0})
+
+	# test that bulk reads whose async responses never arrive are counted as timeouts
+	@timed(10)
+	def test_getResourceValuesTimeout(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/sleepy/3/0/2"),
+								body=self.ah.input('getResourceValue'),
+								status=202)
+		bulk = self.connector.getResourceValues([("sleepy","/3/0/2")],timeout=0.2)
+		expect(list(bulk)).to.equal([])
+		expect(bulk.summary()['timeouts']).to.equal(1)
+
+	# test that a bulk read parked behind a busy endpoint still runs after every request has been issued
+	@timed(10)
+	def test_getResourceValuesParked(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints/ep/3/0/0",
+								body=json.dumps({"async-response-id":"bulk-1"}),
+								status=202)
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints/ep/3/0/1",body="2",status=200)
+		c = mbed_connector_api.connector(token, "http://mock", endpointSlots=1)
+		c.apiVersion = ""
+		bulk = c.getResourceValues([("ep","/3/0/0"),("ep","/3/0/1")],timeout=5)
+		while "bulk-1" not in c.database['async-responses']:
+			time.sleep(0.01)
+		c.handler(json.dumps({"async-responses":[{"id":"bulk-1","status":200,"payload":b64encode("1")}]}))
+		expect(sorted(x.result for x in bulk)).to.equal([2,"1"])
+		expect(bulk.summary()).to.equal({"total":2,"successes":2,"errors":0,"timeouts":0,"pending":0})
+		# slots are released by done callbacks of their own, a leaked one keeps the endpoint busy until @timed fails
+		while c.endpointGateStats()['busy']:
+			time.sleep(0.01)
+		stats = c.endpointGateStats()
+		expect((stats['inFlight'],stats['waiting'])).to.equal((0,0))
+
+	# test that unanswered async responses expire and overflowing ones are evicted
+	@timed(10)
+	def test_asyncResponseExpiry(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/sleepy/3/0/\d"),
+								responses=[httpretty.Response(body=self.ah.input('getResourceValue'),status=202) for x in range(3)])
+		c = mbed_connector_api.connector(token, "http://mock", asyncTimeout=0.05, maxPendingAsync=2)
+		c.apiVersion=""
+		called = []
+		x = c.getResourceValue("sleepy","/3/0/1",cbfn=called.append)
+		y = c.getResourceValue("sleepy","/3/0/2")
+		z = c.getResourceValue("sleepy","/3/0/3")
+		# third pending entry pushes out the first
+		expect(x.isDone()).to.equal(True)
+		expect(x.error.errType).to.equal("async_evicted")
+		expect(called).to.equal([x])
+		time.sleep(0.1)
+		expect(c.database['async-responses'].sweep()).to.equal(2)
+		expect(z.error.errType).to.equal("async_timeout")
+		stats = c.asyncResponseStats()
+		expect((stats['pending'],stats['evictions'],stats['expired'],stats['overflow'])).to.equal((0,3,2,1))
+
+	# test that an async response arriving before its 202 has been registered is not lost
+	@timed(10)
+	def test_asyncResponseArrivesEarly(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/fast/3/0/2"),
+								body=json.dumps({"async-response-id":"early-1"}),
+								status=202)
+		self.connector.handler(json.dumps({"async-responses":[{"id":"early-1","status":200,"payload":b64encode("42")}]}))
+		x = self.connector.getResourceValue("fast","/3/0/2")
+		expect(x.isDone()).to.equal(True)
+		expect(x.result).to.equal("42")
+		expect(self.connector.asyncResponseStats()['earlyMatched']).to.equal(1)
+
+	# test registering and resolving async responses from many threads at once
+	@timed(10)
+	def test_asyncRegistryConcurrent(self):
+		registry = self.connector.database['async-responses']
+		results = [mbed_connector_api.asyncResult() for x in range(2000)]
+		def register(offset):
+			for x in range(offset,len(results),4):
+				registry[str(x)] = results[x]
+		def resolve(offset):
+			for x in range(offset,len(results),4):
+				found = registry.resolve(str(x),{"id":str(x),"status":200,"payload":b64encode(str(x))})
+				if found is not None:
+					self.connector._fillAsync(found,{"id":str(x),"status":200,"payload":b64encode(str(x))})
+		threads = [threading.Thread(target=register,args=(x,)) for x in range(4)]
+		threads += [threading.Thread(target=resolve,args=(x,)) for x in range(4)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		expect([x.result for x in results]).to.equal([str(x) for x in range(len(results))])
+		expect(len(registry)).to.equal(0)
+
+	# test that notifications and reads fill the local resource cache and useLocalCache skips the request
+	@timed(10)
+	def test_resourceCache(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/ep1/3/0/2"),
+								body="abc",
+								status=200)
+		self.connector.handler(json.dumps({"notifications":[
+									{"ep":"ep2","path":"/3303/0/5700","ct":"text/plain","payload":b64encode("21.5"),"max-age":60},
+									{"ep":"ep2","path":"/3303/0/5701","ct":"text/plain","payload":b64encode("Cel"),"max-age":0}]}))
+		x = self.connector.getResourceValue("ep2","/3303/0/5700",useLocalCache=True)
+		expect(x.isDone()).to.equal(True)
+		expect(x.result).to.equal("21.5")
+		expect(len(httpretty.HTTPretty.latest_requests)).to.equal(0)
+		# max-age 0 is never cached
+		expect(self.connector.cache.get("ep2","/3303/0/5701")).to.equal(None)
+		# completed reads are cached too
+		self.connector.getResourceValue("ep1","/3/0/2")
+		y = self.connector.getResourceValue("ep1","/3/0/2",useLocalCache=True)
+		expect(y.result).to.equal("abc")
+		expect(len(httpretty.HTTPretty.latest_requests)).to.equal(1)
+		stats = self.connector.cacheStats()
+		expect((stats['hits'],stats['misses'],stats['entries'])).to.equal((2,1,2))
+
+	# test lru eviction and the memory cap of the resource cache
+	def test_resourceCacheEviction(self):
+		cache = mbed_connector_api.resourceCache(maxEntries=2,maxBytes=10)
+		cache.put("ep","/a","1234")
+		cache.put("ep","/b","5678")
+		cache.get("ep","/a")
+		cache.put("ep","/c","90") # over maxEntries, /b is least recently used
+		expect(cache.get("ep","/b")).to.equal(None)
+		cache.put("ep","/d","123456789") # over maxBytes
+		expect(cache.stats()['bytes'] <= 10).to.equal(True)
+		expect(cache.get("ep","/d")).to.equal("123456789")
+
+	# test that the endpoint directory is seeded from getEndpoints and follows registration events
+	@timed(10)
+	def test_endpointDirectory(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints"),
+								body=self.md.getPayload('endpoints'),
+								status=self.md.getStatusCode('endpoints'))
+		events = []
+		self.connector.directory.addListener(lambda event,name,record: events.append((event,name)))
+		x = self.connector.syncDirectory()
+		expect(x.error).to.equal(False)
+		expect(self.connector.directory.byType("test")).to.equal(["51f540a2-3113-46e2-aef4-96e94a637b31"])
+		self.connector.handler(json.dumps({"registrations":[{"ep":"new-ep","ept":"sensor","q":True,
+																"resources":[{"path":"/3303/0/5700","obs":True}]}]}))
+		record = self.connector.directory.get("new-ep")
+		expect(record['queueMode']).to.equal(True)
+		expect(record['resources'].keys()).to.equal(["/3303/0/5700"])
+		self.connector.handler(json.dumps({"reg-updates":[{"ep":"new-ep","ept":"sensor","q":False,"resources":[]}],
+											"registrations-expired":["51f540a2-3113-46e2-aef4-96e94a637b31"]}))
+		expect(self.connector.directory.get("new-ep")['queueMode']).to.equal(False)
+		expect("51f540a2-3113-46e2-aef4-96e94a637b31" in self.connector.directory).to.equal(False)
+		expect(events).to.equal([("registered","51f540a2-3113-46e2-aef4-96e94a637b31"),("registered","new-ep"),
+								("updated","new-ep"),("expired","51f540a2-3113-46e2-aef4-96e94a637b31")])
+		# queue mode sent as a string is read the same way when seeding
+		self.connector.directory.seed([{"name":"seeded-ep","type":"sensor","q":"false"},{"name":"queued-ep","type":"sensor","q":"true"}])
+		expect(self.connector.directory.get("seeded-ep")['queueMode']).to.equal(False)
+		expect(self.connector.directory.get("queued-ep")['queueMode']).to.equal(True)
+
+	# test streaming the endpoint and resource lists, GET /endpoints and /endpoints/{endpoint}
+	@timed(10)
+	def test_iterEndpoints(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints$"),
+								body=self.md.getPayload('endpoints'),
+								status=self.md.getStatusCode('endpoints'))
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/51f540a2-3113-46e2-aef4-96e94a637b31"),
+								body=self.md.getPayload('resources'),
+								status=self.md.getStatusCode('resources'))
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/missing"),
+								body="",
+								status=404)
+		eps = list(self.connector.iterEndpoints(pageSize=16))
+		expect(eps).to.equal(json.loads(self.md.getPayload('endpoints')))
+		res = list(self.connector.iterResources(eps[0]['name'],pageSize=7))
+		expect(res).to.equal(json.loads(self.md.getPayload('resources')))
+		assert_raises(mbed_connector_api.connectorException,list,self.connector.iterResources("missing"))
+
+	# test that dispatched notifications keep per endpoint order and run endpoints in parallel
+	@timed(10)
+	def test_notificationDispatch(self):
+		c = mbed_connector_api.connector(token, "http://mock", dispatchWorkers=4)
+		seen = {}
+		lock = threading.Lock()
+		def slow(data):
+			n = data['notifications'][0]
+			time.sleep(0.05)
+			with lock:
+				seen.setdefault(n['ep'],[]).append(n['path'])
+		c.setHandler('notifications',slow)
+		batch = [{"ep":"ep-%d"%(x%4),"path":"/3/0/%d"%x,"payload":b64encode(str(x))} for x in range(16)]
+		start = time.time()
+		c.handler(json.dumps({"notifications":batch}))
+		# handler returns before the callbacks have run
+		expect(time.time()-start < 0.05).to.equal(True)
+		c.shutdown()
+		for x in range(4):
+			expect(seen["ep-%d"%x]).to.equal(["/3/0/%d"%y for y in range(x,16,4)])
+		expect(c.dispatchStats()['dispatched']).to.equal(16)
+
+	# test that routed subscribers only get the events matching their patterns
+	@timed(10)
+	def test_notificationRouting(self):
+		seen = []
+		sensors = self.connector.on('notifications',ep='sensor-*',path='/3303/*/5700',cb=lambda n: seen.append(('sensor',n['ep'],n['path'])))
+		self.connector.on('notifications',ep='lamp',cb=lambda n: seen.append(('lamp',n['ep'],n['path'])))
+		self.connector.on('notifications',path='/3/0/**',cb=lambda n: seen.append(('device',n['ep'],n['path'])))
+		self.connector.on('de-registrations',ep='sensor-*',cb=lambda ep: seen.append(('gone',ep,None)))
+		batch = [{"ep":"sensor-1","path":"/3303/0/5700","payload":b64encode("21")},
+				{"ep":"sensor-2","path":"/3303/0/5701","payload":b64encode("x")},
+				{"ep":"lamp","path":"/3311/0/5850","payload":b64encode("1")},
+				{"ep":"other","path":"/3/0/1/2","payload":b64encode("v")}]
+		self.connector.handler(json.dumps({"notifications":batch,"de-registrations":["sensor-1","lamp"]}))
+		expect(seen).to.equal([('sensor','sensor-1','/3303/0/5700'),('lamp','lamp','/3311/0/5850'),
+								('device','other','/3/0/1/2'),('gone','sensor-1',None)])
+		expect(self.connector.off(sensors)).to.equal(True)
+		expect(self.connector.off(sensors)).to.equal(False)
+		del seen[:]
+		self.connector.handler(json.dumps({"notifications":batch[:1]}))
+		expect(seen).to.equal([])
+
+	# test that event objects read fields from the entry and decode the payload once, when asked
+	def test_notificationEvents(self):
+		seen = []
+		self.connector.on('notifications',ep='sensor-1',cb=seen.append)
+		self.connector.on('registrations',cb=seen.append)
+		entry = {"ep":"sensor-1","path":"/3303/0/5700","ct":"text/plain","max-age":30,"payload":b64encode("21.5")}
+		self.connector.handler(json.dumps({"notifications":[entry],
+			"registrations":[{"ep":"sensor-1","ept":"sensor","q":"true","resources":[{"path":"/3303/0/5700"}]}]}))
+		n,reg = seen
+		expect(isinstance(n,mbed_connector_api.notificationEvent)).to.equal(True)
+		expect((n.ep,n.path,n.ct,n.maxAge,n.timestamp)).to.equal(("sensor-1","/3303/0/5700","text/plain",30,None))
+		expect(n.raw).to.equal(entry)
+		expect(n.payload).to.equal("21.5")
+		expect(n.payload is n.payload).to.equal(True)
+		expect(n.view.tobytes()).to.equal("21.5")
+		expect(n['path']).to.equal("/3303/0/5700")
+		expect((reg.ep,reg.ept,reg.queueMode,len(reg.resources))).to.equal(("sensor-1","sensor",True,1))
+		assert_raises(AttributeError,setattr,n,'extra',1)
+
+	# test that response bodies are decoded according to their content type
+	def test_contentTypeDecoding(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints",
+								body=self.md.getPayload('endpoints'),
+								content_type="application/json")
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints/plain/3/0/1",
+								body="42",
+								content_type="text/plain")
+		expect(self.connector.getEndpoints().result).to.equal(json.loads(self.md.getPayload('endpoints')))
+		# plain text and untyped bodies are parsed as JSON when they can be, as before content types were looked at
+		expect(self.connector.getResourceValue("plain","/3/0/1").result).to.equal(42)
+		expect(mbed_connector_api.codec.decode('42')).to.equal(42)
+		expect(mbed_connector_api.codec.decode('hello',"text/plain")).to.equal('hello')
+		expect(mbed_connector_api.codec.decode('42',"application/octet-stream")).to.equal('42')
+		expect(mbed_connector_api.codec.decode('{"a":1}',"text/plain; charset=utf-8")).to.equal({"a":1})
+		expect(mbed_connector_api.codec.decode('[1',"application/json")).to.equal('[1')
+		expect(mbed_connector_api.codec.decode('[1]',"application/octet-stream")).to.equal('[1]')
+		# text that cannot be JSON never reaches the parser
+		def refuse(content):
+			raise AssertionError("parsed %r" % content)
+		loads = mbed_connector_api.codec.loads
+		mbed_connector_api.codec.loads = refuse
+		try:
+			expect(mbed_connector_api.codec.decode('hello')).to.equal('hello')
+			expect(mbed_connector_api.codec.decode(' hello world',"text/plain")).to.equal(' hello world')
+			expect(mbed_connector_api.codec.decode('   ')).to.equal('   ')
+		finally:
+			mbed_connector_api.codec.loads = loads
+		expect(mbed_connector_api.codec.setBackend('json')).to.equal('json')
+		assert_raises(ValueError,mbed_connector_api.codec.setBackend,'missing')
+		mbed_connector_api.codec.setBackend()
+
+	# test that failed pulls back off, open the circuit and close it again after a good probe
+	@timed(10)
+	def test_longPollBackoff(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/notification/pull",body="",status=503)
+		c = mbed_connector_api.connector(token, "http://mock",
+				reconnect=mbed_connector_api.reconnectPolicy(baseDelay=0.01,maxDelay=0.05,failureThreshold=3,openTime=0.2))
+		c.apiVersion = ""
+		delays = [c._pollOnce() for x in range(3)]
+		expect(all(0 <= d <= 0.05 for d in delays[:2])).to.equal(True)
+		expect(delays[2]).to.equal(0.2)
+		health = c.longPollHealth()
+		expect((health['state'],health['consecutiveFailures'],health['circuitOpens'])).to.equal(('open',3,1))
+		expect(health['lastError']).to.equal("HTTP status 503")
+		expect(health['sinceLastSuccess']).to.equal(None)
+		# no request is made while the circuit is open
+		requests = len(httpretty.latest_requests())
+		expect(c._pollOnce() > 0).to.equal(True)
+		expect(len(httpretty.latest_requests())).to.equal(requests)
+		time.sleep(0.25)
+		httpretty.register_uri(httpretty.GET,"http://mock/notification/pull",body="",status=204)
+		expect(c._pollOnce()).to.equal(0)
+		health = c.longPollHealth()
+		expect((health['state'],health['consecutiveFailures'],health['totalFailures'])).to.equal(('closed',0,3))
+		expect(health['sinceLastSuccess'] < 1).to.equal(True)
+
+	# test that pipelined long polling keeps pulling while slow callbacks run
+	@timed(10)
+	def test_pipelinedLongPoll(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/notification/pull",
+								body=json.dumps({"notifications":[{"ep":"ep","path":"/3/0/1","payload":b64encode("1")}]}),
+								status=200)
+		seen = []
+		def slow(data):
+			time.sleep(0.05)
+			seen.append(data)
+		self.connector.setHandler('notifications',slow)
+		expect(self.connector.pipelineStats()).to.equal(None)
+		thread = self.connector.startLongPolling(pipelined=True,pipelineDepth=2)
+		while len(seen) < 4:
+			time.sleep(0.01)
+		# pulls go ahead of the callbacks
+		expect(len(httpretty.latest_requests()) > len(seen)).to.equal(True)
+		self.connector.stopLongPolling()
+		thread.join()
+		# everything pulled was dispatched before the thread ended
+		stats = self.connector.pipelineStats()
+		expect(stats['processed']).to.equal(len(seen))
+		expect(stats['queued']).to.equal(0)
+		expect(stats['maxQueued'] >= 1).to.equal(True)
+		expect(stats['maxLag'] > 0).to.equal(True)
+
+	# test that the rate limiter spaces requests out, seeds its budget from /limits and fails fast when asked
+	@timed(10)
+	def test_rateLimiter(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/limits",
+								body='{"transaction-quota":10,"transaction-count":4}',
+								content_type="application/json")
+		httpretty.register_uri(httpretty.GET,"http://mock/",body="DeviceServer v3.0.0-520\nREST version = v2")
+		c = mbed_connector_api.connector(token, "http://mock",limiter=mbed_connector_api.rateLimiter(rate=50,burst=2))
+		c.apiVersion = ""
+		start = time.time()
+		for x in range(5):
+			expect(c.getConnectorVersion().error).to.equal(False)
+		# two go at once, the other three wait 20ms each
+		expect(time.time()-start >= 0.05).to.equal(True)
+		stats = c.rateLimitStats()
+		expect((stats['budget'],stats['refreshes'])).to.equal((1,1))
+		expect(stats['throttled'] >= 1).to.equal(True)
+		c = mbed_connector_api.connector(token, "http://mock",limiter=mbed_connector_api.rateLimiter(rate=1,burst=1,mode='fail'))
+		c.apiVersion = ""
+		expect(c.getConnectorVersion().error).to.equal(False)
+		expect(c.throttleWait() > 0.5).to.equal(True)
+		try:
+			c.getConnectorVersion()
+			raise AssertionError("rate limit was not enforced")
+		except mbed_connector_api.connectorException as e:
+			expect(e.error.errType).to.equal("rate_limited")
+			expect(e.retryAfter > 0.5).to.equal(True)
+		expect(c.rateLimitStats()['failed']).to.equal(1)
+
+	# test that a second request to a busy endpoint waits for the first one's async-response
+	@timed(10)
+	def test_endpointGate(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/busy/3/0/1"),
+								body=json.dumps({"async-response-id":"gate-1"}),
+								status=202)
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/other/3/0/1"),
+								body="7",
+								status=200)
+		c = mbed_connector_api.connector(token, "http://mock", executor=4, endpointSlots=1)
+		c.apiVersion = ""
+		first = c.getResourceValue("busy","/3/0/1")
+		while len(c.database['async-responses']) == 0: # wait for the 202
+			time.sleep(0.01)
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/busy/3/0/2"),body="8",status=200)
+		second = c.getResourceValue("busy","/3/0/2")
+		# other endpoints are not held up
+		expect(c.getResourceValue("other","/3/0/1").getResult(1)).to.equal(7)
+		time.sleep(0.1)
+		expect(second.isDone()).to.equal(False)
+		expect(c.endpointGateStats()['waiting']).to.equal(1)
+		c.handler(json.dumps({"async-responses":[{"id":"gate-1","status":200,"payload":b64encode("6")}]}))
+		expect(first.getResult(1)).to.equal("6")
+		expect(second.getResult(1)).to.equal(8)
+		while c.endpointGateStats()['busy']: # released by a done callback, after getResult has returned
+			time.sleep(0.01)
+		stats = c.endpointGateStats()
+		expect((stats['busy'],stats['inFlight'],stats['waiting'],stats['waits'])).to.equal((0,0,0,1))
+		c.shutdown()
+
+	# test that requests queued for a busy endpoint do not hold workers, with two workers and six slow reads
+	@timed(10)
+	def test_endpointGateParked(self):
+		for i in range(1,7):
+			httpretty.register_uri(httpretty.GET,"http://mock/endpoints/busy/3/0/%d" % i,
+									body=json.dumps({"async-response-id":"parked-%d" % i}),
+									status=202)
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints/other/3/0/1",body="7",status=200)
+		c = mbed_connector_api.asyncConnector(token, "http://mock", workers=2, endpointSlots=1)
+		c.apiVersion = ""
+		reads = [c.getResourceValue("busy","/3/0/%d" % i) for i in range(1,7)]
+		# both workers are free for other endpoints while five reads wait for the busy one
+		expect(c.getResourceValue("other","/3/0/1").getResult(1)).to.equal(7)
+		expect(c.endpointGateStats()['waiting']).to.equal(5)
+		for i in range(1,7):
+			while "parked-%d" % i not in c.database['async-responses']:
+				time.sleep(0.01)
+			if i < 6:
+				expect(reads[i].isDone()).to.equal(False) # the next read waits for this one
+			c.handler(json.dumps({"async-responses":[{"id":"parked-%d" % i,"status":200,"payload":b64encode(str(i))}]}))
+		expect([r.getResult(1) for r in reads]).to.equal(["1","2","3","4","5","6"])
+		while c.endpointGateStats()['busy']: # released by a done callback, after getResult has returned
+			time.sleep(0.01)
+		stats = c.endpointGateStats()
+		expect((stats['busy'],stats['inFlight'],stats['waiting'],stats['waits'])).to.equal((0,0,0,5))
+		c.shutdown()
+
+	# test that transient statuses are retried, and POST only when allowed
+	@timed(10)
+	def test_retryPolicy(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/",
+								responses=[httpretty.Response(body="",status=503,adding_headers={"Retry-After":"0.05"}),
+											httpretty.Response(body="",status=429),
+											httpretty.Response(body="DeviceServer v3.0.0-520\nREST version = v2",status=200)])
+		httpretty.register_uri(httpretty.POST,"http://mock/endpoints/ep/3/0/1",
+								responses=[httpretty.Response(body="",status=503),
+											httpretty.Response(body="",status=503),
+											httpretty.Response(body="",status=201)])
+		c = mbed_connector_api.connector(token, "http://mock", retry=mbed_connector_api.retryPolicy(baseDelay=0.01))
+		c.apiVersion = ""
+		start = time.time()
+		expect(c.getConnectorVersion().error).to.equal(False)
+		# Retry-After was honoured
+		expect(time.time()-start >= 0.05).to.equal(True)
+		expect(c.retryStats()).to.equal({503:1,429:1})
+		expect(c.postResource("ep","/3/0/1").status_code).to.equal(503)
+		expect(c.retryStats()).to.equal({503:1,429:1})
+		c.setRetryPolicy(mbed_connector_api.retryPolicy(baseDelay=0.01,retryUnsafe=True),verb='post')
+		expect(c.postResource("ep","/3/0/1").status_code).to.equal(201)
+		expect(c.retryStats()).to.equal({503:2,429:1})
+		# attempts run out
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints",body="",status=502)
+		expect(c.getEndpoints().status_code).to.equal(502)
+		expect(c.retryStats()[502]).to.equal(2)
+
+	# test that identical reads in flight share one request and one async-response
+	@timed(10)
+	def test_coalescedReads(self):
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/sleepy/3/0/1"),
+								responses=[httpretty.Response(body=json.dumps({"async-response-id":"shared-1"}),status=202),
+											httpretty.Response(body=json.dumps({"async-response-id":"other-1"}),status=202)])
+		c = mbed_connector_api.connector(token, "http://mock", coalesceReads=True)
+		c.apiVersion = ""
+		called = []
+		results = [c.getResourceValue("sleepy","/3/0/1",cbfn=called.append) for x in range(3)]
+		other = c.getResourceValue("sleepy","/3/0/1",noResp=True)
+		expect(len(httpretty.latest_requests())).to.equal(2)
+		expect(c.coalesceStats()).to.equal({"inFlight":2,"coalesced":2})
+		c.handler(json.dumps({"async-responses":[{"id":"shared-1","status":200,"payload":b64encode("5")}]}))
+		expect([x.getResult(1) for x in results]).to.equal(["5"]*3)
+		expect(sorted(id(x) for x in called)).to.equal(sorted(id(x) for x in results))
+		expect(other.isDone()).to.equal(False)
+		# the next read after the answer is a new request
+		c.getResourceValue("sleepy","/3/0/1")
+		expect(len(httpretty.latest_requests())).to.equal(3)
+
+	# test that writes to a sleeping queue-mode endpoint are held, coalesced and sent when it wakes up
+	@timed(10)
+	def test_queueModeOutbox(self):
+		c = mbed_connector_api.connector(token, "http://mock", queueOutbox=True)
+		c.apiVersion = ""
+		c.handler(json.dumps({"registrations":[{"ep":"qdev","ept":"sensor","q":True,"resources":[]}]}))
+		httpretty.register_uri(httpretty.PUT,"http://mock/endpoints/qdev/3/0/1",body="",status=409)
+		writes = [c.putResourceValue("qdev","/3/0/1",str(x)) for x in range(3)]
+		expect([w.isDone() for w in writes]).to.equal([False]*3)
+		expect(len(httpretty.latest_requests())).to.equal(1)
+		stats = c.outboxStats()
+		expect((stats['asleep'],stats['depth'],stats['held'],stats['coalesced'])).to.equal((1,1,3,2))
+		# reading the resource list changes the directory but does not mean the device is awake
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints/qdev",body=json.dumps([{"uri":"/3/0/1"}]),status=200)
+		expect(c.getResources("qdev").status_code).to.equal(200)
+		expect([x.method for x in httpretty.latest_requests() if x.path.startswith("/endpoints/qdev")]).to.equal(["PUT","GET"])
+		expect(c.outboxStats()['flushes']).to.equal(0)
+		httpretty.register_uri(httpretty.PUT,"http://mock/endpoints/qdev/3/0/1",body="",status=200)
+		c.handler(json.dumps({"reg-updates":[{"ep":"qdev","ept":"sensor","q":True}]}))
+		for w in writes:
+			expect(w.wait(1)).to.equal(True)
+			expect((w.error,w.status_code)).to.equal((False,200))
+		# only the last value was sent
+		expect([x.method for x in httpretty.latest_requests() if x.path.startswith("/endpoints/qdev")]).to.equal(["PUT","GET","PUT"])
+		expect(httpretty.last_request().body).to.equal('"2"')
+		stats = c.outboxStats()
+		expect((stats['asleep'],stats['depth'],stats['flushed'],stats['flushes'])).to.equal((0,0,1,1))
+
+	# test that pre-subscription rules are reduced to a covering set, matched locally and sent as connector's format
+	@timed(10)
+	def test_preSubscriptionRules(self):
+		rules = mbed_connector_api.preSubscriptionRules([
+			("node-1","/3/0/1"),
+			("node-1","/3/0/2"),
+			("node-1","/3/0/*"),
+			("node-*","/3/0/1"),
+			("node-2","/3/0/1"),
+			("node-2","/5/*"),
+			("gw","/1/*","gateway"),
+			("gw","/1/0/1","gateway"),
+			("*","/9/0/0","lamp"),
+			("lamp-*","/9/0/0","lamp"),
+			{"endpoint-name":"node-3","resource-path":["/3/0/1","/5/0/1"]}])
+		expect(rules.rules).to.equal([
+			{"endpoint-type":"lamp","resource-path":["/9/0/0"]},
+			{"endpoint-name":"gw","endpoint-type":"gateway","resource-path":["/1/*"]},
+			{"endpoint-name":"node-*","resource-path":["/3/0/1"]},
+			{"endpoint-name":"node-1","resource-path":["/3/0/*"]},
+			{"endpoint-name":"node-2","resource-path":["/5/*"]},
+			{"endpoint-name":"node-3","resource-path":["/5/0/1"]}])
+		expect(rules.before).to.equal({"rules":11,"pairs":12})
+		expect(rules.after).to.equal({"rules":6,"pairs":6})
+		expect(rules.matches("node-1","/3/0/7")).to.equal(True)
+		expect(rules.matches("node-9","/3/0/1")).to.equal(True)
+		expect(rules.matches("node-9","/3/0/2")).to.equal(False)
+		expect(rules.matches("gw","/1/0/5")).to.equal(False)
+		expect(rules.matches("gw","/1/0/5","gateway")).to.equal(True)
+		expect(rules.matches("anything","/9/0/0","lamp")).to.equal(True)
+		# without a name only rules for any endpoint can match
+		expect(rules.matches(None,"/9/0/0","lamp")).to.equal(True)
+		expect(rules.matches(None,"/3/0/1")).to.equal(False)
+		expect(len(mbed_connector_api.preSubscriptionRules([("a*","/1"),("*","*"),("b","/2","t")]))).to.equal(1)
+		httpretty.register_uri(httpretty.PUT,"http://mock/subscriptions",body="",status=204)
+		expect(self.connector.putPreSubscription(rules).status_code).to.equal(204)
+		expect(json.loads(httpretty.last_request().body)).to.equal(rules.rules)
+
+	# test that concurrent pre-subscription changes are merged with the rules on connector and sent in one PUT
+	@timed(10)
+	def test_incrementalPreSubscriptions(self):
+		c = mbed_connector_api.connector(token, "http://mock", preSubscriptionWindow=0.2)
+		c.apiVersion = ""
+		httpretty.register_uri(httpretty.GET,"http://mock/subscriptions",body=json.dumps([{"endpoint-name":"node-1","resource-path":["/3/0/1"]}]),status=200)
+		httpretty.register_uri(httpretty.PUT,"http://mock/subscriptions",body="",status=204)
+		# other tests' connectors may still be polling, only look at the pre-subscription requests
+		sent = lambda: [x for x in httpretty.latest_requests() if x.path == "/subscriptions"]
+		results = []
+		threads = [threading.Thread(target=lambda r=r: results.append(c.addPreSubscriptions([r]))) for r in [("node-2","/3/0/1"),("node-*","/5/*"),("node-1","/3/0/1")]]
+		[t.start() for t in threads]
+		[t.join() for t in threads]
+		for r in results:
+			expect(r.wait(2)).to.equal(True)
+			expect((r.error,r.status_code)).to.equal((False,204))
+		expect([x.method for x in sent()]).to.equal(["GET","PUT"])
+		expected = [{"endpoint-name":"node-*","resource-path":["/5/*"]},
+					{"endpoint-name":"node-1","resource-path":["/3/0/1"]},
+					{"endpoint-name":"node-2","resource-path":["/3/0/1"]}]
+		expect(json.loads(sent()[-1].body)).to.equal(expected)
+		expect(results[0].result).to.equal(expected)
+		# already covered, nothing is sent
+		r = c.addPreSubscriptions([("node-7","/5/0/1")])
+		expect(r.wait(2)).to.equal(True)
+		expect((r.error,r.status_code,r.result)).to.equal((False,None,expected))
+		# removing the broad rule keeps the narrower one it covered
+		r = c.removePreSubscriptions([{"endpoint-name":"node-*","resource-path":["/5/*"]},("node-2","/3/0/1")])
+		expect(r.wait(2)).to.equal(True)
+		expect(json.loads(sent()[-1].body)).to.equal([{"endpoint-name":"node-1","resource-path":["/3/0/1"]},
+																	{"endpoint-name":"node-7","resource-path":["/5/0/1"]}])
+		expect(len(sent())).to.equal(3)
+		expect(c.preSubscriptionStats()).to.equal({"rules":2,"pending":0,"changes":5,"puts":2,"skipped":1,"failed":0})
+		# a failed PUT keeps the local copy as it was
+		httpretty.register_uri(httpretty.PUT,"http://mock/subscriptions",body="",status=500)
+		r = c.addPreSubscriptions([("node-9","/1")])
+		expect(r.wait(2)).to.equal(True)
+		expect(r.status_code).to.equal(500)
+		expect(r.error).to_not.equal(False)
+		expect(c.preSubscriptionStats()['failed']).to.equal(1)
+		expect(c.preSubscriptionStats()['rules']).to.equal(2)
+
+	# test that API calls, HTTP requests and notification lag are measured and exported as Prometheus text
+	@timed(10)
+	def test_metrics(self):
+		httpretty.register_uri(httpretty.GET,"http://mock/endpoints",body=json.dumps([{"name":"ep-1"}]),status=200)
+		httpretty.register_uri(httpretty.GET,"http://mock/",body="",status=404)
+		self.connector.getEndpoints()
+		self.connector.getEndpoints()
+		self.connector.getConnectorVersion()
+		snapshot = self.connector.metricsSnapshot()
+		expect(snapshot['call_seconds'][('getEndpoints','200')]['count']).to.equal(2)
+		expect(snapshot['call_seconds'][('getConnectorVersion','404')]['count']).to.equal(1)
+		expect(snapshot['http_request_seconds'][('GET','200')]['count']).to.equal(2)
+		expect(snapshot['http_request_seconds'][('GET','404')]['buckets'][-1]).to.equal(('inf',1))
+		expect(snapshot['async_responses_pending']).to.equal(0)
+		expect(snapshot['longpoll_circuit_state']).to.equal(0)
+		# lag from the connector timestamp, in seconds or milliseconds
+		self.connector.handler(json.dumps({"notifications":[{"ep":"ep-1","path":"/3/0/1","payload":b64encode("1"),"timestamp":time.time()-2},
+															{"ep":"ep-1","path":"/3/0/2","payload":b64encode("1"),"timestamp":int(time.time()*1000)},
+															{"ep":"ep-1","path":"/3/0/3","payload":b64encode("1")}]}))
+		lag = self.connector.metricsSnapshot()['notification_lag_seconds'][()]
+		expect(lag['count']).to.equal(2)
+		expect(lag['sum'] >= 2).to.equal(True)
+		text = self.connector.metricsText()
+		expect(text).to.contain('# TYPE mbed_connector_call_seconds histogram')
+		expect(text).to.contain('mbed_connector_call_seconds_count{method="getEndpoints",status="200"} 2')
+		expect(text).to.contain('mbed_connector_http_request_seconds_bucket{verb="GET",status="404",le="+Inf"} 1')
+		expect(text).to.contain('mbed_connector_async_responses_pending 0.0')
+		expect(text).to_not.contain('longpoll_seconds_since_success')
+		c = mbed_connector_api.connector(token, "http://mock", collectMetrics=False)
+		c.apiVersion = ""
+		expect(c.getEndpoints().status_code).to.equal(200)
+		expect(c.metricsSnapshot()).to.equal(None)
+		expect(c.metricsText()).to.equal("")
+
+	# test that readers coalesced onto a request that fails get the same error as its caller
+	@timed(10)
+	def test_coalescedReadFailure(self):
+		c = mbed_connector_api.connector(token, "http://mock", endpointSlots=1, endpointWait=0.5, coalesceReads=True)
+		c.apiVersion = ""
+		httpretty.register_uri(httpretty.GET,re.compile("http://mock/endpoints/busy/3/0/.*"),body=json.dumps({"async-response-id":"busy-1"}),status=202)
+		c.getResourceValue("busy","/3/0/1") # holds the only slot until its async-response
+		raised = []
+		def lead():
+			try:
+				c.getResourceValue("busy","/3/0/2")
+			except mbed_connector_api.connectorException as e:
+				raised.append(e.error)
+		leader = threading.Thread(target=lead)
+		leader.start()
+		while c.coalesceStats()['inFlight'] < 2:
+			time.sleep(0.01)
+		follower = c.getResourceValue("busy","/3/0/2")
+		leader.join()
+		expect(follower.wait(1)).to.equal(True)
+		expect(raised[0].errType).to.equal("endpoint_busy")
+		expect(follower.error.errType).to.equal("endpoint_busy")
+		expect(follower.status_code).to.equal('')
+
+	# test that the app's own writes, deleteEndpoint and de-registrations drop cached values
+	@timed(10)
+	def test_resourceCacheInvalidation(self):
+		notify = lambda ep,path,value: self.connector.handler(json.dumps({"notifications":[{"ep":ep,"path":path,"payload":b64encode(value),"max-age":60}]}))
+		notify("ep1","/3/0/1","old")
+		notify("ep1","/3/0/2","other")
+		httpretty.register_uri(httpretty.PUT,"http://mock/endpoints/ep1/3/0/1",body="",status=200)
+		expect(self.connector.putResourceValue("ep1","/3/0/1","new").error).to.equal(False)
+		expect(self.connector.cache.get("ep1","/3/0/1")).to.equal(None)
+		expect(self.connector.cache.get("ep1","/3/0/2")).to.equal("other")
+		# a failed write leaves the value
+		notify("ep1","/3/0/3","kept")
+		httpretty.register_uri(httpretty.POST,"http://mock/endpoints/ep1/3/0/3",body="",status=404)
+		self.connector.postResource("ep1","/3/0/3","x")
+		expect(self.connector.cache.get("ep1","/3/0/3")).to.equal("kept")
+		# a 202 write drops the value when its async-response arrives
+		httpretty.register_uri(httpretty.POST,"http://mock/endpoints/ep1/3/0/2",body=json.dumps({"async-response-id":"w-1"}),status=202)
+		self.connector.postResource("ep1","/3/0/2","x")
+		expect(self.connector.cache.get("ep1","/3/0/2")).to.equal("other")
+		self.connector.handler(json.dumps({"async-responses":[{"id":"w-1","status":200,"payload":""}]}))
+		expect(self.connector.cache.get("ep1","/3/0/2")).to.equal(None)
+		httpretty.register_uri(httpretty.DELETE,"http://mock/endpoints/ep1",body="",status=200)
+		self.connector.deleteEndpoint("ep1")
+		expect(self.connector.cache.get("ep1","/3/0/3")).to.equal(None)
+		notify("ep2","/3/0/1","a")
+		notify("ep3","/3/0/1","b")
+		self.connector.handler(json.dumps({"de-registrations":["ep2"],"registrations-expired":["ep3"]}))
+		expect((self.connector.cache.get("ep2","/3/0/1"),self.connector.cache.get("ep3","/3/0/1"))).to.equal((None,None))
+
+	# test that unanswered async-responses in every stripe expire from callback notifications, without a long poll
+	@timed(10)
+	def test_asyncExpiryWithoutLongPoll(self):
+		c = mbed_connector_api.connector(token, "http://mock", asyncTimeout=0.2)
+		registry = c.database['async-responses']
+		results = [mbed_connector_api.asyncResult() for x in range(40)]
+		for x,result in enumerate(results):
+			registry["cb-%d" % x] = result
+		expect(registry.sweepDue()).to.equal(0)
+		time.sleep(0.3)
+		c.handler(json.dumps({"notifications":[]}))
+		expect([x.isDone() for x in results]).to.equal([True]*40)
+		expect(set(x.error.errType for x in results)).to.equal(set(["async_timeout"]))
+		expect(len(registry)).to.equal(0)
+
+	# test that the default async-responses handler reuses the events built by handler() instead of wrapping entries again
+	@timed(10)
+	def test_asyncResponseEventsReused(self):
+		module = mbed_connector_api.mbed_connector_api
+		built = []
+		original = module.asyncResponseEvent
+		module.asyncResponseEvent = lambda entry: built.append(entry) or original(entry)
+		try:
+			routed = []
+			self.connector.on('async-responses',cb=routed.append)
+			result = mbed_connector_api.asyncResult()
+			self.connector.database['async-responses']["reuse-1"] = result
+			self.connector.handler(json.dumps({"async-responses":[{"id":"reuse-1","status":200,"payload":b64encode("7")}]}))
+			expect(result.result).to.equal("7")
+			expect(built).to.equal([])
+			expect(routed[0].payload).to.equal("7")
+		finally:
+			module.asyncResponseEvent = original
+
+	# test that async-response timeouts are reported as timeouts and a failing feeder ends the iteration
+	@timed(10)
+	def test_bulkResultFailures(self):
+		def issue(x):
+			if x == 3:
+				raise mbed_connector_api.connectorException(mbed_connector_api.response_codes("rate_limited",""))
+			result = mbed_connector_api.asyncResult()
+			result.error = mbed_connector_api.response_codes("async_timeout","") if x == 1 else False
+			result.is_done = True
+			return result
+		bulk = mbed_connector_api.mbed_connector_api.bulkResult(range(6),issue,concurrency=2)
+		expect(len(list(bulk))).to.equal(3)
+		expect(bulk.summary()).to.equal({"total":6,"successes":2,"errors":3,"timeouts":1,"pending":0})
+		expect(bulk.error.error.errType).to.equal("rate_limited")
+
+	# test that restarting long polling while a pull is in flight leaves exactly one poll loop running
+	@timed(10)
+	def test_asyncConnectorRestartPolling(self):
+		c = mbed_connector_api.asyncConnector(token, "http://mock", workers=4)
+		c.apiVersion=""
+		lock = threading.Lock()
+		running = [0,0,0] # now, most at once, pulls
+		def pull(versioned=True):
+			with lock:
+				running[0] += 1
+				running[1] = max(running[1],running[0])
+				running[2] += 1
+			time.sleep(0.02)
+			with lock:
+				running[0] -= 1
+			return 0
+		c._pollOnce = pull
+		c.startLongPolling()
+		time.sleep(0.01) # first pull in flight
+		c.stopLongPolling()
+		c.startLongPolling()
+		time.sleep(0.1)
+		with lock:
+			running[1] = running[0] # the pull from before the stop has finished, count overlap from here
+		time.sleep(0.1)
+		pulls = running[2]
+		time.sleep(0.1)
+		expect(running[2] > pulls).to.equal(True) # still polling after the restart
+		c.stopLongPolling()
+		time.sleep(0.05)
+		pulls = running[2]
+		time.sleep(0.1)
+		expect(running[2]).to.equal(pulls)
+		expect(running[1]).to.equal(1)
+		c.shutdown()
+
 	# TODO: this test is not working. currently broken
 	@timed(10)
 	def test_getResourceValue(self):
@@ -310,3 +1166,48 @@ class test_connector_mock:
 	#def test_deleteCallbackURL(self):
 	#	#TODO
 	#	return
+
+
+# the receiver needs real sockets, so these tests do not use httpretty
+class test_callbackReceiver:
+
+	def setUp(self):
+		self.connector = mbed_connector_api.connector(token, "http://mock")
+		self.receiver = mbed_connector_api.callbackReceiver(self.connector,host="127.0.0.1",port=0,path="/cb")
+		self.url = self.receiver.start()
+
+	def tearDown(self):
+		self.receiver.stop()
+
+	# test that concurrent deliveries are acknowledged before their callbacks have run
+	@timed(10)
+	def test_concurrentDeliveries(self):
+		seen = []
+		def slow(data):
+			time.sleep(0.02)
+			seen.append(data['notifications'][0]['path'])
+		self.connector.setHandler('notifications',slow)
+		statuses = []
+		def post(x):
+			body = json.dumps({"notifications":[{"ep":"ep","path":"/3/0/%d"%x,"payload":b64encode(str(x))}]})
+			statuses.append(requests.put(self.url,data=body).status_code)
+		threads = [threading.Thread(target=post,args=(x,)) for x in range(8)]
+		start = time.time()
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		expect(statuses).to.equal([204]*8)
+		# all eight were acknowledged in less time than it takes to run their callbacks one after another
+		expect(time.time()-start < 0.16).to.equal(True)
+		self.receiver.stop()
+		expect(sorted(seen)).to.equal(sorted("/3/0/%d"%x for x in range(8)))
+		stats = self.receiver.stats()
+		expect((stats['received'],stats['processed'],stats['rejected'],stats['queued'])).to.equal((8,8,0,0))
+		expect(stats['maxProcessing'] >= 0.02).to.equal(True)
+		expect(stats['maxAck'] < stats['maxProcessing']).to.equal(True)
+
+	# test that other methods and paths are refused
+	def test_rejectsOtherRequests(self):
+		expect(requests.get(self.url).status_code).to.equal(405)
+		expect(requests.put(self.url+"x",data="{}").status_code).to.equal(404)
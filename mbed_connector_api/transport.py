@@ -0,0 +1,102 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import requests as r
+from requests.adapters import HTTPAdapter
+
+class transport:
+	"""
+	Pooled, keep-alive HTTP transport owned by a :class:`.connector` instance.
+	All REST calls share one ``requests.Session`` so TCP / TLS connections are
+	reused between calls instead of being set up for every request.
+
+	:var session: ``requests.Session`` used for all requests
+	:var token: None, or a function returning the bearer token. It is read before every request and the
+		``Authorization`` header is rebuilt when the token has changed
+	"""
+
+	def setToken(self,token):
+		"""
+		Set the bearer token sent in the default ``Authorization`` header.
+
+		:param str token: API token
+		:return: none
+		"""
+		self.session.headers["Authorization"] = "Bearer "+token
+		self._token = token
+
+	def request(self,method,url,**kwargs):
+		"""
+		Make a request through the connection pool. Accepts the same keyword arguments as ``requests.request``.
+
+		:param str method: HTTP verb
+		:param str url: complete url to hit
+		:return: response object
+		:rtype: requests.Response
+		"""
+		if self.token is not None:
+			token = self.token()
+			if token != self._token:
+				self.setToken(token)
+		return self.session.request(method,url,**kwargs)
+
+	def get(self,url,**kwargs):
+		return self.request("GET",url,**kwargs)
+
+	def put(self,url,**kwargs):
+		return self.request("PUT",url,**kwargs)
+
+	def post(self,url,**kwargs):
+		return self.request("POST",url,**kwargs)
+
+	def delete(self,url,**kwargs):
+		return self.request("DELETE",url,**kwargs)
+
+	def stats(self):
+		"""
+		Connection pool statistics. A hit is a request served over an already open connection,
+		a miss is a request that had to open a new connection.
+
+		:return: dictionary with ``requests``, ``hits``, ``misses`` and ``pools`` counts
+		:rtype: dict
+		"""
+		requests = 0
+		misses = 0
+		pools = self._adapter.poolmanager.pools
+		for key in pools.keys():
+			try:
+				pool = pools[key]
+			except KeyError: # pool was evicted while we were looking at it
+				continue
+			requests += pool.num_requests
+			misses += pool.num_connections
+		return {"requests":requests,
+				"hits":max(requests-misses,0),
+				"misses":misses,
+				"pools":len(pools),
+				"poolSize":self.poolSize}
+
+	def close(self):
+		"""
+		Close all pooled connections.
+
+		:return: none
+		"""
+		self.session.close()
+
+	def __init__(self,token,poolSize=10,poolConnections=10):
+		'''
+		:param token: API token, or a function returning it when the token may change
+		:param int poolSize: Optional - connections kept open per host
+		:param int poolConnections: Optional - number of hosts to keep pools for
+		'''
+		self.poolSize = poolSize
+		self.token = token if callable(token) else None
+		self.session = r.Session()
+		# poolConnections is the number of hosts to keep pools for, poolSize the connections kept per host
+		self._adapter = HTTPAdapter(pool_connections=poolConnections,pool_maxsize=poolSize)
+		self.session.mount("https://",self._adapter)
+		self.session.mount("http://",self._adapter)
+		self.session.headers.update({"Connection":"keep-alive"})
+		self.setToken(self.token() if self.token is not None else token)
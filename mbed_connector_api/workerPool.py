@@ -0,0 +1,77 @@
+# Copyright 2014-2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0
+# See LICENSE file for details.
+import threading
+import Queue
+import sys
+import traceback
+import logging
+
+class workerPool:
+	"""
+	Small bounded thread pool used to run blocking REST calls off the calling thread.
+	Exposes the same ``submit(fn, *args, **kwargs)`` entry point as a ``concurrent.futures`` executor.
+
+	:var workers: number of worker threads
+	"""
+
+	def submit(self,fn,*args,**kwargs):
+		"""
+		Queue ``fn(*args, **kwargs)`` to run on a worker thread. Blocks if the work queue is full.
+
+		:param fnptr fn: function to run
+		:return: none
+		"""
+		if self._shutdown.is_set():
+			raise RuntimeError("cannot submit work to a workerPool that has been shut down")
+		self._queue.put((fn,args,kwargs))
+
+	def pending(self):
+		"""
+		:returns: number of queued tasks not yet picked up by a worker
+		:rtype: int
+		"""
+		return self._queue.qsize()
+
+	def shutdown(self,wait=True):
+		"""
+		Stop the worker threads once the queued work has been run.
+
+		:param bool wait: Optional - block until all workers have exited
+		:return: none
+		"""
+		self._shutdown.set()
+		for t in self._threads:
+			self._queue.put(None)
+		if wait:
+			for t in self._threads:
+				t.join()
+
+	# worker thread, run tasks until a None sentinel is pulled from the queue
+	def _work(self):
+		while True:
+			task = self._queue.get()
+			if task is None:
+				return
+			fn,args,kwargs = task
+			try:
+				fn(*args,**kwargs)
+			except:
+				self.log.error("workerPool task threw an exception")
+				ex_type, ex, tb = sys.exc_info()
+				traceback.print_tb(tb)
+				self.log.error(sys.exc_info())
+				del tb
+
+	def __init__(self,workers=8,maxQueue=0,name="mdc-api-worker"):
+		self.workers = workers
+		self.log = logging.getLogger(name="mdc-api-logger")
+		self._queue = Queue.Queue(maxsize=maxQueue) # 0 means unbounded
+		self._shutdown = threading.Event()
+		self._threads = []
+		for x in range(workers):
+			t = threading.Thread(target=self._work,name=name+"-"+str(x))
+			t.daemon = True # exit with the overall process, same as the longpoll thread
+			t.start()
+			self._threads.append(t)
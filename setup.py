@@ -12,6 +12,9 @@ setup(name='mbed_connector_api',
       install_requires=[
           'requests[security]',
       ],
+      extras_require={
+          'fastjson': ['ujson'],
+      },
       classifiers=[
         'Development Status :: 3 - Alpha',
         'License :: OSI Approved :: Apache Software License',